@@ -0,0 +1,144 @@
+"""Flask与ASGI两种服务模式共用的请求解析和查询逻辑
+
+这里的函数不依赖具体的Web框架：参数错误抛出ValueError（由调用方转换为400响应）。
+"""
+
+import re
+import time
+from datetime import datetime, timezone
+from database import get_recent_data_json, get_telemetry, get_telemetry_buckets
+import codec
+import config
+from metrics import registry
+
+HTTP_REQUESTS = registry.counter('smarthome_http_requests_total', 'HTTP请求数', ['method', 'route', 'status'])
+HTTP_SECONDS = registry.histogram('smarthome_http_request_seconds', 'HTTP请求处理耗时（流式响应为返回响应头之前的时间）',
+                                  ['method', 'route'])
+
+# 时间桶单位（秒）
+BUCKET_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+# 单次聚合查询最多返回的时间桶数
+MAX_BUCKETS = 5000
+# /api/data单次最多返回的记录数
+MAX_LIMIT = 10000
+
+def parse_bucket(value):
+    """解析时间桶参数，如 10s、1m、1h、1d，返回秒数"""
+    match = re.fullmatch(r'(\d+)([smhd])', value.strip())
+    if not match or int(match.group(1)) <= 0:
+        raise ValueError(f'无效的时间桶参数: {value}')
+    return int(match.group(1)) * BUCKET_UNITS[match.group(2)]
+
+def parse_time(value):
+    """解析时间参数，支持Unix时间戳和ISO 8601格式（无时区时按UTC处理）"""
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        moment = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError(f'无效的时间参数: {value}') from None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+def query_data(args):
+    """处理/api/data的查询参数，返回JSON响应正文
+
+    不带查询条件时返回最近的limit条原始记录；带device/metric/from/to时按条件查询时序数据，
+    再带bucket（如1m、1h）时返回在SQL中按时间桶聚合的min/avg/max。
+    """
+    limit = args.get('limit')
+    limit = int(limit) if limit else None
+    # SQLite中LIMIT为负数表示不限制，不能直接传入
+    if limit is not None and not 0 < limit <= MAX_LIMIT:
+        raise ValueError(f'limit必须在1-{MAX_LIMIT}之间')
+    device = args.get('device')
+    metric = args.get('metric')
+    start = args.get('from')
+    end = args.get('to')
+    bucket = args.get('bucket')
+
+    if not any([device, metric, start, end, bucket]):
+        # 保存的原始数据直接拼接进响应，不重新解析
+        return '{"data":' + get_recent_data_json(limit or 10) + '}'
+
+    end = parse_time(end) if end else time.time()
+    start = parse_time(start) if start else end - 86400
+    if start >= end:
+        raise ValueError('from必须早于to')
+
+    if bucket:
+        bucket_seconds = parse_bucket(bucket)
+        if (end - start) / bucket_seconds > MAX_BUCKETS:
+            raise ValueError(f'时间桶数量超过上限{MAX_BUCKETS}，请增大bucket或缩小时间范围')
+        source, series = get_telemetry_buckets(device, metric, start, end, bucket_seconds)
+        return codec.dumps({
+            'from': start,
+            'to': end,
+            'bucket': bucket_seconds,
+            'source': source,
+            'columns': ['ts', 'min', 'avg', 'max', 'count'],
+            'series': series
+        })
+
+    if not device:
+        raise ValueError('查询原始时序数据时device不能为空')
+    data = get_telemetry(device, metric, start, end, limit or 1000)
+    return codec.dumps({'from': start, 'to': end, 'data': data})
+
+def query_serial_logs(args, store):
+    """处理/api/serial/logs的查询参数，返回JSON响应正文
+
+    port或device选择串口（不指定时查询全部串口），from/to为时间范围（默认最近default_window秒），
+    pattern为正则表达式，limit为最多返回的行数。
+    """
+    limit = int(args.get('limit') or 1000)
+    if not 0 < limit <= config.SERIAL_LOG_CONFIG['max_lines']:
+        raise ValueError(f"limit必须在1-{config.SERIAL_LOG_CONFIG['max_lines']}之间")
+    end = parse_time(args.get('to')) if args.get('to') else None
+    start = parse_time(args.get('from')) if args.get('from') else None
+    if start is not None and end is not None and start >= end:
+        raise ValueError('from必须早于to')
+    pattern = args.get('pattern')
+    if pattern:
+        try:
+            re.compile(pattern)
+        except re.error as e:
+            raise ValueError(f'无效的正则表达式: {e}') from None
+
+    result = store.query(port=args.get('port'), device=args.get('device'), start=start, end=end,
+                         pattern=pattern, limit=limit)
+    return codec.dumps(result)
+
+def observe_request(method, route, status, elapsed):
+    """记录一个HTTP请求的指标；route为路由规则（未匹配的路径记为unmatched），避免按具体路径产生大量指标"""
+    HTTP_SECONDS.labels(method, route).observe(elapsed)
+    HTTP_REQUESTS.labels(method, route, status).inc()
+
+def build_bulk_messages(data):
+    """解析批量发布请求，返回 [(主题, 负载, QoS, retain), ...]
+
+    messages为 [{topic, payload, qos, retain}, ...]；
+    relays为继电器控制命令的简写 [{device, relay, state}, ...]，
+    会转换为发往 mySmartHome/relay/<device>/control 的消息。
+    """
+    messages = []
+    for item in data.get('messages', []):
+        messages.append((item.get('topic'), item.get('payload'), item.get('qos'), bool(item.get('retain'))))
+    for item in data.get('relays', []):
+        topic = f"mySmartHome/relay/{item.get('device')}/control"
+        payload = {'relay': item.get('relay'), 'state': bool(item.get('state'))}
+        messages.append((topic if item.get('device') else None, payload, item.get('qos'), False))
+
+    if not messages:
+        raise ValueError('没有要发布的消息')
+    if len(messages) > config.PUBLISH_CONFIG['max_bulk']:
+        raise ValueError(f"单次最多发布{config.PUBLISH_CONFIG['max_bulk']}条消息")
+    for topic, _, qos, _ in messages:
+        if not topic or '+' in topic or '#' in topic:
+            raise ValueError(f'无效的主题: {topic}')
+        if qos is not None and qos not in (0, 1, 2):
+            raise ValueError(f'无效的QoS: {qos}')
+    return messages
@@ -1,36 +1,68 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 from flask_cors import CORS
-from mqtt_handler import client as mqtt_client
-from database import get_recent_data, init_db, register_user, verify_user, update_user_password
+import mqtt_handler
+from mqtt_handler import (mqtt_publisher, live_stream, device_states, data_tail,
+                          warm_state_cache, is_http_role)
+from database import init_db, register_user, verify_user, update_user_password, get_service_status
+from api_common import build_bulk_messages, observe_request, query_data, query_serial_logs
+from stream import format_sse
+from token_store import create_token_store
+import metrics
+import log
 import config
 import json
+import serial
+import time
+from concurrent.futures import TimeoutError as FuturesTimeoutError
 from functools import wraps
 
+# 日志由后台线程写出，级别、采样和限速见LOG_CONFIG
+log.setup()
+logger = log.get_logger('http')
+
 app = Flask(__name__)
 CORS(app)  # 允许跨域请求
 
+# 记录每个请求的耗时和状态码
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    start = g.get('request_start')
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        observe_request(request.method, route, response.status_code, time.perf_counter() - start)
+    return response
+
 # 初始化数据库
 init_db()
 
-# 启动MQTT客户端循环
-mqtt_client.loop_start()
+# 用数据库中的最新数据预热设备状态缓存
+warm_state_cache()
 
-# 简单的令牌存储（实际生产环境应使用更安全的方式，如JWT）
-active_tokens = {}
+# 连接MQTT代理并启动客户端循环（HTTP工作进程只发布，不订阅）
+mqtt_handler.start()
+
+# 登录令牌存储（带过期时间；多个HTTP工作进程之间必须通过SQLite共享）
+token_store = create_token_store('sqlite' if is_http_role() else None)
 
 def token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
-        token = request.headers.get('Authorization')
+        # 浏览器的EventSource无法设置请求头，允许通过token参数传递
+        token = request.headers.get('Authorization') or request.args.get('token')
         
         if not token:
             return jsonify({'status': 'error', 'message': '缺少认证令牌'}), 401
             
-        if token not in active_tokens:
+        user = token_store.get(token)
+        if user is None:
             return jsonify({'status': 'error', 'message': '无效或过期的令牌'}), 401
             
         # 将用户信息添加到请求中
-        request.user = active_tokens[token]
+        request.user = user
         return f(*args, **kwargs)
     return decorated
 
@@ -70,15 +102,13 @@ def login():
         success, result = verify_user(username, password)
         
         if success:
-            # 生成简单的令牌（实际应使用JWT）
-            import uuid
-            token = str(uuid.uuid4())
-            active_tokens[token] = result
+            token = token_store.issue(result)
             
             return jsonify({
                 'status': 'success', 
                 'message': '登录成功',
                 'token': token,
+                'expires_in': token_store.ttl,
                 'user': {
                     'id': result['id'],
                     'username': result['username']
@@ -94,18 +124,101 @@ def login():
 @token_required
 def logout():
     """用户登出API接口"""
-    token = request.headers.get('Authorization')
-    if token in active_tokens:
-        del active_tokens[token]
+    token = request.headers.get('Authorization') or request.args.get('token')
+    token_store.revoke(token)
     return jsonify({'status': 'success', 'message': '登出成功'})
 
 @app.route('/api/data', methods=['GET'])
 @token_required
 def get_data():
-    """获取存储的数据API接口（需要认证）"""
-    limit = request.args.get('limit', 10, type=int)
-    data = get_recent_data(limit)
-    return jsonify({'data': data})
+    """获取存储的数据API接口（需要认证）
+
+    不带查询条件时返回最近的limit条原始记录；带device/metric/from/to时按条件查询时序数据，
+    再带bucket（如1m、1h）时返回在SQL中按时间桶聚合的min/avg/max。
+    """
+    try:
+        return Response(query_data(request.args), mimetype='application/json')
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+@app.route('/api/devices/state', methods=['GET'])
+@token_required
+def devices_state():
+    """获取设备最新状态API接口（需要认证，直接读取内存缓存，支持ETag）"""
+    device = request.args.get('device')
+    if device:
+        # 先检查设备是否存在：不存在的设备没有版本，If-None-Match: *等条件不能让它返回304
+        state, etag = device_states.get_with_etag(device)
+        if state is None:
+            return jsonify({'status': 'error', 'message': '设备不存在'}), 404
+        if request.if_none_match.contains_weak(etag.strip('"')):
+            return Response(status=304, headers={'ETag': etag})
+        response = jsonify(state)
+    else:
+        etag = device_states.etag()
+        if request.if_none_match.contains_weak(etag.strip('"')):
+            return Response(status=304, headers={'ETag': etag})
+        body, etag = device_states.to_json()
+        response = Response(body, mimetype='application/json')
+
+    response.headers['ETag'] = etag
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/api/stream', methods=['GET'])
+@token_required
+def stream_data():
+    """实时数据推送API接口（Server-Sent Events，需要认证）
+
+    参数topic（支持+/#通配符）和device用于过滤消息；
+    断线重连时浏览器会带上Last-Event-ID请求头，也可以用last_id参数指定从哪条消息之后继续。
+    """
+    topic = request.args.get('topic')
+    device = request.args.get('device')
+    last_id = request.headers.get('Last-Event-ID') or request.args.get('last_id')
+    try:
+        last_id = int(last_id) if last_id else None
+    except ValueError:
+        return jsonify({'status': 'error', 'message': '无效的last_id'}), 400
+
+    subscriber = live_stream.subscribe(topic, device, last_id)
+    heartbeat = config.STREAM_CONFIG['heartbeat']
+
+    def generate():
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                events = subscriber.get(timeout=heartbeat)
+                yield format_sse(events) if events else ': ping\n\n'
+        finally:
+            live_stream.unsubscribe(subscriber)
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@app.route('/api/ingest/stats', methods=['GET'])
+@token_required
+def ingest_stats():
+    """获取数据写入流水线统计API接口（需要认证）"""
+    if is_http_role():
+        # 写入流水线在写入进程中运行，读取其定期保存的状态
+        status = get_service_status('ingest')
+        return jsonify({
+            'status': 'success',
+            'stats': status['data'] if status else None,
+            'stats_updated_at': status['updated_at'] if status else None,
+            'stream': live_stream.stats(),
+            'tail': data_tail.stats(),
+            'publish': mqtt_publisher.stats()
+        })
+    return jsonify({
+        'status': 'success',
+        'stats': mqtt_handler.ingest_stats(),
+        'stream': live_stream.stats(),
+        'publish': mqtt_publisher.stats()
+    })
 
 @app.route('/api/user/update-password', methods=['POST'])
 @token_required
@@ -131,7 +244,7 @@ def update_password():
             return jsonify({'status': 'error', 'message': message}), 401
             
     except Exception as e:
-        print(f"[DEBUG] Error updating password: {str(e)}")  # 添加异常日志
+        logger.error("Error updating password", extra={'error': str(e)})
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
 @app.route('/api/publish', methods=['POST'])
@@ -141,50 +254,132 @@ def publish_data():
     try:
         data = request.get_json()
         topic = config.MQTT_CONFIG['topic_publish']
+        qos = request.args.get('qos', type=int)
         
-        print(f"[DEBUG] Received data from frontend: {data}")  # 添加调试日志
+        logger.debug("Received data from frontend", extra={'data': data})
         
-        # 发布消息到MQTT
-        result = mqtt_client.publish(topic, json.dumps(data))
+        # 放入发布队列，并等待代理确认
+        future = mqtt_publisher.publish(topic, json.dumps(data), qos)
+        try:
+            mid = future.result(timeout=config.PUBLISH_CONFIG['wait_timeout'])
+        except FuturesTimeoutError:
+            # 与代理断开时消息留在缓冲区中，重新连接后发送
+            logger.info("Data queued for MQTT, waiting for broker")
+            return jsonify({'status': 'pending', 'message': 'Data queued'}), 202
         
-        if result[0] == 0:
-            print("[DEBUG] Data successfully published to MQTT")  # 添加成功日志
-            return jsonify({'status': 'success', 'message': 'Data published'})
-        else:
-            print(f"[DEBUG] Failed to publish data to MQTT, return code: {result[0]}")  # 添加失败日志
-            return jsonify({'status': 'error', 'message': 'Failed to publish'}), 500
+        logger.debug("Data successfully published to MQTT", extra={'mid': mid})
+        return jsonify({'status': 'success', 'message': 'Data published', 'mid': mid})
             
     except Exception as e:
-        print(f"[DEBUG] Error processing publish request: {str(e)}")  # 添加异常日志
+        logger.error("Error processing publish request", extra={'error': str(e)})
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+@app.route('/api/publish/bulk', methods=['POST'])
+@token_required
+def publish_bulk():
+    """批量发布MQTT消息API接口（需要认证）
+
+    请求体中的messages为 [{topic, payload, qos, retain}, ...]；
+    relays为继电器控制命令的简写 [{device, relay, state}, ...]，
+    会转换为发往 mySmartHome/relay/<device>/control 的消息。
+    """
+    try:
+        try:
+            messages = build_bulk_messages(request.get_json() or {})
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+
+        # 先全部放入发布队列，再统一等待结果
+        futures = []
+        for topic, payload, qos, retain in messages:
+            if not isinstance(payload, (str, bytes)):
+                payload = json.dumps(payload)
+            futures.append(mqtt_publisher.publish(topic, payload, qos, retain))
+
+        deadline = time.monotonic() + config.PUBLISH_CONFIG['wait_timeout']
+        results = []
+        summary = {'delivered': 0, 'pending': 0, 'failed': 0}
+        for (topic, _, _, _), future in zip(messages, futures):
+            try:
+                mid = future.result(timeout=max(0, deadline - time.monotonic()))
+                results.append({'topic': topic, 'status': 'delivered', 'mid': mid})
+                summary['delivered'] += 1
+            except FuturesTimeoutError:
+                results.append({'topic': topic, 'status': 'pending'})
+                summary['pending'] += 1
+            except Exception as e:
+                results.append({'topic': topic, 'status': 'failed', 'message': str(e)})
+                summary['failed'] += 1
+
+        status = 'success' if summary['delivered'] == len(messages) else 'partial'
+        return jsonify({'status': status, 'summary': summary, 'results': results})
+
+    except Exception as e:
+        logger.error("Error processing bulk publish request", extra={'error': str(e)})
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
 @app.route('/api/debug/serial', methods=['POST'])
 @token_required
 def serial_debug():
-    """串口调试API接口（需要认证）"""
+    """串口调试API接口（需要认证）
+
+    把命令发送到设备串口，返回设备的实际输出；complete表示响应结束的原因（match/prompt/idle/timeout）。
+    """
     try:
         data = request.get_json()
         command = data.get('command')
+        timeout = data.get('timeout')
         
         if not command:
             return jsonify({'status': 'error', 'message': '命令不能为空'}), 400
         
-        print(f"[DEBUG] Serial debug command: {command}")
+        logger.info("Serial debug command", extra={'command': command})
         
-        # 这里可以添加串口通信逻辑
-        # 暂时模拟响应
-        response = f"执行命令: {command}\\n响应: OK"
+        future = mqtt_handler.request_serial_command(command, timeout, data.get('device'))
+        wait = (timeout or config.SERIAL_CONFIG['command_timeout']) + config.PUBLISH_CONFIG['wait_timeout']
+        try:
+            result = future.result(timeout=wait)
+        except FuturesTimeoutError:
+            mqtt_handler.cancel_serial_request(future)
+            return jsonify({'status': 'error', 'message': '等待串口响应超时'}), 504
+        except serial.SerialException as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 503
+        if result.get('error'):
+            return jsonify({'status': 'error', 'message': result['error']}), 503
         
         return jsonify({
             'status': 'success', 
             'message': '命令执行成功',
-            'response': response
+            'response': result['response'],
+            'lines': result['lines'],
+            'complete': result['complete'],
+            'elapsed': result['elapsed'],
+            'device': result['device']
         })
             
     except Exception as e:
-        print(f"[DEBUG] Error processing serial debug: {str(e)}")
+        logger.error("Error processing serial debug", extra={'error': str(e)})
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
+@app.route('/api/serial/logs', methods=['GET'])
+@token_required
+def serial_logs():
+    """查询串口日志API接口（需要认证）
+
+    按port/device、from/to和正则表达式pattern返回串口输出行，只解压与时间范围重叠的日志块。
+    """
+    try:
+        return Response(query_serial_logs(request.args, mqtt_handler.serial_log), mimetype='application/json')
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus指标接口（不需要认证，应只对监控系统开放）"""
+    if not config.METRICS_CONFIG['enabled']:
+        return jsonify({'status': 'error', 'message': 'Not Found'}), 404
+    return Response(metrics.registry.expose(), mimetype=metrics.CONTENT_TYPE)
+
 if __name__ == '__main__':
     app.run(
         host=config.WEB_SERVER_CONFIG['host'],
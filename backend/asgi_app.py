@@ -0,0 +1,484 @@
+"""ASGI服务模式：HTTP请求和MQTT客户端共用同一个asyncio事件循环
+
+与app.py提供相同的API接口。MQTT套接字由事件循环直接驱动（不再使用loop_start()线程），
+SSE连接是协程而不是占用一个线程；SQLite访问和密码哈希等阻塞调用放到线程池中执行。
+
+运行方式（需要安装uvicorn）：
+    python asgi_app.py
+或：
+    uvicorn asgi_app:app --host 0.0.0.0 --port 5000
+"""
+
+import asyncio
+import json
+import serial
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from urllib.parse import parse_qs
+import mqtt_handler
+from mqtt_handler import (mqtt_publisher, ingest_pipeline, retention_worker, live_stream, device_states,
+                          data_tail, consumer_group, is_http_role, uses_consumer_group)
+from mqtt_asyncio import AsyncioMqttLoop
+from database import init_db, register_user, verify_user, update_user_password, get_service_status
+from api_common import build_bulk_messages, observe_request, query_data, query_serial_logs
+from stream import format_sse
+from token_store import SqliteTokenStore, create_token_store
+import codec
+import config
+import metrics
+import log
+
+# 日志由后台线程写出，级别、采样和限速见LOG_CONFIG
+log.setup()
+logger = log.get_logger('http')
+
+# 数据库等阻塞操作使用的线程池
+db_executor = ThreadPoolExecutor(max_workers=config.ASGI_CONFIG['db_workers'], thread_name_prefix='asgi-db')
+
+# 登录令牌存储（多个HTTP工作进程之间必须通过SQLite共享）
+token_store = create_token_store('sqlite' if is_http_role() else None)
+
+# 路由表：(方法, 路径) -> (处理函数, 是否需要认证)
+routes = {}
+
+CORS_HEADERS = [
+    (b'access-control-allow-origin', b'*'),
+    (b'access-control-allow-headers', b'Authorization, Content-Type, Last-Event-ID'),
+    (b'access-control-allow-methods', b'GET, POST, OPTIONS'),
+]
+
+class Request:
+    """一次HTTP请求"""
+
+    def __init__(self, scope, body):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.args = {key: values[0] for key, values in
+                     parse_qs(scope.get('query_string', b'').decode('latin-1')).items()}
+        self.headers = {name.decode('latin-1').lower(): value.decode('latin-1')
+                        for name, value in scope.get('headers', [])}
+        self.body = body
+        self.user = None
+
+    def get_json(self):
+        """解析JSON请求体，格式错误时返回None"""
+        try:
+            return codec.loads(self.body) if self.body else None
+        except ValueError:
+            return None
+
+    @property
+    def token(self):
+        return self.headers.get('authorization') or self.args.get('token')
+
+class Response:
+    """HTTP响应"""
+
+    def __init__(self, body=b'', status=200, content_type='application/json', headers=None):
+        self.body = body.encode() if isinstance(body, str) else body
+        self.status = status
+        self.headers = [(b'content-type', content_type.encode())] + CORS_HEADERS
+        for name, value in (headers or {}).items():
+            self.headers.append((name.lower().encode(), value.encode()))
+
+class StreamResponse:
+    """SSE流式响应，events为异步生成器"""
+
+    def __init__(self, events, headers=None):
+        self.events = events
+        self.status = 200
+        self.headers = [(b'content-type', b'text/event-stream')] + CORS_HEADERS
+        for name, value in (headers or {}).items():
+            self.headers.append((name.lower().encode(), value.encode()))
+
+def jsonify(data, status=200, headers=None):
+    return Response(codec.dumps(data), status, headers=headers)
+
+def error(message, status):
+    return jsonify({'status': 'error', 'message': message}, status)
+
+def route(path, method='GET', auth=True):
+    """注册路由"""
+    def decorator(handler):
+        routes[(method, path)] = (handler, auth)
+        return handler
+    return decorator
+
+async def run_blocking(func, *args):
+    """在数据库线程池中执行阻塞调用"""
+    return await asyncio.get_running_loop().run_in_executor(db_executor, partial(func, *args))
+
+async def call_token_store(method, *args):
+    """调用令牌存储：SQLite存储需要访问数据库，放到线程池中执行；内存存储直接在事件循环中调用"""
+    if isinstance(token_store, SqliteTokenStore):
+        return await run_blocking(method, *args)
+    return method(*args)
+
+@route('/api/register', 'POST', auth=False)
+async def register(request):
+    """用户注册API接口"""
+    data = request.get_json() or {}
+    username = data.get('username')
+    password = data.get('password')
+    if not username or not password:
+        return error('用户名和密码不能为空', 400)
+
+    success, message = await run_blocking(register_user, username, password, data.get('email'))
+    if success:
+        return jsonify({'status': 'success', 'message': message})
+    return error(message, 400)
+
+@route('/api/login', 'POST', auth=False)
+async def login(request):
+    """用户登录API接口"""
+    data = request.get_json() or {}
+    username = data.get('username')
+    password = data.get('password')
+    if not username or not password:
+        return error('用户名和密码不能为空', 400)
+
+    success, result = await run_blocking(verify_user, username, password)
+    if not success:
+        return error(result, 401)
+
+    token = await call_token_store(token_store.issue, result)
+    return jsonify({
+        'status': 'success',
+        'message': '登录成功',
+        'token': token,
+        'expires_in': token_store.ttl,
+        'user': {
+            'id': result['id'],
+            'username': result['username']
+        }
+    })
+
+@route('/api/logout', 'POST')
+async def logout(request):
+    """用户登出API接口"""
+    await call_token_store(token_store.revoke, request.token)
+    return jsonify({'status': 'success', 'message': '登出成功'})
+
+@route('/api/data')
+async def get_data(request):
+    """获取存储的数据API接口（需要认证）"""
+    try:
+        return Response(await run_blocking(query_data, request.args))
+    except ValueError as e:
+        return error(str(e), 400)
+
+@route('/api/devices/state')
+async def devices_state(request):
+    """获取设备最新状态API接口（需要认证，直接读取内存缓存，支持ETag）"""
+    device = request.args.get('device')
+    if_none_match = request.headers.get('if-none-match', '')
+    if device:
+        # 先检查设备是否存在：不存在的设备没有版本，If-None-Match: *等条件不能让它返回304
+        state, etag = device_states.get_with_etag(device)
+        if state is None:
+            return error('设备不存在', 404)
+    else:
+        etag = device_states.etag()
+    # If-None-Match使用弱比较：忽略W/前缀，*匹配任意版本
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    if '*' in tags or etag in [tag[2:] if tag.startswith('W/') else tag for tag in tags]:
+        return Response(status=304, headers={'ETag': etag})
+
+    if device:
+        body = codec.dumps(state)
+    else:
+        body, etag = device_states.to_json()
+    return Response(body, headers={'ETag': etag, 'Cache-Control': 'no-cache'})
+
+@route('/api/stream')
+async def stream_data(request):
+    """实时数据推送API接口（Server-Sent Events，需要认证）"""
+    last_id = request.headers.get('last-event-id') or request.args.get('last_id')
+    try:
+        last_id = int(last_id) if last_id else None
+    except ValueError:
+        return error('无效的last_id', 400)
+
+    loop = asyncio.get_running_loop()
+    wakeup = asyncio.Event()
+
+    def notify():
+        # MQTT消息在事件循环中分发时直接唤醒，其他线程中分发时切换到事件循环线程
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            wakeup.set()
+        else:
+            loop.call_soon_threadsafe(wakeup.set)
+
+    subscriber = live_stream.subscribe(request.args.get('topic'), request.args.get('device'), last_id,
+                                       notify=notify)
+    heartbeat = config.STREAM_CONFIG['heartbeat']
+
+    async def events():
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                if not subscriber.buffer:
+                    try:
+                        await asyncio.wait_for(wakeup.wait(), heartbeat)
+                    except asyncio.TimeoutError:
+                        pass
+                wakeup.clear()
+                batch = subscriber.drain()
+                yield format_sse(batch) if batch else ': ping\n\n'
+        finally:
+            live_stream.unsubscribe(subscriber)
+
+    return StreamResponse(events(), headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@route('/api/ingest/stats')
+async def ingest_stats(request):
+    """获取数据写入流水线统计API接口（需要认证）"""
+    if is_http_role():
+        status = await run_blocking(get_service_status, 'ingest')
+        return jsonify({
+            'status': 'success',
+            'stats': status['data'] if status else None,
+            'stats_updated_at': status['updated_at'] if status else None,
+            'stream': live_stream.stats(),
+            'tail': data_tail.stats(),
+            'publish': mqtt_publisher.stats()
+        })
+    return jsonify({
+        'status': 'success',
+        'stats': mqtt_handler.ingest_stats(),
+        'stream': live_stream.stats(),
+        'publish': mqtt_publisher.stats()
+    })
+
+@route('/api/user/update-password', 'POST')
+async def update_password(request):
+    """更新用户密码API接口（需要认证）"""
+    data = request.get_json() or {}
+    current_password = data.get('currentPassword')
+    new_password = data.get('newPassword')
+    if not current_password or not new_password:
+        return error('当前密码和新密码不能为空', 400)
+
+    success, message = await run_blocking(update_user_password, request.user['id'],
+                                          current_password, new_password)
+    if success:
+        return jsonify({'status': 'success', 'message': message})
+    return error(message, 401)
+
+@route('/api/publish', 'POST')
+async def publish_data(request):
+    """发布数据到MQTT主题API接口（需要认证）"""
+    qos = request.args.get('qos')
+    future = mqtt_publisher.publish(config.MQTT_CONFIG['topic_publish'], json.dumps(request.get_json()),
+                                    int(qos) if qos else None)
+    try:
+        mid = await asyncio.wait_for(asyncio.wrap_future(future), config.PUBLISH_CONFIG['wait_timeout'])
+    except asyncio.TimeoutError:
+        return jsonify({'status': 'pending', 'message': 'Data queued'}, 202)
+    return jsonify({'status': 'success', 'message': 'Data published', 'mid': mid})
+
+@route('/api/publish/bulk', 'POST')
+async def publish_bulk(request):
+    """批量发布MQTT消息API接口（需要认证）"""
+    try:
+        messages = build_bulk_messages(request.get_json() or {})
+    except ValueError as e:
+        return error(str(e), 400)
+
+    futures = []
+    for topic, payload, qos, retain in messages:
+        if not isinstance(payload, (str, bytes)):
+            payload = json.dumps(payload)
+        futures.append(asyncio.wrap_future(mqtt_publisher.publish(topic, payload, qos, retain)))
+
+    # 统一等待，超时后仍未完成的消息报告为pending
+    await asyncio.wait(futures, timeout=config.PUBLISH_CONFIG['wait_timeout'])
+
+    results = []
+    summary = {'delivered': 0, 'pending': 0, 'failed': 0}
+    for (topic, _, _, _), future in zip(messages, futures):
+        if not future.done():
+            future.cancel()
+            results.append({'topic': topic, 'status': 'pending'})
+            summary['pending'] += 1
+        elif future.exception() is not None:
+            results.append({'topic': topic, 'status': 'failed', 'message': str(future.exception())})
+            summary['failed'] += 1
+        else:
+            results.append({'topic': topic, 'status': 'delivered', 'mid': future.result()})
+            summary['delivered'] += 1
+
+    status = 'success' if summary['delivered'] == len(messages) else 'partial'
+    return jsonify({'status': status, 'summary': summary, 'results': results})
+
+@route('/api/debug/serial', 'POST')
+async def serial_debug(request):
+    """串口调试API接口（需要认证）"""
+    data = request.get_json() or {}
+    command = data.get('command')
+    timeout = data.get('timeout')
+    if not command:
+        return error('命令不能为空', 400)
+
+    future = mqtt_handler.request_serial_command(command, timeout, data.get('device'))
+    wait = (timeout or config.SERIAL_CONFIG['command_timeout']) + config.PUBLISH_CONFIG['wait_timeout']
+    try:
+        result = await asyncio.wait_for(asyncio.wrap_future(future), wait)
+    except asyncio.TimeoutError:
+        mqtt_handler.cancel_serial_request(future)
+        return error('等待串口响应超时', 504)
+    except serial.SerialException as e:
+        return error(str(e), 503)
+    if result.get('error'):
+        return error(result['error'], 503)
+
+    return jsonify({
+        'status': 'success',
+        'message': '命令执行成功',
+        'response': result['response'],
+        'lines': result['lines'],
+        'complete': result['complete'],
+        'elapsed': result['elapsed'],
+        'device': result['device']
+    })
+
+@route('/api/serial/logs')
+async def serial_logs(request):
+    """查询串口日志API接口（需要认证）"""
+    try:
+        return Response(await run_blocking(query_serial_logs, request.args, mqtt_handler.serial_log))
+    except ValueError as e:
+        return error(str(e), 400)
+
+@route('/metrics', auth=False)
+async def metrics_endpoint(request):
+    """Prometheus指标接口（不需要认证，应只对监控系统开放）"""
+    if not config.METRICS_CONFIG['enabled']:
+        return error('Not Found', 404)
+    return Response(metrics.registry.expose(), content_type=metrics.CONTENT_TYPE)
+
+async def dispatch(request):
+    if request.method == 'OPTIONS':
+        return Response(status=204)
+
+    entry = routes.get((request.method, request.path))
+    if entry is None:
+        if any(path == request.path for _, path in routes):
+            return error('Method Not Allowed', 405)
+        return error('Not Found', 404)
+
+    handler, auth = entry
+    if auth:
+        if not request.token:
+            return error('缺少认证令牌', 401)
+        request.user = await call_token_store(token_store.get, request.token)
+        if request.user is None:
+            return error('无效或过期的令牌', 401)
+
+    try:
+        return await handler(request)
+    except Exception as e:
+        logger.error("Error handling request", extra={'method': request.method, 'path': request.path, 'error': str(e)})
+        return error(str(e), 500)
+
+async def read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+async def send_stream(response, send, receive):
+    """发送SSE流，客户端断开时结束"""
+    await send({'type': 'http.response.start', 'status': response.status, 'headers': response.headers})
+    disconnected = asyncio.ensure_future(receive())
+    try:
+        async for chunk in response.events:
+            if disconnected.done():
+                break
+            await send({'type': 'http.response.body', 'body': chunk.encode(), 'more_body': True})
+    except OSError:
+        pass
+    finally:
+        disconnected.cancel()
+        await response.events.aclose()
+
+# MQTT客户端在事件循环中运行（生命周期启动时创建）
+mqtt_loop = None
+
+async def lifespan(receive, send):
+    global mqtt_loop
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(db_executor, init_db)
+            await loop.run_in_executor(db_executor, mqtt_handler.warm_state_cache)
+            mqtt_handler.start_services()
+            mqtt_loop = AsyncioMqttLoop(mqtt_handler.client, loop)
+            await mqtt_loop.connect(
+                config.MQTT_CONFIG['broker_url'],
+                int(config.MQTT_CONFIG['port']),
+                int(config.MQTT_CONFIG['keepalive'])
+            )
+            # 消费组的各消费者使用各自的网络线程，不在事件循环中运行
+            if uses_consumer_group():
+                consumer_group.start()
+            if not is_http_role():
+                mqtt_handler.init_serial()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            if mqtt_loop:
+                await mqtt_loop.disconnect()
+            mqtt_publisher.stop()
+            data_tail.stop()
+            retention_worker.stop()
+            # 先停止消费者，再写完流水线中的数据；顺序相反时停止期间收到的消息会被计为丢弃
+            await asyncio.get_running_loop().run_in_executor(None, consumer_group.stop)
+            await asyncio.get_running_loop().run_in_executor(None, ingest_pipeline.stop)
+            db_executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def app(scope, receive, send):
+    """ASGI应用入口"""
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    body = await read_body(receive)
+    if body is None:
+        return
+    start = time.perf_counter()
+    request = Request(scope, body)
+    response = await dispatch(request)
+    route = request.path if (request.method, request.path) in routes else 'unmatched'
+    observe_request(request.method, route, response.status, time.perf_counter() - start)
+
+    if isinstance(response, StreamResponse):
+        await send_stream(response, send, receive)
+        return
+    await send({'type': 'http.response.start', 'status': response.status, 'headers': response.headers})
+    await send({'type': 'http.response.body', 'body': response.body})
+
+if __name__ == '__main__':
+    try:
+        import uvicorn
+    except ImportError:
+        raise SystemExit('ASGI模式需要uvicorn，请先运行: pip install uvicorn')
+    uvicorn.run(
+        app,
+        host=config.WEB_SERVER_CONFIG['host'],
+        port=config.WEB_SERVER_CONFIG['port'],
+        loop='asyncio'
+    )
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+二进制遥测与JSON对比测试脚本（负载生成器）
+
+默认在本进程内比较两种格式：每条消息的字节数，以及经过路由解码、规范化并批量写入临时数据库的CPU时间。
+指定--broker时改为向MQTT代理发送模拟设备数据，用于在实际写入进程上比较：
+
+    python benchmarks/bench_binary_telemetry.py --messages 50000
+    python benchmarks/bench_binary_telemetry.py --broker localhost --format binary --devices 100 --rate 2000
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import config
+
+def temphum_reading(device, seq):
+    return {
+        'deviceId': device,
+        'temperature': round(random.uniform(15, 30), 2),
+        'humidity': round(random.uniform(30, 70), 2),
+        'timestamp': seq * 5000
+    }
+
+def relay_status(device, seq):
+    return {
+        'deviceId': device,
+        'deviceType': 'SmartRelay',
+        'numOutputs': 4,
+        'timestamp': seq * 5000,
+        'rssi': random.randint(-80, -40),
+        'relays': [{'index': i, 'state': random.random() < 0.5, 'lastChange': seq * 1000,
+                    'onDuration': random.randint(0, 100000), 'pin': 5 + i} for i in range(4)]
+    }
+
+def generate(binary_telemetry, fmt, devices, count):
+    """生成 [(主题, 负载), ...]，TempHum读数和SmartRelay状态各占一半"""
+    messages = []
+    for seq in range(count):
+        index = seq % devices
+        if seq % 2 == 0:
+            device = f"TempHum_{index:04d}"
+            data, schema, topic = temphum_reading(device, seq), 'temphum', 'mySmartHome/sensor/temphum'
+        else:
+            device = f"AA:BB:CC:00:{index // 256:02X}:{index % 256:02X}"
+            data, schema, topic = relay_status(device, seq), 'relay_status', f"mySmartHome/relay/{device}/status"
+        if fmt == 'binary':
+            messages.append((f"mySmartHome/bin/{device}", binary_telemetry.encode(schema, data)))
+        else:
+            messages.append((topic, json.dumps(data).encode()))
+    return messages
+
+class Collector:
+    """代替写入流水线，收集待写入的消息"""
+
+    def __init__(self):
+        self.items = []
+
+    def submit(self, item):
+        self.items.append(item)
+        return True
+
+def run_offline(args):
+    workdir = tempfile.mkdtemp()
+    config.DATABASE_CONFIG['database_path'] = os.path.join(workdir, 'bench.db')
+
+    import binary_telemetry
+    import database
+    from router import TopicRouter
+    from telemetry import normalize
+    database.init_db()
+
+    router = TopicRouter()
+    for topic_filter in ('mySmartHome/sensor/#', 'mySmartHome/relay/+/status'):
+        router.add(topic_filter, codec='json', persist=True)
+    router.add('mySmartHome/bin/+', codec='binary', persist=True)
+
+    print(f"{'format':<8} {'bytes/msg':>10} {'decode us':>10} {'ingest us':>10} {'metric rows':>12}")
+    for fmt in ('json', 'binary'):
+        messages = generate(binary_telemetry, fmt, args.devices, args.messages)
+        size = sum(len(payload) for _, payload in messages) / len(messages)
+
+        collector = Collector()
+        start = time.process_time()
+        for topic, payload in messages:
+            router.dispatch(topic, payload, time.time(), collector)
+        decode_us = (time.process_time() - start) / len(messages) * 1e6
+
+        rows = sum(len(normalize(item[0], item[2], item[1])[1]) for item in collector.items)
+        start = time.process_time()
+        for i in range(0, len(collector.items), args.batch):
+            database.insert_data_batch(collector.items[i:i + args.batch])
+        ingest_us = decode_us + (time.process_time() - start) / len(messages) * 1e6
+
+        print(f"{fmt:<8} {size:>10.1f} {decode_us:>10.2f} {ingest_us:>10.2f} {rows:>12}")
+
+def run_broker(args):
+    import paho.mqtt.client as mqtt
+    import binary_telemetry
+
+    client = mqtt.Client()
+    client.connect(args.broker, args.port)
+    client.loop_start()
+
+    messages = generate(binary_telemetry, args.format, args.devices, args.messages)
+    interval = 1.0 / args.rate if args.rate else 0
+    sent_bytes = 0
+    start = time.perf_counter()
+    for seq, (topic, payload) in enumerate(messages):
+        client.publish(topic, payload, qos=0)
+        sent_bytes += len(payload)
+        if interval:
+            delay = start + (seq + 1) * interval - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+    elapsed = time.perf_counter() - start
+    client.disconnect()
+    client.loop_stop()
+
+    print(f"sent {len(messages)} {args.format} messages from {args.devices} devices in {elapsed:.2f}s "
+          f"({len(messages) / elapsed:.0f} msg/s, {sent_bytes / len(messages):.1f} bytes/msg)")
+
+def main():
+    parser = argparse.ArgumentParser(description="二进制遥测与JSON对比测试")
+    parser.add_argument("--messages", type=int, default=20000, help="消息数")
+    parser.add_argument("--devices", type=int, default=50, help="模拟设备数")
+    parser.add_argument("--batch", type=int, default=config.INGEST_CONFIG['batch_size'], help="写库批次大小")
+    parser.add_argument("--broker", help="MQTT代理地址，指定时向代理发送消息")
+    parser.add_argument("--port", type=int, default=config.MQTT_CONFIG['port'], help="MQTT代理端口")
+    parser.add_argument("--format", choices=['json', 'binary'], default='binary', help="发送的消息格式")
+    parser.add_argument("--rate", type=float, default=0, help="每秒发送的消息数，0表示不限速")
+    args = parser.parse_args()
+
+    if args.broker:
+        run_broker(args)
+    else:
+        run_offline(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+共享订阅消费组测试脚本
+向本地MQTT代理（需支持MQTT 5共享订阅，如mosquitto 1.6+）发送N条消息，
+分别用不同数量的消费者在临时数据库上消费，检查每条消息只写入一次，
+并输出每个消费者分到的消息数、吞吐量和写入延迟
+
+    mosquitto -p 1883 &
+    python benchmarks/bench_consumer_group.py --messages 20000 --consumers 1 2 4
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import config
+
+def decode_and_submit(topic, payload, pipeline):
+    """消费者的处理函数：解码JSON后放入该消费者的写入流水线"""
+    pipeline.submit((topic, time.time(), json.loads(payload)))
+
+def run_group(mqtt, database, ConsumerGroup, count, messages, host, port, timeout):
+    run_id = uuid.uuid4().hex[:8]
+    topic = f"bench/{run_id}/sensor"
+    group = ConsumerGroup(decode_and_submit, count=count, group=f"bench-{run_id}", topics=[f"bench/{run_id}/#"])
+    group.start(host, port, 60)
+
+    deadline = time.time() + 10
+    while not all(consumer.connected for consumer in group.consumers):
+        if time.time() > deadline:
+            group.stop()
+            raise RuntimeError('消费者连接代理超时')
+        time.sleep(0.05)
+    time.sleep(0.5)  # 等待订阅生效
+
+    publisher = mqtt.Client(protocol=mqtt.MQTTv5)
+    publisher.max_inflight_messages_set(1000)
+    publisher.max_queued_messages_set(0)
+    publisher.connect(host, port)
+    publisher.loop_start()
+
+    with database.get_connection() as conn:
+        before = conn.execute("SELECT COUNT(*) FROM sensor_data").fetchone()[0]
+
+    start = time.perf_counter()
+    infos = []
+    for i in range(messages):
+        payload = json.dumps({'deviceId': f"dev{i % 50}", 'temperature': 20 + i % 10, 'humidity': 50, 'seq': i})
+        infos.append(publisher.publish(topic, payload, qos=1))
+    for info in infos:
+        info.wait_for_publish()
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        stats = group.stats()
+        if stats['written'] + stats['failed'] + stats['dropped'] >= messages:
+            break
+        time.sleep(0.05)
+    elapsed = time.perf_counter() - start
+
+    stats = group.stats()
+    publisher.disconnect()
+    publisher.loop_stop()
+    group.stop()
+
+    with database.get_connection() as conn:
+        written = conn.execute("SELECT COUNT(*) FROM sensor_data").fetchone()[0] - before
+    return elapsed, written, stats
+
+def main():
+    parser = argparse.ArgumentParser(description="共享订阅消费组测试")
+    parser.add_argument("--host", default=config.MQTT_CONFIG['broker_url'], help="MQTT代理地址")
+    parser.add_argument("--port", type=int, default=config.MQTT_CONFIG['port'], help="MQTT代理端口")
+    parser.add_argument("--messages", type=int, default=20000, help="每组测试发送的消息数")
+    parser.add_argument("--consumers", type=int, nargs='+', default=[1, 2, 4], help="要测试的消费者数")
+    parser.add_argument("--timeout", type=float, default=60.0, help="等待写入完成的最长时间(秒)")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    config.DATABASE_CONFIG['database_path'] = os.path.join(workdir, 'bench.db')
+    config.JOURNAL_CONFIG['directory'] = os.path.join(workdir, 'journal')
+
+    import paho.mqtt.client as mqtt
+    import database
+    from consumer_group import ConsumerGroup
+    database.init_db()
+
+    print(f"{'consumers':>9} {'msgs/s':>10} {'written':>8} {'max lag s':>10}  per-consumer received")
+    ok = True
+    for count in args.consumers:
+        elapsed, written, stats = run_group(mqtt, database, ConsumerGroup, count, args.messages,
+                                            args.host, args.port, args.timeout)
+        received = [consumer['received'] for consumer in stats['consumers']]
+        lag = stats['max_lag'] if stats['max_lag'] is not None else float('nan')
+        print(f"{count:>9} {args.messages / elapsed:>10.1f} {written:>8} {lag:>10.3f}  {received}")
+        if written != args.messages or sum(received) != args.messages:
+            ok = False
+            print(f"  !! 期望{args.messages}条，实际收到{sum(received)}条、写入{written}条")
+
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
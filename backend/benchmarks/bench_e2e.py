@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+"""
+端到端负载测试脚本
+模拟N个TempHum/SmartRelay/SmartSocket设备按指定频率向本地MQTT代理发送数据，
+同时用多个HTTP客户端并发请求/api/data、/api/login和/api/publish，统计：
+  - 写入吞吐量（每秒写入数据库的消息数）和丢失的消息数
+  - 端到端延迟（设备发送到记录出现在数据库中）的百分位数
+  - 各HTTP接口的延迟百分位数、每秒请求数和错误数
+结果以JSON保存，指定--compare时与之前的结果比较，用于发现版本之间的性能回退
+
+需要先启动MQTT代理和后端服务（与本脚本在同一台机器上，端到端延迟直接读取数据库）：
+
+    mosquitto -p 1883 &
+    python app.py &
+    python benchmarks/bench_e2e.py --temphum 50 --relays 20 --sockets 10 --rate 1 --duration 60 \\
+        --http-clients 8 --output results/e2e.json --label v1.2
+    python benchmarks/bench_e2e.py ... --compare results/e2e.json
+"""
+
+import argparse
+import heapq
+import http.client
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from urllib.parse import urlsplit
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, BACKEND_DIR)
+
+import config
+
+# 与基准结果比较的指标：(路径, 是否越大越好)
+COMPARE_METRICS = [
+    (('mqtt', 'stored_per_sec'), True),
+    (('mqtt', 'latency_ms', 'p50'), False),
+    (('mqtt', 'latency_ms', 'p99'), False),
+    (('http', 'data', 'p50'), False),
+    (('http', 'data', 'p99'), False),
+    (('http', 'login', 'p99'), False),
+    (('http', 'publish', 'p99'), False),
+]
+
+def percentiles(values):
+    """返回毫秒为单位的p50/p90/p99/max"""
+    if not values:
+        return {'p50': None, 'p90': None, 'p99': None, 'max': None}
+    values = sorted(values)
+
+    def pick(q):
+        return round(values[min(len(values) - 1, int(q * len(values)))] * 1000, 3)
+    return {'p50': pick(0.5), 'p90': pick(0.9), 'p99': pick(0.99), 'max': round(values[-1] * 1000, 3)}
+
+# TempHum固件发布数据的主题
+MQTT_TOPIC = config.MQTT_CONFIG['topic_subscribe']
+
+class VirtualDevice:
+    """一个模拟设备，按固件的主题和消息格式生成数据"""
+
+    def __init__(self, kind, index, run_id):
+        self.kind = kind
+        self.seq = 0
+        if kind == 'temphum':
+            self.device_id = f"TempHum_{run_id}_{index:04d}"
+            self.topic = MQTT_TOPIC
+        elif kind == 'relay':
+            self.device_id = f"BE:{run_id[:2]}:{run_id[2:4]}:00:{index // 256:02X}:{index % 256:02X}".upper()
+            self.topic = f"mySmartHome/relay/{self.device_id}/status"
+        else:
+            self.device_id = f"SmartSocket_{run_id}_{index:04d}"
+            self.topic = 'mySmartHome/socket/status'
+
+    def message(self, run_id):
+        self.seq += 1
+        data = {'deviceId': self.device_id, 'timestamp': self.seq * 1000}
+        if self.kind == 'temphum':
+            data.update(temperature=round(random.uniform(15, 30), 2), humidity=round(random.uniform(30, 70), 2))
+        elif self.kind == 'relay':
+            data.update(deviceType='SmartRelay', numOutputs=4, rssi=random.randint(-80, -40),
+                        relays=[{'index': i, 'state': random.random() < 0.5, 'pin': 5 + i} for i in range(4)])
+        else:
+            data['outputs'] = [{'index': i, 'state': random.random() < 0.5, 'voltage': round(random.uniform(218, 232), 1),
+                                'current': round(random.uniform(0, 5), 3), 'power': round(random.uniform(0, 1000), 1),
+                                'energy': round(random.uniform(0, 100), 3)} for i in range(2)]
+        # 用于在数据库中识别本次测试的消息并计算端到端延迟（字符串字段，不会被拆分为指标）
+        data['bench'] = f"{run_id}|{self.device_id}/{self.seq}|{time.time():.6f}"
+        return data
+
+class DevicePublisher(threading.Thread):
+    """一个MQTT连接，按各设备的频率发送其负责的设备的数据"""
+
+    def __init__(self, mqtt, args, devices, run_id, stop_event):
+        super().__init__(daemon=True)
+        self.args = args
+        self.devices = devices
+        self.run_id = run_id
+        self.stop_event = stop_event
+        self.sent = 0
+        self.errors = 0
+        self.client = mqtt.Client()
+        self.client.max_queued_messages_set(0)
+        self.client.connect(args.broker, args.port)
+        self.client.loop_start()
+
+    def run(self):
+        interval = 1.0 / self.args.rate
+        # (下次发送时间, 设备序号)，各设备错开发送时间
+        schedule = [(time.perf_counter() + random.uniform(0, interval), i) for i in range(len(self.devices))]
+        heapq.heapify(schedule)
+        while schedule and not self.stop_event.is_set():
+            due, index = schedule[0]
+            delay = due - time.perf_counter()
+            if delay > 0 and self.stop_event.wait(delay):
+                break
+            device = self.devices[index]
+            info = self.client.publish(device.topic, json.dumps(device.message(self.run_id)), qos=self.args.qos)
+            if info.rc == 0:
+                self.sent += 1
+            else:
+                self.errors += 1
+            heapq.heapreplace(schedule, (due + interval, index))
+
+    def close(self):
+        self.client.disconnect()
+        self.client.loop_stop()
+
+class DatabaseWatcher(threading.Thread):
+    """轮询数据库中新写入的记录，找出本次测试的消息并记录其出现的时间"""
+
+    def __init__(self, path, run_id, poll_interval):
+        super().__init__(daemon=True)
+        self.conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        self.run_id = run_id
+        self.poll_interval = poll_interval
+        self.last_id = self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM sensor_data").fetchone()[0]
+        self.seen = {}                  # 消息ID -> 延迟(秒)
+        self.duplicates = 0
+        self.stop_event = threading.Event()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            self.poll()
+            self.stop_event.wait(self.poll_interval)
+
+    def poll(self):
+        rows = self.conn.execute("SELECT id, data FROM sensor_data WHERE id > ? ORDER BY id LIMIT 5000",
+                                 (self.last_id,)).fetchall()
+        now = time.time()
+        for row_id, payload in rows:
+            self.last_id = row_id
+            if not payload or self.run_id not in payload:
+                continue
+            try:
+                bench = json.loads(payload).get('bench')
+                run_id, message_id, sent_at = bench.split('|')
+            except (ValueError, AttributeError):
+                continue
+            if run_id != self.run_id:
+                continue
+            if message_id in self.seen:
+                self.duplicates += 1
+            else:
+                self.seen[message_id] = now - float(sent_at)
+        return len(rows)
+
+class HttpClient(threading.Thread):
+    """一个保持连接的HTTP客户端，按权重随机请求各接口"""
+
+    def __init__(self, args, token, weights, stop_event):
+        super().__init__(daemon=True)
+        self.args = args
+        self.token = token
+        self.weights = weights
+        self.stop_event = stop_event
+        self.latencies = {name: [] for name in weights}
+        self.errors = {name: 0 for name in weights}
+        url = urlsplit(args.url)
+        self.host, self.port = url.hostname, url.port or 80
+
+    def request(self, conn, method, path, body=None, token=None):
+        headers = {'Content-Type': 'application/json'}
+        if token:
+            headers['Authorization'] = token
+        conn.request(method, path, json.dumps(body) if body is not None else None, headers)
+        response = conn.getresponse()
+        data = response.read()
+        return response.status, data
+
+    def call(self, conn, name):
+        if name == 'data':
+            return self.request(conn, 'GET', f"/api/data?limit={self.args.data_limit}", token=self.token)
+        if name == 'login':
+            return self.request(conn, 'POST', '/api/login',
+                                {'username': self.args.username, 'password': self.args.password})
+        return self.request(conn, 'POST', '/api/publish',
+                            {'bench': True, 'temperature': round(random.uniform(15, 30), 2)}, token=self.token)
+
+    def run(self):
+        names = list(self.weights)
+        weights = [self.weights[name] for name in names]
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+        while not self.stop_event.is_set():
+            name = random.choices(names, weights)[0]
+            start = time.perf_counter()
+            try:
+                status, _ = self.call(conn, name)
+                # /api/publish在代理未确认时返回202，同样计入成功
+                ok = status < 400
+            except (OSError, http.client.HTTPException):
+                ok = False
+                conn.close()
+                conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+            if ok:
+                self.latencies[name].append(time.perf_counter() - start)
+            else:
+                self.errors[name] += 1
+        conn.close()
+
+def get_token(args):
+    """注册（已存在时忽略）并登录测试用户，返回令牌"""
+    url = urlsplit(args.url)
+    conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=30)
+    body = {'username': args.username, 'password': args.password}
+    conn.request('POST', '/api/register', json.dumps(body), {'Content-Type': 'application/json'})
+    conn.getresponse().read()
+    conn.request('POST', '/api/login', json.dumps(body), {'Content-Type': 'application/json'})
+    response = conn.getresponse()
+    data = json.loads(response.read())
+    conn.close()
+    if not data.get('token'):
+        raise RuntimeError(f"登录失败: {data}")
+    return data['token']
+
+def parse_weights(value):
+    """解析HTTP请求权重，如 data=7,publish=2,login=1"""
+    weights = {}
+    for item in value.split(','):
+        name, _, weight = item.partition('=')
+        if name not in ('data', 'login', 'publish'):
+            raise argparse.ArgumentTypeError(f"未知的接口: {name}")
+        if float(weight) > 0:
+            weights[name] = float(weight)
+    return weights
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def run(args):
+    import paho.mqtt.client as mqtt
+
+    run_id = uuid.uuid4().hex[:8]
+    db_path = args.db or config.DATABASE_CONFIG['database_path']
+    if not os.path.isabs(db_path):
+        db_path = os.path.join(BACKEND_DIR, db_path)
+
+    devices = ([VirtualDevice('temphum', i, run_id) for i in range(args.temphum)] +
+               [VirtualDevice('relay', i, run_id) for i in range(args.relays)] +
+               [VirtualDevice('socket', i, run_id) for i in range(args.sockets)])
+    token = get_token(args) if args.http_clients else None
+
+    watcher = DatabaseWatcher(db_path, run_id, args.poll)
+    stop_event = threading.Event()
+    publishers = [DevicePublisher(mqtt, args, devices[i::args.mqtt_clients], run_id, stop_event)
+                  for i in range(min(args.mqtt_clients, len(devices)))]
+    clients = [HttpClient(args, token, args.http_mix, stop_event) for _ in range(args.http_clients)]
+
+    print(f"run {run_id}: {len(devices)} devices x {args.rate} msg/s, {args.http_clients} HTTP clients, "
+          f"{args.duration}s")
+    watcher.start()
+    start = time.perf_counter()
+    for thread in publishers + clients:
+        thread.start()
+    stop_event.wait(args.duration)
+    stop_event.set()
+    elapsed = time.perf_counter() - start
+    for thread in publishers + clients:
+        thread.join()
+    for publisher in publishers:
+        publisher.close()
+
+    # 等待写入进程写完剩余消息
+    sent = sum(p.sent for p in publishers)
+    deadline = time.time() + args.drain_timeout
+    while len(watcher.seen) < sent and time.time() < deadline:
+        time.sleep(0.1)
+    watcher.stop_event.set()
+    watcher.join()
+    drained = time.perf_counter() - start
+
+    latencies = list(watcher.seen.values())
+    stored = len(latencies)
+    http_results = {}
+    for name in args.http_mix:
+        values = [v for client in clients for v in client.latencies[name]]
+        http_results[name] = dict(percentiles(values), count=len(values),
+                                  errors=sum(client.errors[name] for client in clients),
+                                  per_sec=round(len(values) / elapsed, 1))
+
+    return {
+        'label': args.label,
+        'revision': git_revision(),
+        'run_id': run_id,
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'params': {
+            'temphum': args.temphum, 'relays': args.relays, 'sockets': args.sockets, 'rate': args.rate,
+            'qos': args.qos, 'duration': args.duration, 'mqtt_clients': args.mqtt_clients,
+            'http_clients': args.http_clients, 'http_mix': args.http_mix, 'poll_ms': args.poll * 1000
+        },
+        'mqtt': {
+            'sent': sent,
+            'publish_errors': sum(p.errors for p in publishers),
+            'stored': stored,
+            'lost': sent - stored,
+            'duplicates': watcher.duplicates,
+            'sent_per_sec': round(sent / elapsed, 1),
+            'stored_per_sec': round(stored / drained, 1),
+            'latency_ms': percentiles(latencies)
+        },
+        'http': http_results
+    }
+
+def lookup(result, path):
+    for key in path:
+        if not isinstance(result, dict) or key not in result:
+            return None
+        result = result[key]
+    return result
+
+def compare(result, baseline, threshold):
+    """与基准结果比较，打印变化并返回退化超过threshold的指标"""
+    regressions = []
+    print(f"\ncompared with {baseline.get('label') or baseline.get('revision')} ({baseline.get('started_at')})")
+    print(f"{'metric':<28} {'baseline':>10} {'current':>10} {'change':>8}")
+    for path, higher_is_better in COMPARE_METRICS:
+        old, new = lookup(baseline, path), lookup(result, path)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        worse = -change if higher_is_better else change
+        flag = ' !' if worse > threshold else ''
+        if flag:
+            regressions.append('.'.join(path))
+        print(f"{'.'.join(path):<28} {old:>10} {new:>10} {change:>+8.1%}{flag}")
+    return regressions
+
+def print_result(result):
+    mqtt = result['mqtt']
+    latency = mqtt['latency_ms']
+    print(f"\nMQTT: sent {mqtt['sent']} ({mqtt['sent_per_sec']}/s), stored {mqtt['stored']} "
+          f"({mqtt['stored_per_sec']}/s), lost {mqtt['lost']}, duplicates {mqtt['duplicates']}")
+    print(f"message->DB latency ms: p50 {latency['p50']}  p90 {latency['p90']}  p99 {latency['p99']}  "
+          f"max {latency['max']}  (poll {result['params']['poll_ms']:.0f} ms)")
+    if result['http']:
+        print(f"\n{'endpoint':<10} {'count':>8} {'errors':>7} {'req/s':>8} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9}")
+        for name, stats in result['http'].items():
+            print(f"{name:<10} {stats['count']:>8} {stats['errors']:>7} {stats['per_sec']:>8} "
+                  f"{stats['p50']!s:>9} {stats['p90']!s:>9} {stats['p99']!s:>9}")
+
+def main():
+    parser = argparse.ArgumentParser(description="端到端负载测试")
+    parser.add_argument("--broker", default='localhost', help="MQTT代理地址")
+    parser.add_argument("--port", type=int, default=config.MQTT_CONFIG['port'], help="MQTT代理端口")
+    parser.add_argument("--url", default='http://localhost:5000', help="后端HTTP地址")
+    parser.add_argument("--db", help="后端数据库路径（默认DATABASE_CONFIG['database_path']）")
+    parser.add_argument("--temphum", type=int, default=20, help="模拟TempHum设备数")
+    parser.add_argument("--relays", type=int, default=10, help="模拟SmartRelay设备数")
+    parser.add_argument("--sockets", type=int, default=5, help="模拟SmartSocket设备数")
+    parser.add_argument("--rate", type=float, default=1.0, help="每个设备每秒发送的消息数")
+    parser.add_argument("--qos", type=int, choices=[0, 1, 2], default=0, help="设备消息的QoS")
+    parser.add_argument("--mqtt-clients", type=int, default=4, help="发送设备数据的MQTT连接数")
+    parser.add_argument("--http-clients", type=int, default=4, help="并发HTTP客户端数，0表示不测试HTTP")
+    parser.add_argument("--http-mix", type=parse_weights, default=parse_weights('data=7,publish=2,login=1'),
+                        help="各接口的请求权重，如 data=7,publish=2,login=1")
+    parser.add_argument("--data-limit", type=int, default=50, help="/api/data请求的limit参数")
+    parser.add_argument("--username", default='bench_user', help="测试用户名（不存在时自动注册）")
+    parser.add_argument("--password", default='bench_password', help="测试用户密码")
+    parser.add_argument("--duration", type=float, default=30, help="测试时间(秒)")
+    parser.add_argument("--drain-timeout", type=float, default=30, help="停止发送后等待写完的最长时间(秒)")
+    parser.add_argument("--poll", type=float, default=0.01, help="轮询数据库的间隔(秒)，决定延迟的测量精度")
+    parser.add_argument("--label", help="本次结果的标签（如版本号）")
+    parser.add_argument("--output", help="保存JSON结果的文件")
+    parser.add_argument("--compare", help="与之前保存的JSON结果比较")
+    parser.add_argument("--threshold", type=float, default=0.1, help="超过该比例的退化视为回退")
+    args = parser.parse_args()
+
+    result = run(args)
+    print_result(result)
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"\nresults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            regressions = compare(result, json.load(f), args.threshold)
+        if regressions:
+            print(f"regressions: {', '.join(regressions)}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
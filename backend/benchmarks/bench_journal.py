@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+写入日志测试脚本
+在临时目录中比较：逐条提交SQLite事务、按批写入SQLite、写入日志（每条fsync）、
+写入日志（一批一次fsync，组提交）的吞吐量，再把日志回放到数据库，检查条数和顺序
+
+    python benchmarks/bench_journal.py --messages 20000 --batch 500
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import config
+
+def make_items(count):
+    items = []
+    for i in range(count):
+        data = {'deviceId': f"dev{i % 50}", 'temperature': 20 + i % 10, 'humidity': 50, 'seq': i}
+        items.append(('mySmartHome/sensor/temphum', time.time(), data, json.dumps(data).encode()))
+    return items
+
+def measure(label, items, batch, write):
+    start = time.perf_counter()
+    for i in range(0, len(items), batch):
+        write(items[i:i + batch])
+    elapsed = time.perf_counter() - start
+    print(f"{label:<34} {batch:>6} {len(items) / elapsed:>12.0f}")
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="写入日志（组提交）与SQLite逐条提交的吞吐量对比")
+    parser.add_argument("--messages", type=int, default=20000, help="每项测试写入的消息数")
+    parser.add_argument("--batch", type=int, default=500, help="组提交的批次大小")
+    parser.add_argument("--row-messages", type=int, default=2000, help="逐条提交测试的消息数（较慢）")
+    parser.add_argument("--no-fsync", action="store_true", help="写入日志后不fsync")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    config.DATABASE_CONFIG['database_path'] = os.path.join(workdir, 'bench.db')
+    config.LOG_CONFIG['file'] = None
+
+    import database
+    from journal import IngestJournal, JournalReplayer
+    database.init_db()
+    fsync = not args.no_fsync
+    items = make_items(args.messages)
+
+    print(f"{'method':<34} {'batch':>6} {'msgs/s':>12}")
+    measure('sqlite, commit per row', items[:args.row_messages], 1, database.insert_data_batch)
+    measure('sqlite, batched', items, args.batch, database.insert_data_batch)
+    single = IngestJournal(os.path.join(workdir, 'single'), fsync=fsync).open()
+    measure(f"journal, fsync per row{'' if fsync else ' (off)'}", items[:args.row_messages], 1, single.append)
+    journal = IngestJournal(os.path.join(workdir, 'journal'), fsync=fsync).open()
+    measure(f"journal, group commit{'' if fsync else ' (no fsync)'}", items, args.batch, journal.append)
+
+    with database.get_connection() as conn:
+        before = conn.execute("SELECT MAX(id) FROM sensor_data").fetchone()[0]
+    replayer = JournalReplayer(journal, 'bench')
+    start = time.perf_counter()
+    replayer.start()
+    while journal.pending and replayer.errors == 0:
+        time.sleep(0.01)
+    elapsed = time.perf_counter() - start
+    replayer.stop()
+    print(f"{'replay into sqlite':<34} {replayer.batch_size:>6} {args.messages / elapsed:>12.0f}")
+
+    with database.get_connection() as conn:
+        rows = conn.execute("SELECT data FROM sensor_data WHERE id > ? ORDER BY id", (before,)).fetchall()
+    seqs = [json.loads(row[0])['seq'] for row in rows]
+    ok = seqs == list(range(args.messages))
+    if not ok:
+        print(f"  !! 回放写入{len(seqs)}条，期望{args.messages}条且按顺序")
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+JSON编解码性能测试脚本
+比较写入和读取一条设备消息的旧路径与新路径：
+  旧路径：bytes.decode() -> json.loads -> json.dumps（写库） -> json.loads（读库） -> json.dumps（响应）
+  新路径：codec.loads(bytes) -> 原样保存负载 -> 读库时直接拼接进响应
+分别测试标准库json和orjson（已安装时）后端，并在临时数据库上测试/api/data的整体耗时
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import config
+
+# TempHum设备的典型消息
+SAMPLE = json.dumps({
+    'deviceId': 'TempHum_A1B2C3',
+    'deviceType': 'TempHum',
+    'timestamp': 1718000000,
+    'temperature': 23.5,
+    'humidity': 48.2,
+    'heatIndex': 23.9,
+    'dewPoint': 11.8,
+    'wifi': {'rssi': -61, 'ip': '192.168.1.23'},
+    'uptime': 86400,
+    'freeHeap': 214560
+}).encode()
+
+def per_message_us(func, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        func()
+    return (time.perf_counter() - start) / count * 1e6
+
+def old_path():
+    data = json.loads(SAMPLE.decode())
+    stored = json.dumps(data)
+    row = {'id': 1, 'timestamp': '2024-06-10 00:00:00', 'data': json.loads(stored)}
+    return json.dumps({'data': [row]})
+
+def make_new_path(codec):
+    def new_path():
+        codec.loads(SAMPLE)
+        stored = SAMPLE.decode('utf-8')
+        return '{"data":[' + f'{{"id":1,"timestamp":{codec.dumps("2024-06-10 00:00:00")},"data":{stored}}}' + ']}'
+    return new_path
+
+def main():
+    parser = argparse.ArgumentParser(description="JSON编解码性能测试")
+    parser.add_argument("--count", type=int, default=100000, help="每组测试的消息数")
+    parser.add_argument("--rows", type=int, default=1000, help="/api/data测试返回的记录数")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    config.DATABASE_CONFIG['database_path'] = os.path.join(workdir, 'bench.db')
+
+    import codec
+    import database
+    from api_common import query_data
+    database.init_db()
+
+    print(f"payload: {len(SAMPLE)} bytes")
+    print(f"{'path':<16} {'us/msg':>8}")
+    print(f"{'old (stdlib)':<16} {per_message_us(old_path, args.count):>8.2f}")
+    for backend in codec.BACKENDS:
+        codec.set_backend(backend)
+        print(f"{'new (' + backend + ')':<16} {per_message_us(make_new_path(codec), args.count):>8.2f}")
+
+    # 在临时数据库上比较/api/data的两种读取方式
+    items = [('mySmartHome/sensor/temphum', time.time(), json.loads(SAMPLE), SAMPLE) for _ in range(args.rows)]
+    database.insert_data_batch(items)
+
+    def old_read():
+        return json.dumps({'data': database.get_recent_data(args.rows)})
+
+    print(f"\n/api/data limit={args.rows}")
+    print(f"{'old (parse rows)':<22} {per_message_us(old_read, 50) / 1000:>8.2f} ms")
+    for backend in codec.BACKENDS:
+        codec.set_backend(backend)
+        body = query_data({'limit': str(args.rows)})
+        assert json.loads(body) == json.loads(old_read())
+        elapsed = per_message_us(lambda: query_data({'limit': str(args.rows)}), 50) / 1000
+        print(f"{'new (splice, ' + backend + ')':<22} {elapsed:>8.2f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+登录性能测试脚本
+在临时数据库上测试不同密码哈希工作因子下verify_user的每秒登录次数，
+分别统计未命中凭据缓存（每次都计算哈希）和命中缓存时的结果
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import config
+
+def run_logins(verify_user, username, password, threads, duration):
+    """用多个线程在指定时间内反复登录，返回每秒登录次数"""
+    counts = [0] * threads
+    deadline = time.perf_counter() + duration
+
+    def worker(index):
+        while time.perf_counter() < deadline:
+            ok, _ = verify_user(username, password)
+            if not ok:
+                raise RuntimeError('登录失败')
+            counts[index] += 1
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    return sum(counts) / (time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description="登录性能测试")
+    parser.add_argument("--iterations", type=int, nargs='+', default=[1000, 10000, 100000, 200000, 600000],
+                        help="要测试的PBKDF2迭代次数")
+    parser.add_argument("--threads", type=int, default=8, help="并发登录线程数")
+    parser.add_argument("--duration", type=float, default=3.0, help="每组测试时间(秒)")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    config.DATABASE_CONFIG['database_path'] = os.path.join(workdir, 'bench.db')
+
+    import database
+    import passwords
+    database.init_db()
+
+    print(f"{'iterations':>10} {'hash ms':>9} {'cold logins/s':>14} {'cached logins/s':>16}")
+    for iterations in args.iterations:
+        config.PASSWORD_CONFIG['iterations'] = iterations
+        username = f"bench_{iterations}"
+        database.register_user(username, 'password123')
+
+        start = time.perf_counter()
+        passwords.make_password_hash('password123', iterations)
+        hash_ms = (time.perf_counter() - start) * 1000
+
+        passwords.credential_cache.max_entries = 0
+        passwords.credential_cache.clear()
+        cold = run_logins(database.verify_user, username, 'password123', args.threads, args.duration)
+
+        passwords.credential_cache.max_entries = config.PASSWORD_CONFIG['cache_size'] or 1024
+        cached = run_logins(database.verify_user, username, 'password123', args.threads, args.duration)
+
+        print(f"{iterations:>10} {hash_ms:>9.2f} {cold:>14.1f} {cached:>16.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+指标记录开销测试脚本
+测量热路径上每次记录指标的耗时（单线程和多线程），以及输出/metrics的耗时：
+  - Counter.inc()
+  - Histogram.observe()
+  - 计时并记录（两次perf_counter加一次observe，即路由解码和写库的用法）
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from metrics import Registry
+
+def per_call_ns(func, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        func()
+    return (time.perf_counter() - start) / count * 1e9
+
+def threaded_ns(func, count, threads):
+    """多个线程同时记录，返回每次记录的平均耗时（墙钟时间 / 总次数）"""
+    def worker():
+        for _ in range(count):
+            func()
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    return (time.perf_counter() - start) / (count * threads) * 1e9
+
+def main():
+    parser = argparse.ArgumentParser(description="指标记录开销测试")
+    parser.add_argument("--count", type=int, default=1000000, help="每组测试的记录次数")
+    parser.add_argument("--threads", type=int, default=4, help="多线程测试的线程数")
+    parser.add_argument("--series", type=int, default=200, help="输出测试中的指标数")
+    args = parser.parse_args()
+
+    registry = Registry()
+    counter = registry.counter('bench_total', 'bench', ['route']).labels('mySmartHome/sensor/#')
+    histogram = registry.histogram('bench_seconds', 'bench', ['codec']).labels('json')
+    perf_counter = time.perf_counter
+
+    def timed():
+        start = perf_counter()
+        histogram.observe(perf_counter() - start)
+
+    cases = [
+        ('counter.inc', counter.inc),
+        ('histogram.observe', lambda: histogram.observe(0.0003)),
+        ('time + observe', timed),
+    ]
+    print(f"{'operation':<20} {'ns/op':>8} {f'ns/op x{args.threads}':>12}")
+    for name, func in cases:
+        print(f"{name:<20} {per_call_ns(func, args.count):>8.0f} "
+              f"{threaded_ns(func, args.count // args.threads, args.threads):>12.0f}")
+    expected = args.count + args.count // args.threads * args.threads
+    print(f"counter value {counter.value} (expected {expected})")
+
+    family = registry.histogram('bench_route_seconds', 'bench', ['route'])
+    for i in range(args.series):
+        family.labels(f"route/{i}").observe(0.001)
+    start = time.perf_counter()
+    body = registry.expose()
+    print(f"\nexpose {args.series + 2} series: {(time.perf_counter() - start) * 1000:.2f} ms, {len(body)} bytes")
+
+if __name__ == "__main__":
+    main()
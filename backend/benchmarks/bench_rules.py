@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+规则引擎测试脚本
+生成指定数量的设备和规则（阈值、变化率、无数据和回差规则，其中--generic条不指定设备、适用于全部设备），
+用同一组消息比较规则引擎（按设备和指标索引）与逐条检查全部规则的朴素实现的吞吐量，
+并检查两者的规则触发和恢复次数一致
+
+    python benchmarks/bench_rules.py --devices 1000 --rules 100 1000 5000 --generic 20 --messages 50000
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from rules import Rule, RuleEngine, topic_matches
+from telemetry import extract_metrics
+
+METRICS = ('temperature', 'humidity')
+
+def make_rules(count, generic, devices, rng):
+    definitions = []
+    for i in range(count):
+        kind = ('threshold', 'rate', 'hysteresis', 'absent')[i % 4]
+        rule = {'id': f"rule{i}", 'type': kind, 'metric': rng.choice(METRICS),
+                'actions': [{'device': f"AABBCCDD{i % 256:04X}", 'relay': i % 4, 'state': True}],
+                'clear_actions': [{'device': f"AABBCCDD{i % 256:04X}", 'relay': i % 4, 'state': False}]}
+        if i >= generic:
+            rule['device'] = f"dev{rng.randrange(devices)}"
+        if i % 7 == 0:
+            rule['topic'] = 'mySmartHome/sensor/#'
+        if kind == 'threshold':
+            rule.update(op=rng.choice(['>', '<']), value=rng.uniform(20, 30))
+        elif kind == 'rate':
+            rule.update(value=rng.uniform(0.5, 3))
+        elif kind == 'hysteresis':
+            low = rng.uniform(20, 28)
+            rule.update(low=low, high=low + 1)
+        else:
+            rule.update(minutes=rng.uniform(1, 10))
+        definitions.append(rule)
+    return definitions
+
+def make_messages(count, devices, rng):
+    messages = []
+    # 每个设备的数值随机游走，与真实传感器一样缓慢变化
+    values = [[rng.uniform(18, 32), rng.uniform(30, 70)] for _ in range(devices)]
+    ts = 1_000_000.0
+    for i in range(count):
+        ts += 0.01
+        index = rng.randrange(devices)
+        device = f"dev{index}"
+        value = values[index]
+        value[0] = min(35.0, max(15.0, value[0] + rng.uniform(-0.3, 0.3)))
+        value[1] = min(80.0, max(20.0, value[1] + rng.uniform(-1, 1)))
+        data = {'deviceId': device, 'temperature': round(value[0], 1), 'humidity': round(value[1], 1),
+                'rssi': rng.randrange(-90, -40)}
+        topic = 'mySmartHome/sensor/temphum' if i % 3 else f"mySmartHome/relay/{device}/status"
+        messages.append((topic, device, extract_metrics(data), ts))
+    return messages
+
+def naive(definitions, messages):
+    """逐条检查全部规则"""
+    rules = [Rule(definition) for definition in definitions]
+    changes = 0
+    start = time.perf_counter()
+    for topic, device, metrics, ts in messages:
+        values = dict(metrics)
+        for rule in rules:
+            if rule.device is not None and rule.device != device:
+                continue
+            if rule.topic is not None and not topic_matches(rule.topic, topic):
+                continue
+            if rule.metric is None:
+                value = None
+            elif rule.metric in values:
+                value = values[rule.metric]
+            else:
+                continue
+            if rule.update(device, value, ts) is not None:
+                changes += 1
+    return time.perf_counter() - start, changes
+
+def indexed(definitions, messages):
+    """规则引擎（动作发布到空函数）"""
+    engine = RuleEngine(lambda *args: None)
+    engine.load(definitions, now=messages[0][3])
+    start = time.perf_counter()
+    for topic, device, metrics, ts in messages:
+        engine.evaluate(topic, device, metrics, ts)
+    return time.perf_counter() - start, engine.fired + engine.cleared
+
+def main():
+    parser = argparse.ArgumentParser(description="规则引擎与逐条检查全部规则的吞吐量对比")
+    parser.add_argument("--devices", type=int, default=1000, help="设备数")
+    parser.add_argument("--rules", type=int, nargs='+', default=[100, 1000, 5000], help="要测试的规则数")
+    parser.add_argument("--generic", type=int, default=20, help="不指定设备的规则数")
+    parser.add_argument("--messages", type=int, default=50000, help="消息数")
+    parser.add_argument("--naive-messages", type=int, default=5000, help="朴素实现使用的消息数（较慢）")
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    messages = make_messages(args.messages, args.devices, rng)
+    print(f"{'rules':>6} {'naive msgs/s':>13} {'indexed msgs/s':>15} {'speedup':>8} {'changes':>8}")
+    ok = True
+    for count in args.rules:
+        definitions = make_rules(count, args.generic, args.devices, rng)
+        subset = messages[:args.naive_messages]
+        naive_elapsed, naive_changes = naive(definitions, subset)
+        _, check_changes = indexed(definitions, subset)
+        elapsed, changes = indexed(definitions, messages)
+        naive_rate = len(subset) / naive_elapsed
+        rate = len(messages) / elapsed
+        print(f"{count:>6} {naive_rate:>13.0f} {rate:>15.0f} {rate / naive_rate:>7.1f}x {changes:>8}")
+        if naive_changes != check_changes:
+            ok = False
+            print(f"  !! 状态变化次数不一致：朴素实现{naive_changes}，规则引擎{check_changes}")
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""紧凑二进制遥测格式
+
+高频设备可以在专用主题 mySmartHome/bin/<设备ID> 上发送二进制负载代替JSON：
+第1个字节是格式ID，其后是该格式的定长结构（小端序），可以带若干个定长的重复项。
+解码结果与同类设备的JSON数据字段相同，因此规范化后得到相同的时序数据行。
+
+格式1 TempHum读数（9字节，JSON约80字节）：
+    B 格式ID | I timestamp(ms) | h temperature(0.01°C) | H humidity(0.01%)
+格式2 SmartRelay状态（7 + 9×路数 字节，4路时43字节，JSON约400字节）：
+    B 格式ID | I timestamp(ms) | b rssi | B numOutputs | 每路: B state | I lastChange | I onDuration
+"""
+
+import struct
+
+class Schema:
+    """一种二进制格式：头部结构、重复项结构和字段定义
+
+    fields/item_fields为 (字段名, 缩放系数) 列表，缩放系数不为None时整数按该系数还原为小数；
+    count_field为头部中表示重复项数量的字段。
+    """
+
+    def __init__(self, schema_id, name, device_type, header, fields, item=None, item_fields=(),
+                 items_field=None, count_field=None, bool_fields=()):
+        self.id = schema_id
+        self.name = name
+        self.device_type = device_type
+        self.header = struct.Struct('<B' + header)
+        self.fields = fields
+        self.item = struct.Struct('<' + item) if item else None
+        self.item_fields = item_fields
+        self.items_field = items_field
+        self.count_field = count_field
+        self.bool_fields = set(bool_fields)
+        # 解码时按字段顺序使用的 (字段名, 转换类型, 缩放系数)，在注册时预先计算
+        self._header_plan = self._plan(fields)
+        self._item_plan = self._plan(item_fields)
+
+    def _plan(self, fields):
+        return [(name, 'bool' if name in self.bool_fields else 'scale' if scale is not None else None, scale)
+                for name, scale in fields]
+
+    @staticmethod
+    def _unpack_fields(values, plan, result):
+        for (name, kind, scale), value in zip(plan, values):
+            if kind is None:
+                result[name] = value
+            elif kind == 'scale':
+                result[name] = value / scale
+            else:
+                result[name] = value != 0
+        return result
+
+    def _pack_fields(self, data, fields):
+        values = []
+        for name, scale in fields:
+            value = data.get(name, 0)
+            if name in self.bool_fields:
+                value = 1 if value else 0
+            elif scale is not None:
+                value = round(value * scale)
+            values.append(value)
+        return values
+
+    def decode(self, payload):
+        """把二进制负载（含格式ID）解码为与JSON相同字段的字典"""
+        if len(payload) < self.header.size:
+            raise ValueError(f'格式{self.id}的负载长度不足: {len(payload)}')
+        data = self._unpack_fields(self.header.unpack_from(payload)[1:], self._header_plan,
+                                   {'deviceType': self.device_type})
+        if self.item is None:
+            if len(payload) != self.header.size:
+                raise ValueError(f'格式{self.id}的负载长度错误: {len(payload)}')
+            return data
+
+        count = data[self.count_field]
+        if len(payload) != self.header.size + count * self.item.size:
+            raise ValueError(f'格式{self.id}的负载长度错误: {len(payload)}')
+        data[self.items_field] = [self._unpack_fields(values, self._item_plan, {'index': index})
+                                  for index, values in enumerate(self.item.iter_unpack(payload[self.header.size:]))]
+        return data
+
+    def encode(self, data):
+        """把与JSON相同字段的字典编码为二进制负载（参考实现，固件按相同布局编码）"""
+        header = dict(data)
+        items = data.get(self.items_field, []) if self.item else []
+        if self.count_field:
+            header[self.count_field] = len(items)
+        parts = [self.header.pack(self.id, *self._pack_fields(header, self.fields))]
+        for item in items:
+            parts.append(self.item.pack(*self._pack_fields(item, self.item_fields)))
+        return b''.join(parts)
+
+# 格式注册表：格式ID -> 格式
+SCHEMAS = {}
+
+def register_schema(schema):
+    """注册一种二进制格式，格式ID不能重复"""
+    if not 0 < schema.id < 256:
+        raise ValueError(f'格式ID必须在1-255之间: {schema.id}')
+    if schema.id in SCHEMAS:
+        raise ValueError(f'格式ID已被使用: {schema.id}')
+    SCHEMAS[schema.id] = schema
+    return schema
+
+def get_schema(name_or_id):
+    """按格式ID或名称查找格式"""
+    if isinstance(name_or_id, int):
+        return SCHEMAS[name_or_id]
+    for schema in SCHEMAS.values():
+        if schema.name == name_or_id:
+            return schema
+    raise KeyError(name_or_id)
+
+def decode(payload):
+    """按首字节的格式ID解码二进制负载"""
+    if not payload:
+        raise ValueError('空的二进制负载')
+    schema = SCHEMAS.get(payload[0])
+    if schema is None:
+        raise ValueError(f'未知的二进制格式ID: {payload[0]}')
+    return schema.decode(payload)
+
+def encode(name_or_id, data):
+    """按指定格式编码数据"""
+    return get_schema(name_or_id).encode(data)
+
+register_schema(Schema(
+    1, 'temphum', 'TempHum',
+    header='IhH',
+    fields=[('timestamp', None), ('temperature', 100), ('humidity', 100)]
+))
+
+register_schema(Schema(
+    2, 'relay_status', 'SmartRelay',
+    header='IbB',
+    fields=[('timestamp', None), ('rssi', None), ('numOutputs', None)],
+    item='BII',
+    item_fields=[('state', None), ('lastChange', None), ('onDuration', None)],
+    items_field='relays',
+    count_field='numOutputs',
+    bool_fields=['state']
+))
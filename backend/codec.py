@@ -0,0 +1,47 @@
+"""JSON编解码层
+
+安装了orjson时使用orjson，否则使用标准库json；可以通过CODEC_CONFIG['json_backend']指定。
+loads()直接接受MQTT负载的bytes，不需要先decode()为字符串。
+"""
+
+import json
+from config import CODEC_CONFIG
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def _std_loads(data):
+    return json.loads(data)
+
+def _std_dumps(obj):
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
+
+def _orjson_dumps(obj):
+    try:
+        return orjson.dumps(obj).decode()
+    except TypeError:
+        # orjson不支持的类型（如非字符串的键、超过64位的整数）退回标准库
+        return _std_dumps(obj)
+
+BACKENDS = {'json': (_std_loads, _std_dumps)}
+if orjson is not None:
+    BACKENDS['orjson'] = (orjson.loads, _orjson_dumps)
+
+backend = None
+loads = None
+dumps = None
+
+def set_backend(name='auto'):
+    """选择JSON后端：auto（优先orjson）、orjson或json"""
+    global backend, loads, dumps
+    if name == 'auto':
+        name = 'orjson' if 'orjson' in BACKENDS else 'json'
+    if name not in BACKENDS:
+        raise ValueError(f'JSON后端不可用: {name}')
+    backend = name
+    loads, dumps = BACKENDS[name]
+    return name
+
+set_backend(CODEC_CONFIG['json_backend'])
@@ -1,3 +1,5 @@
+import os
+
 # 后端Web服务器配置
 WEB_SERVER_CONFIG = {
     'host': '0.0.0.0',      # 允许所有IP访问
@@ -12,12 +14,199 @@ MQTT_CONFIG = {
     'keepalive': 60,            # 心跳间隔
     'topic_subscribe': 'data/pub',   # 订阅主题
     'topic_publish': 'data/sub',     # 发布主题
+    'device_topics': [               # 额外订阅的设备状态主题
+        'mySmartHome/sensor/#',
+        'mySmartHome/relay/+/status',
+        'mySmartHome/socket/status',
+        'mySmartHome/device/status',  # 设备上线通知（纯文本）
+        'mySmartHome/bin/+'           # 紧凑二进制遥测（格式见binary_telemetry.py）
+    ],
     'username': None,           # 认证用户名(如有)
-    'password': None           # 认证密码(如有)
+    'password': None,          # 认证密码(如有)
+    # 写入进程中的消费者数：1为单个客户端直接订阅；大于1时使用MQTT 5共享订阅
+    # ($share/<share_group>/<主题>)，由多个消费者（各自独立的连接，共用一条写入流水线）分担消息
+    'consumer_count': 1,
+    'share_group': 'smarthome-ingest'  # 共享订阅组名，多个写入进程使用相同组名时共同分担消息
 }
 
 # 数据库配置
 DATABASE_CONFIG = {
     'database_path': 'app.db',  # SQLite数据库文件路径
-    'table_name': 'sensor_data' # 数据表名
-}
\ No newline at end of file
+    'table_name': 'sensor_data', # 数据表名
+    'journal_mode': 'WAL',      # WAL模式下读写互不阻塞
+    'synchronous': 'NORMAL',    # WAL模式下NORMAL即可保证一致性，且提交更快
+    'cache_size': -16000,       # 页缓存大小，负数表示KB（约16MB）
+    'mmap_size': 268435456,     # 内存映射读取大小（256MB）
+    'busy_timeout': 5.0,        # 等待写锁的超时时间(秒)
+    'cached_statements': 256,   # 每个连接缓存的预编译语句数
+    'pool_size': 8              # 连接池保留的空闲连接数
+}
+
+# 登录令牌配置
+AUTH_CONFIG = {
+    'token_ttl': 86400,         # 令牌有效期(秒)
+    'max_tokens': 10000,        # 最多保留的令牌数，超出时淘汰最早过期的令牌
+    'sweep_interval': 60,       # 清理过期令牌的最小间隔(秒)
+    'token_backend': 'memory'   # memory: 进程内存储；sqlite: 存入数据库，多个工作进程共享
+}
+
+# 密码哈希配置
+PASSWORD_CONFIG = {
+    'iterations': 200000,       # PBKDF2-SHA256迭代次数（工作因子），越大越安全也越慢
+    'workers': 4,               # 密码哈希线程池大小
+    'cache_size': 1024,         # 最近验证通过的凭据缓存条数，0表示不缓存
+    'cache_ttl': 300            # 凭据缓存有效期(秒)
+}
+
+# MQTT发布队列配置
+PUBLISH_CONFIG = {
+    'qos': 1,                   # 默认QoS等级
+    'buffer_size': 1000,        # 与代理断开时最多缓存的待发布消息数
+    'ack_timeout': 30,          # 等待代理确认的超时时间(秒)
+    'wait_timeout': 5,          # HTTP接口等待发布结果的时间(秒)
+    'max_bulk': 500             # 批量发布接口单次最多消息数
+}
+
+# MQTT数据写入流水线配置
+INGEST_CONFIG = {
+    'queue_size': 10000,        # 待写入消息队列的最大长度
+    'batch_size': 500,          # 单批最多写入的消息数
+    'flush_interval': 0.5,      # 批次最长等待时间(秒)，到时即使未满也写入
+    'put_timeout': 0.0          # 队列满时入队等待时间(秒)，0表示立即丢弃
+}
+
+# MQTT消息去重配置（按设备ID、设备时间戳和负载哈希识别重连重发和QoS1重传的重复消息）
+DEDUP_CONFIG = {
+    'enabled': True,
+    'window': 600,              # 去重时间窗口(秒)
+    'generations': 3,           # 轮转布隆过滤器的代数，每代覆盖window/(generations-1)秒
+    'bloom_bytes': 1024 * 1024, # 每代布隆过滤器的大小，总内存固定，与设备数量无关
+    'capacity': 600000,         # 每代的设计容量（决定哈希函数个数），写满后提前换代，保证误判率不超过设计值
+    'recent_size': 50000,       # 最近消息表保留的窗口内消息摘要数（按首次出现的顺序淘汰）
+    'require_timestamp': True   # 只对带设备时间戳（timestamp字段）的消息去重
+}
+
+# 写入日志配置（数据库写入失败或跟不上时，数据先顺序写入磁盘日志，再由回放线程写入数据库）
+JOURNAL_CONFIG = {
+    'enabled': True,
+    'directory': 'journal',     # 日志目录，每条写入流水线一个子目录
+    'segment_bytes': 64 * 1024 * 1024,  # 单个日志段的大小，超过后换新文件；已回放的日志段被删除
+    'fsync': True,              # 每批写入后fsync（一批消息一次fsync），False时只保证进程崩溃不丢数据
+    'spill_depth': 0.5,         # 写入队列积压超过队列长度的该比例时，新批次改写日志
+    'replay_batch': 5000,       # 回放时单个事务写入的消息数
+    'retry_interval': 1.0,      # 回放写库失败后的重试间隔(秒)，之后每次加倍
+    'retry_max': 30.0,          # 重试间隔上限(秒)
+    'poison_retries': 3         # 同一批连续失败该次数后逐条写入，单独写入仍失败的记录移到隔离日志
+}
+
+# 规则引擎配置（按规则检查写入的设备数据，条件满足或恢复时发布MQTT消息，规则格式见rules.py）
+RULES_CONFIG = {
+    'enabled': True,
+    'file': 'rules.json',       # 规则文件（JSON数组），不存在时没有规则；修改后自动重新加载
+    'check_interval': 5,        # 检查absent规则和规则文件是否修改的间隔(秒)
+    'min_interval': 1.0         # rate规则的最小采样间隔(秒)，间隔更短的数据不参与计算变化率
+}
+
+# 汇总表与数据保留配置（保留天数为None表示永久保留）
+RETENTION_CONFIG = {
+    'raw_days': 30,             # 原始数据（sensor_data、telemetry）保留天数
+    'rollup_days': {            # 各级汇总表保留天数
+        'telemetry_1m': 90,
+        'telemetry_1h': 730,
+        'telemetry_1d': None
+    },
+    'batch_size': 2000,         # 每次删除的最大行数，避免长时间占用写锁
+    'batch_pause': 0.05,        # 两批删除之间的间隔(秒)，让出写锁给数据写入
+    'interval': 600,            # 清理任务的执行间隔(秒)
+    'rollup_chunk': 50000       # 每次汇总处理的最大原始数据行数
+}
+
+# 串口调试配置
+SERIAL_CONFIG = {
+    'ports': [],                # 枚举不到时额外尝试打开的串口（如pty、固定的设备链接）
+    'port_patterns': [r'ttyUSB', r'ttyACM', r'^COM\d+$', r'cu\.usb'],  # 自动打开的枚举串口
+    'scan_interval': 2.0,       # 扫描串口（热插拔检测）的间隔(秒)
+    'reconnect_min': 1.0,       # 打开失败后第一次重试的等待时间(秒)，之后每次加倍
+    'reconnect_max': 60.0,      # 重试等待时间上限(秒)
+    'identify_command': None,   # 连接后发送的查询设备ID的命令，None表示不查询
+    'identify_pattern': r'(?:ID|MAC)\s*[:=]\s*(\S+)',  # 从查询响应中提取设备ID
+    'baudrate': 115200,         # 波特率
+    'buffer_lines': 2000,       # 每个串口保留的最近输出行数
+    'command_timeout': 2.0,     # 等待命令响应的最长时间(秒)
+    'idle_timeout': 0.3,        # 已有输出后停止输出超过该时间即认为响应结束(秒)
+    'response_pattern': r'^(OK|ERROR|FAIL)\b',  # 表示响应结束的行
+    'prompt_pattern': r'[>#$] ?$',  # 表示设备等待输入的提示符（未换行的输出）
+    'line_ending': '\r\n',     # 命令结尾
+    'response_topic': 'mySmartHome/debug/serial'  # 串口命令结果的发布主题
+}
+
+# 串口日志配置（所有串口的原始输出写入压缩分段文件）
+SERIAL_LOG_CONFIG = {
+    'enabled': True,
+    'directory': 'serial_logs',     # 日志目录，每个串口一个子目录
+    'compression': 'auto',          # auto（安装了zstandard时使用zstd）、zstd或gzip
+    'level': None,                  # 压缩级别，None表示默认（gzip 6，zstd 3）
+    'block_bytes': 65536,           # 数据块的原始大小，每块单独压缩，是查询时解压的最小单位
+    'flush_interval': 2.0,          # 未写满的数据块最长等待时间(秒)
+    'segment_bytes': 8 * 1024 * 1024,       # 单个数据段的压缩后大小，超过后换新文件
+    'segment_seconds': 86400,       # 单个数据段最长覆盖的时间(秒)，超过后换新文件，输出很少的串口也能按保留天数删除
+    'max_total_bytes': 2 * 1024 ** 3,       # 全部日志的磁盘占用上限，超过时删除最旧的数据段
+    'retention_days': 14,           # 日志保留天数
+    'default_window': 3600,         # 查询不指定开始时间时返回最近多少秒
+    'max_lines': 10000              # 单次查询最多返回的行数
+}
+
+# 指标配置（Prometheus文本格式）
+METRICS_CONFIG = {
+    'enabled': True,            # 是否提供/metrics接口
+    'ingest_port': 9101         # 写入进程提供/metrics的端口，None表示不提供
+}
+
+# 日志配置（日志在调用线程上格式化，由后台线程写出）
+LOG_CONFIG = {
+    'level': 'INFO',            # smarthome日志器的级别
+    'levels': {                 # 单个日志器的级别，如 'smarthome.http': 'DEBUG'
+        'smarthome.mqtt.message': 'INFO'
+    },
+    'format': 'json',           # json（每行一个JSON对象）或text
+    'console': True,            # 是否输出到控制台
+    # 日志文件，None表示不写文件；{role}为进程角色，多个HTTP工作进程时文件名后附加进程ID
+    'file': 'logs/{role}.log',
+    'max_bytes': 20 * 1024 * 1024,      # 单个日志文件的大小，超过后滚动
+    'backup_count': 5,          # 保留的旧日志文件数
+    'queue_size': 10000,        # 等待写出的日志行数上限，超过时丢弃并计数
+    'rate_limits': {            # 日志器每秒最多输出的条数，被抑制的条数记在下一条日志的suppressed字段
+        'smarthome.mqtt.message': 5
+    },
+    'sampling': {}              # 日志器每N条只输出一条（警告及以上不采样），如 'smarthome.http': 100
+}
+
+# JSON编解码配置
+CODEC_CONFIG = {
+    'json_backend': 'auto'      # auto（安装了orjson时使用orjson）、orjson或json（标准库）
+}
+
+# 实时数据推送(SSE)配置
+STREAM_CONFIG = {
+    'history_size': 1000,       # 保留的最近消息数，用于断线重连后补发
+    'client_buffer': 200,       # 每个连接的缓冲消息数，消费过慢时丢弃最旧的消息
+    'heartbeat': 15             # 无消息时发送心跳的间隔(秒)
+}
+
+# ASGI服务模式(asgi_app.py)配置
+ASGI_CONFIG = {
+    'db_workers': 8             # 执行数据库查询等阻塞操作的线程数
+}
+
+# 多进程部署配置（launcher.py）
+DEPLOY_CONFIG = {
+    # 进程角色：all为单进程（HTTP和MQTT写入在同一进程），
+    # ingest为唯一订阅MQTT并写库的进程，http为只提供API的无状态工作进程
+    'role': os.environ.get('SMARTHOME_ROLE', 'all'),
+    'server': 'gunicorn',       # HTTP服务：gunicorn(Flask) 或 uvicorn(ASGI)，未安装时退回单进程Flask
+    'http_workers': 4,          # HTTP工作进程数
+    'http_threads': 8,          # 每个gunicorn工作进程的线程数（SSE连接各占一个线程）
+    'tail_interval': 0.5,       # HTTP进程轮询新写入数据的间隔(秒)
+    'tail_batch': 500,          # 每次轮询最多读取的记录数
+    'status_interval': 5        # 写入进程保存运行状态的间隔(秒)
+}
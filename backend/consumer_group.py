@@ -0,0 +1,162 @@
+import os
+import threading
+import time
+import paho.mqtt.client as mqtt
+from ingest import IngestPipeline
+from log import get_logger
+from config import MQTT_CONFIG
+
+logger = get_logger('consumer')
+
+def shared_topic(group, topic):
+    """生成MQTT 5共享订阅主题：$share/<组名>/<主题>"""
+    return f"$share/{group}/{topic}"
+
+class GroupConsumer:
+    """共享订阅组中的一个消费者
+
+    每个消费者有独立的MQTT连接（独立的网络线程和JSON解码），解码后的数据放入组内共用的写入流水线，
+    代理把同一共享订阅上的消息轮流分给组内的消费者。
+    client_factory用于创建MQTT客户端（默认paho的mqtt.Client）。
+    """
+
+    def __init__(self, index, group, topics, handler, pipeline, client_factory=None):
+        self.index = index
+        self.group = group
+        self.topics = topics
+        self.handler = handler
+        self.pipeline = pipeline
+        self.client = (client_factory or mqtt.Client)(client_id=f"{group}-{os.getpid()}-{index}",
+                                                     protocol=mqtt.MQTTv5)
+        if MQTT_CONFIG.get('username'):
+            self.client.username_pw_set(MQTT_CONFIG['username'], MQTT_CONFIG.get('password'))
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+        self.client.on_message = self._on_message
+
+        # 统计计数（只由该消费者的网络线程修改）
+        self.connected = False
+        self.received = 0           # 收到的消息数
+        self.received_bytes = 0     # 收到的负载字节数
+        self.busy_time = 0.0        # 处理消息累计耗时(秒)
+        self.last_received_at = None
+        self.rate = 0               # 上一整秒处理的消息数
+        self._second = 0
+        self._second_count = 0
+
+    def _on_connect(self, client, userdata, flags, rc, properties=None):
+        if rc == 0:
+            self.connected = True
+            for topic in self.topics:
+                client.subscribe(shared_topic(self.group, topic))
+        else:
+            logger.error("Failed to connect", extra={'consumer': self.index, 'rc': rc})
+
+    def _on_disconnect(self, client, userdata, rc, properties=None):
+        self.connected = False
+        if rc != 0:
+            logger.warning("Unexpected disconnection", extra={'consumer': self.index, 'rc': rc})
+
+    def _on_message(self, client, userdata, msg):
+        started = time.perf_counter()
+        self.handler(msg.topic, msg.payload, self.pipeline)
+        self.busy_time += time.perf_counter() - started
+
+        now = time.time()
+        self.received += 1
+        self.received_bytes += len(msg.payload)
+        self.last_received_at = now
+        second = int(now)
+        if second != self._second:
+            self.rate = self._second_count if second == self._second + 1 else 0
+            self._second = second
+            self._second_count = 0
+        self._second_count += 1
+
+    def start(self, host, port, keepalive):
+        """在后台连接代理（断开后由paho自动重连）"""
+        self.client.connect_async(host, port, keepalive)
+        self.client.loop_start()
+
+    def stop(self):
+        """断开连接（离开共享订阅组，代理把之后的消息分给组内其他消费者）"""
+        self.client.disconnect()
+        self.client.loop_stop()
+
+    def stats(self):
+        """返回该消费者的吞吐量统计"""
+        return {
+            'consumer': self.index,
+            'connected': self.connected,
+            'received': self.received,
+            'received_bytes': self.received_bytes,
+            'rate': self.rate if int(time.time()) <= self._second + 1 else 0,
+            'busy_time': round(self.busy_time, 3),
+            'last_received_at': self.last_received_at
+        }
+
+class ConsumerGroup:
+    """MQTT 5共享订阅消费组：K个消费者共同消费同一组主题，每条消息只由其中一个处理
+
+    多个写入进程（或多台主机）使用相同的组名时也会加入同一个组，共同分担消息。
+    消费者分担网络接收和解码，写库由组内共用的一条写入流水线（一个写线程）完成：SQLite同时只允许一个写事务，
+    多个写线程只会互相等待写锁、把批次拆小，因此写库吞吐量是扩展的上限。
+    pipeline为共用的写入流水线（如mqtt_handler.ingest_pipeline），不指定时由消费组创建并负责启停。
+    """
+
+    def __init__(self, handler, count=None, group=None, topics=None, pipeline=None, client_factory=None):
+        self.handler = handler
+        self.count = count or MQTT_CONFIG['consumer_count']
+        self.group = group or MQTT_CONFIG['share_group']
+        self.topics = topics or [MQTT_CONFIG['topic_subscribe']] + MQTT_CONFIG.get('device_topics', [])
+        self._owns_pipeline = pipeline is None
+        self.pipeline = pipeline if pipeline is not None else IngestPipeline(name='ingest-writer-group')
+        self.client_factory = client_factory
+        self.consumers = []
+        self._lock = threading.Lock()
+        self._started = False
+
+    def start(self, host=None, port=None, keepalive=None):
+        """启动所有消费者"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            # 首次启动时才创建消费者的MQTT客户端
+            if not self.consumers:
+                self.consumers = [GroupConsumer(index, self.group, self.topics, self.handler, self.pipeline,
+                                                self.client_factory)
+                                  for index in range(self.count)]
+        self.pipeline.start()
+        for consumer in self.consumers:
+            consumer.start(
+                host or MQTT_CONFIG['broker_url'],
+                int(port or MQTT_CONFIG['port']),
+                int(keepalive or MQTT_CONFIG['keepalive'])
+            )
+
+    def stop(self):
+        """停止所有消费者"""
+        with self._lock:
+            if not self._started:
+                return
+            self._started = False
+        for consumer in self.consumers:
+            consumer.stop()
+        if self._owns_pipeline:
+            # 写完流水线中剩余的数据
+            self.pipeline.stop()
+
+    def stats(self):
+        """返回写入流水线的统计、消费组汇总统计和每个消费者的统计
+
+        max_lag为最近一批消息从接收到写入数据库的时间，queue_depth为尚未写入的消息数。
+        """
+        consumers = [consumer.stats() for consumer in self.consumers]
+        stats = self.pipeline.stats()
+        for key in ('received', 'rate'):
+            stats[key] = sum(consumer[key] for consumer in consumers)
+        stats['max_lag'] = stats['last_lag']
+        stats['group'] = self.group
+        stats['consumers'] = consumers
+        return stats
@@ -0,0 +1,62 @@
+import threading
+from database import get_data_since, get_last_data_id
+from log import get_logger
+from config import DEPLOY_CONFIG
+
+logger = get_logger('tail')
+
+class DataTail:
+    """HTTP工作进程中跟踪写入进程新写入的数据
+
+    多进程部署时只有写入进程订阅MQTT，HTTP进程按ID顺序轮询sensor_data中的新记录，
+    交给handler（更新设备状态缓存、推送给SSE订阅者）。记录ID由数据库分配，
+    所有HTTP进程看到的顺序和ID都相同，浏览器断线后重连到其他进程也能继续接收。
+    """
+
+    def __init__(self, handler, interval=None, batch_size=None):
+        self.handler = handler
+        self.interval = interval or DEPLOY_CONFIG['tail_interval']
+        self.batch_size = batch_size or DEPLOY_CONFIG['tail_batch']
+        self.last_id = None
+        self.received = 0
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self, last_id=None):
+        """启动轮询线程，默认从当前最新记录之后开始"""
+        if self._thread and self._thread.is_alive():
+            return
+        self.last_id = get_last_data_id() if last_id is None else last_id
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='data-tail', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        """停止轮询线程"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def stats(self):
+        """返回轮询统计"""
+        return {'last_id': self.last_id, 'received': self.received}
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                rows = get_data_since(self.last_id, self.batch_size)
+            except Exception as e:
+                logger.error("Error reading new data", extra={'error': str(e)})
+                rows = []
+
+            for row in rows:
+                try:
+                    self.handler(row)
+                except Exception as e:
+                    logger.error("Error handling row", extra={'id': row['id'], 'error': str(e)})
+                self.last_id = row['id']
+            self.received += len(rows)
+
+            # 读满一批说明还有积压，立即继续读取
+            if len(rows) < self.batch_size:
+                self._stop_event.wait(self.interval)
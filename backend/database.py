@@ -1,121 +1,617 @@
 import sqlite3
-from datetime import datetime
+from datetime import datetime, timezone
 import json
-import hashlib
+import math
+import threading
+import time
+from contextlib import contextmanager
+import codec
+from metrics import registry
+from log import get_logger
+from config import DATABASE_CONFIG, RETENTION_CONFIG
+from telemetry import normalize
+from passwords import credential_cache, hash_password, needs_rehash, verify_password
+from rollup import (advance_rollups, create_rollup_tables, get_watermark, pick_rollup,
+                    prune_raw_batch, prune_rollup_batch)
+
+# 数据库结构版本（记录在PRAGMA user_version中）
+SCHEMA_VERSION = 6
+
+logger = get_logger('database')
+
+# 空闲连接池（连接长期保持打开，避免每次请求重新打开数据库和解析表结构）
+_pool = []
+_pool_lock = threading.Lock()
+# 当前线程正在使用的连接，嵌套调用时复用同一个连接
+_local = threading.local()
+
+QUERY_SECONDS = registry.histogram('smarthome_db_query_seconds', '数据库查询耗时', ['query'])
+_recent_query = QUERY_SECONDS.labels('recent_data')
+_telemetry_query = QUERY_SECONDS.labels('telemetry')
+_buckets_query = QUERY_SECONDS.labels('telemetry_buckets')
+registry.function('gauge', 'smarthome_db_pool_idle', '连接池中空闲的数据库连接数', lambda: len(_pool))
+REJECTED = registry.counter('smarthome_db_rejected_total', '无法转换为数据库行、被跳过的消息数')
+
+def _open_connection():
+    """打开一个新连接并设置PRAGMA"""
+    conn = sqlite3.connect(
+        DATABASE_CONFIG['database_path'],
+        timeout=DATABASE_CONFIG['busy_timeout'],
+        isolation_level=None,           # 自动提交，写事务由write_connection显式开启
+        check_same_thread=False,        # 连接在线程间借还，同一时刻只被一个线程使用
+        cached_statements=DATABASE_CONFIG['cached_statements']
+    )
+    conn.execute(f"PRAGMA journal_mode={DATABASE_CONFIG['journal_mode']}")
+    conn.execute(f"PRAGMA synchronous={DATABASE_CONFIG['synchronous']}")
+    conn.execute(f"PRAGMA cache_size={int(DATABASE_CONFIG['cache_size'])}")
+    conn.execute(f"PRAGMA mmap_size={int(DATABASE_CONFIG['mmap_size'])}")
+    conn.execute(f"PRAGMA busy_timeout={int(DATABASE_CONFIG['busy_timeout'] * 1000)}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+@contextmanager
+def get_connection():
+    """从连接池借出一个连接，用完后归还"""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        yield conn
+        return
+
+    with _pool_lock:
+        conn = _pool.pop() if _pool else None
+    if conn is None:
+        conn = _open_connection()
+
+    _local.conn = conn
+    try:
+        yield conn
+    finally:
+        _local.conn = None
+        if conn.in_transaction:
+            conn.rollback()
+        with _pool_lock:
+            if len(_pool) < DATABASE_CONFIG['pool_size']:
+                _pool.append(conn)
+                conn = None
+        if conn is not None:
+            conn.close()
+
+@contextmanager
+def write_connection():
+    """开启写事务（BEGIN IMMEDIATE），正常结束时提交，出错时回滚"""
+    with get_connection() as conn:
+        if conn.in_transaction:
+            # 已处于外层写事务中，由外层负责提交
+            yield conn
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+
+def close_all_connections():
+    """关闭连接池中的所有空闲连接"""
+    with _pool_lock:
+        while _pool:
+            _pool.pop().close()
 
 def init_db():
     """初始化数据库表"""
-    conn = sqlite3.connect('app.db')
-    c = conn.cursor()
-    
-    # 创建传感器数据表
-    c.execute('''CREATE TABLE IF NOT EXISTS sensor_data
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                  data TEXT)''')
-    
-    # 创建用户表
-    c.execute('''CREATE TABLE IF NOT EXISTS users
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  username TEXT UNIQUE NOT NULL,
-                  password TEXT NOT NULL,
-                  email TEXT UNIQUE,
-                  created_at DATETIME DEFAULT CURRENT_TIMESTAMP)''')
-    
-    conn.commit()
-    conn.close()
-
-def insert_data(data):
+    with write_connection() as conn:
+        c = conn.cursor()
+
+        # 创建传感器数据表
+        c.execute('''CREATE TABLE IF NOT EXISTS sensor_data
+                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                      timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                      data TEXT)''')
+
+        # 创建用户表
+        c.execute('''CREATE TABLE IF NOT EXISTS users
+                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                      username TEXT UNIQUE NOT NULL,
+                      password TEXT NOT NULL,
+                      email TEXT UNIQUE,
+                      created_at DATETIME DEFAULT CURRENT_TIMESTAMP)''')
+
+        migrate_db(conn)
+
+    catch_up_rollups()
+
+def migrate_db(conn):
+    """按PRAGMA user_version逐步升级数据库结构"""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+
+    if version < 1:
+        # 结构化时序数据：每个指标一行，按设备和时间建立联合索引
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(sensor_data)")]
+        if 'topic' not in columns:
+            conn.execute("ALTER TABLE sensor_data ADD COLUMN topic TEXT")
+        if 'device_id' not in columns:
+            conn.execute("ALTER TABLE sensor_data ADD COLUMN device_id TEXT")
+        _create_telemetry_table(conn, 'telemetry')
+        _create_telemetry_indexes(conn)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_sensor_data_timestamp ON sensor_data (timestamp)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_sensor_data_device ON sensor_data (device_id, id)")
+        _backfill_telemetry(conn)
+
+    if version < 2:
+        # 1分钟/1小时/1天汇总表，由catch_up_rollups()追平历史数据
+        create_rollup_tables(conn)
+
+    if version < 3:
+        # 登录令牌表（token_backend为sqlite时使用，多个工作进程共享）
+        conn.execute('''CREATE TABLE IF NOT EXISTS auth_tokens
+                        (token TEXT PRIMARY KEY,
+                         user TEXT NOT NULL,
+                         expires_at REAL NOT NULL) WITHOUT ROWID''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_auth_tokens_expires ON auth_tokens (expires_at)")
+
+    if version < 4:
+        # 各进程的运行状态（多进程部署时HTTP进程从这里读取写入进程的统计信息）
+        conn.execute('''CREATE TABLE IF NOT EXISTS service_status
+                        (name TEXT PRIMARY KEY,
+                         updated_at REAL NOT NULL,
+                         data TEXT NOT NULL) WITHOUT ROWID''')
+
+    if version < 5:
+        # 写入日志的回放进度（与回放的数据在同一事务中更新，回放不会重复写入）
+        conn.execute('''CREATE TABLE IF NOT EXISTS ingest_journal
+                        (name TEXT PRIMARY KEY,
+                         seq INTEGER NOT NULL) WITHOUT ROWID''')
+
+    if version < 6:
+        # telemetry.id改为AUTOINCREMENT：汇总水位线假定id只增不减，没有AUTOINCREMENT时
+        # 表被清理空后id从1重新开始，新数据落在水位线以下，不会被汇总，还会被当作已汇总的数据删除
+        sql = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'telemetry'").fetchone()[0]
+        if 'AUTOINCREMENT' not in sql.upper():
+            _create_telemetry_table(conn, 'telemetry_new')
+            conn.execute("INSERT INTO telemetry_new (id, ts, device_id, topic, metric, value) "
+                         "SELECT id, ts, device_id, topic, metric, value FROM telemetry")
+            conn.execute("DROP TABLE telemetry")
+            conn.execute("ALTER TABLE telemetry_new RENAME TO telemetry")
+            _create_telemetry_indexes(conn)
+        # 之后分配的id都大于水位线（即使表已被清理空）
+        conn.execute("DELETE FROM sqlite_sequence WHERE name = 'telemetry'")
+        conn.execute("INSERT INTO sqlite_sequence (name, seq) "
+                     "SELECT 'telemetry', MAX(?, IFNULL(MAX(id), 0)) FROM telemetry", (get_watermark(conn),))
+
+    conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+def _create_telemetry_table(conn, name):
+    """创建时序数据表（id为AUTOINCREMENT，清理旧数据后也不会复用）"""
+    conn.execute(f'''CREATE TABLE IF NOT EXISTS {name}
+                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                      ts REAL NOT NULL,
+                      device_id TEXT NOT NULL,
+                      topic TEXT,
+                      metric TEXT NOT NULL,
+                      value REAL)''')
+
+def _create_telemetry_indexes(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_telemetry_device_ts ON telemetry (device_id, ts)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_telemetry_device_metric_ts ON telemetry (device_id, metric, ts)")
+
+def _parse_timestamp(value):
+    """把sensor_data中的UTC时间字符串转换为Unix时间戳"""
+    try:
+        return datetime.strptime(value, '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc).timestamp()
+    except (TypeError, ValueError):
+        return time.time()
+
+def _backfill_telemetry(conn, chunk_size=5000):
+    """把已有的sensor_data记录拆分写入telemetry表"""
+    last_id = 0
+    while True:
+        rows = conn.execute("SELECT id, timestamp, data FROM sensor_data WHERE id > ? ORDER BY id LIMIT ?",
+                            (last_id, chunk_size)).fetchall()
+        if not rows:
+            break
+
+        device_updates = []
+        telemetry_rows = []
+        for row_id, timestamp, payload in rows:
+            try:
+                data = json.loads(payload)
+            except (TypeError, ValueError):
+                continue
+            device_id, metrics = normalize(None, data, _parse_timestamp(timestamp))
+            device_updates.append((device_id, row_id))
+            telemetry_rows.extend(metrics)
+
+        conn.executemany("UPDATE sensor_data SET device_id = ? WHERE id = ?", device_updates)
+        conn.executemany("INSERT INTO telemetry (ts, device_id, topic, metric, value) VALUES (?, ?, ?, ?, ?)",
+                         telemetry_rows)
+        last_id = rows[-1][0]
+
+def _reject_constant(name):
+    raise ValueError(f'非标准JSON常量: {name}')
+
+def _is_strict_json(text):
+    """text中是否没有NaN、Infinity等非标准常量（标准库json解析和序列化时都接受它们）"""
+    if 'NaN' not in text and 'Infinity' not in text:
+        return True
+    try:
+        json.loads(text, parse_constant=_reject_constant)
+    except ValueError:
+        return False
+    return True
+
+def _finite(value):
+    """把NaN、±Infinity替换为None"""
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {key: _finite(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_finite(item) for item in value]
+    return value
+
+def _strict_dumps(data):
+    text = codec.dumps(data)
+    return text if _is_strict_json(text) else codec.dumps(_finite(data))
+
+def _stored_json(data, raw):
+    """返回要保存的JSON文本：优先使用已校验的原始负载
+
+    保存的文本会原样拼接进API响应，必须是严格的JSON；含NaN、Infinity的负载重新序列化（替换为null）。
+    """
+    if raw is not None:
+        try:
+            text = raw.decode('utf-8') if isinstance(raw, (bytes, bytearray)) else raw
+        except UnicodeDecodeError:
+            text = None
+        if text is not None and _is_strict_json(text):
+            return text
+    return _strict_dumps(data)
+
+def insert_data(data, topic=None):
     """插入传感器数据"""
-    conn = sqlite3.connect('app.db')
-    c = conn.cursor()
-    c.execute("INSERT INTO sensor_data (data) VALUES (?)", 
-              (json.dumps(data),))
-    conn.commit()
-    conn.close()
+    insert_data_batch([(topic, time.time(), data)])
+
+def insert_data_batch(items, journal=None):
+    """批量插入传感器数据（一次executemany，一次提交）
+
+    items为 (主题, 接收时间, 数据) 或 (主题, 接收时间, 数据, 原始JSON负载) 的列表；
+    原始数据写入sensor_data（带原始负载时原样保存，不重新序列化），拆分出的数值指标写入telemetry。
+    journal为 (日志名, 序号) 时是从写入日志回放的数据：sensor_data使用消息的接收时间，
+    并在同一事务中记录回放进度（items为空时只记录回放进度）。
+    无法转换的消息被跳过并记录日志，不影响同一批中的其他消息。返回写入的消息数。
+    """
+    if not items and journal is None:
+        return 0
+
+    sensor_rows = []
+    telemetry_rows = []
+    for item in items:
+        topic, received_at, data = item[:3]
+        raw = item[3] if len(item) > 3 else None
+        try:
+            device_id, metrics = normalize(topic, data, received_at)
+            stored = _stored_json(data, raw)
+            if journal is not None:
+                timestamp = datetime.fromtimestamp(received_at, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        except (ValueError, TypeError, OverflowError) as e:
+            REJECTED.inc()
+            logger.warning("Skipping message that cannot be stored", extra={'topic': topic, 'error': str(e)})
+            continue
+        if journal is None:
+            sensor_rows.append((topic, device_id, stored))
+        else:
+            sensor_rows.append((topic, device_id, stored, timestamp))
+        telemetry_rows.extend(metrics)
+
+    with write_connection() as conn:
+        if journal is None:
+            conn.executemany("INSERT INTO sensor_data (topic, device_id, data) VALUES (?, ?, ?)", sensor_rows)
+        else:
+            conn.executemany("INSERT INTO sensor_data (topic, device_id, data, timestamp) VALUES (?, ?, ?, ?)",
+                             sensor_rows)
+            conn.execute('''INSERT INTO ingest_journal (name, seq) VALUES (?, ?)
+                            ON CONFLICT(name) DO UPDATE SET seq = excluded.seq''', journal)
+        conn.executemany("INSERT INTO telemetry (ts, device_id, topic, metric, value) VALUES (?, ?, ?, ?, ?)",
+                         telemetry_rows)
+        # 在同一事务中更新汇总表，保证汇总数据与原始数据一致
+        advance_rollups(conn, RETENTION_CONFIG['rollup_chunk'])
+    return len(sensor_rows)
+
+def catch_up_rollups():
+    """分批把积压的原始数据合并进汇总表（用于启动和升级后）"""
+    total = 0
+    while True:
+        with write_connection() as conn:
+            processed = advance_rollups(conn, RETENTION_CONFIG['rollup_chunk'])
+        if not processed:
+            return total
+        total += processed
+
+def prune_expired():
+    """按保留天数分批删除过期的原始数据和汇总数据，返回各表删除的行数
+
+    每批使用单独的短事务，批与批之间暂停，避免阻塞数据写入。
+    """
+    batch_size = RETENTION_CONFIG['batch_size']
+    pause = RETENTION_CONFIG['batch_pause']
+    now = time.time()
+    deleted = {}
+
+    def run_batches(name, prune):
+        count = 0
+        while True:
+            with write_connection() as conn:
+                removed = prune(conn)
+            count += removed
+            if removed <= 0:
+                break
+            time.sleep(pause)
+        deleted[name] = count
+
+    raw_days = RETENTION_CONFIG['raw_days']
+    if raw_days:
+        cutoff = now - raw_days * 86400
+        cutoff_text = datetime.fromtimestamp(cutoff, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        run_batches('telemetry', lambda conn: prune_raw_batch(conn, cutoff, batch_size))
+        run_batches('sensor_data', lambda conn: conn.execute(
+            '''DELETE FROM sensor_data WHERE id IN
+               (SELECT id FROM sensor_data ORDER BY id LIMIT ?) AND timestamp < ?''',
+            (batch_size, cutoff_text)).rowcount)
+
+    for table, days in RETENTION_CONFIG['rollup_days'].items():
+        if days:
+            cutoff = now - days * 86400
+            run_batches(table, lambda conn: prune_rollup_batch(conn, table, cutoff, batch_size))
+
+    return deleted
 
 def get_recent_data(limit=10):
     """获取最近的数据记录"""
-    conn = sqlite3.connect('app.db')
-    c = conn.cursor()
-    c.execute("SELECT id, timestamp, data FROM sensor_data ORDER BY timestamp DESC LIMIT ?", 
-              (limit,))
-    
-    rows = c.fetchall()
+    with _recent_query.time(), get_connection() as conn:
+        rows = conn.execute("SELECT id, timestamp, data FROM sensor_data ORDER BY id DESC LIMIT ?",
+                            (limit,)).fetchall()
+
     result = []
     for row in rows:
         result.append({
             'id': row[0],
             'timestamp': row[1],
-            'data': json.loads(row[2])
+            'data': codec.loads(row[2])
+        })
+    return result
+
+def get_recent_data_json(limit=10):
+    """获取最近的数据记录，直接返回JSON数组文本
+
+    保存的data已经是JSON文本，直接拼接进结果，不逐行解析再序列化。
+    """
+    with _recent_query.time(), get_connection() as conn:
+        rows = conn.execute("SELECT id, timestamp, data FROM sensor_data ORDER BY id DESC LIMIT ?",
+                            (limit,)).fetchall()
+
+    return '[' + ','.join(f'{{"id":{row[0]},"timestamp":{codec.dumps(row[1])},"data":{_response_json(row[2])}}}'
+                          for row in rows) + ']'
+
+def _response_json(stored):
+    """保存的data文本；早期版本保存的含NaN、Infinity的负载重新序列化后返回"""
+    if not stored:
+        return 'null'
+    if _is_strict_json(stored):
+        return stored
+    try:
+        return _strict_dumps(json.loads(stored))
+    except ValueError:
+        return 'null'
+
+def get_last_data_id():
+    """获取sensor_data中最新记录的ID"""
+    with get_connection() as conn:
+        return conn.execute("SELECT COALESCE(MAX(id), 0) FROM sensor_data").fetchone()[0]
+
+def get_data_since(last_id, limit=500):
+    """按ID顺序获取last_id之后写入的记录，用于HTTP进程跟踪写入进程新写入的数据"""
+    with get_connection() as conn:
+        rows = conn.execute('''SELECT id, timestamp, topic, device_id, data FROM sensor_data
+                              WHERE id > ? ORDER BY id LIMIT ?''', (last_id, limit)).fetchall()
+
+    result = []
+    for row_id, timestamp, topic, device_id, payload in rows:
+        try:
+            data = codec.loads(payload)
+        except (TypeError, ValueError):
+            data = None
+        result.append({
+            'id': row_id,
+            'ts': _parse_timestamp(timestamp),
+            'topic': topic,
+            'device': device_id,
+            'data': data
         })
-    
-    conn.close()
     return result
 
-def hash_password(password):
-    """对密码进行哈希处理"""
-    return hashlib.sha256(password.encode()).hexdigest()
+def get_telemetry(device_id, metric=None, start=None, end=None, limit=1000):
+    """按设备（和指标）查询时间范围内的时序数据，start/end为Unix时间戳"""
+    sql = "SELECT ts, metric, value FROM telemetry WHERE device_id = ?"
+    params = [device_id]
+    if metric:
+        sql += " AND metric = ?"
+        params.append(metric)
+    if start is not None:
+        sql += " AND ts >= ?"
+        params.append(start)
+    if end is not None:
+        sql += " AND ts < ?"
+        params.append(end)
+    sql += " ORDER BY ts DESC LIMIT ?"
+    params.append(limit)
+
+    with _telemetry_query.time(), get_connection() as conn:
+        rows = conn.execute(sql, params).fetchall()
+
+    return [{'ts': row[0], 'metric': row[1], 'value': row[2]} for row in rows]
+
+def get_telemetry_buckets(device_id=None, metric=None, start=None, end=None, bucket=60):
+    """按时间桶聚合时序数据，在SQL中计算每个桶的最小/平均/最大值
+
+    时间桶是某个汇总表精度的整数倍时，自动使用能满足精度的最粗汇总表，否则使用原始数据。
+    返回 (数据来源表名, [{'device': 设备ID, 'metric': 指标名, 'points': [[桶起始时间, min, avg, max, count], ...]}, ...])
+    """
+    rollup = pick_rollup(bucket)
+    if rollup:
+        source, seconds = rollup
+        sql = (f"SELECT device_id, metric, CAST(bucket / ? AS INTEGER) * ? AS b, "
+               f"MIN(min), SUM(sum) / SUM(count), MAX(max), SUM(count) FROM {source} WHERE 1 = 1")
+        time_column = 'bucket'
+        # 汇总桶的起始时间按汇总精度对齐
+        if start is not None:
+            start = int(start // seconds) * seconds
+    else:
+        source = 'telemetry'
+        sql = ("SELECT device_id, metric, CAST(ts / ? AS INTEGER) * ? AS b, "
+               "MIN(value), AVG(value), MAX(value), COUNT(value) FROM telemetry WHERE 1 = 1")
+        time_column = 'ts'
+
+    params = [bucket, bucket]
+    if device_id:
+        sql += " AND device_id = ?"
+        params.append(device_id)
+    if metric:
+        sql += " AND metric = ?"
+        params.append(metric)
+    if start is not None:
+        sql += f" AND {time_column} >= ?"
+        params.append(start)
+    if end is not None:
+        sql += f" AND {time_column} < ?"
+        params.append(end)
+    sql += " GROUP BY device_id, metric, b ORDER BY device_id, metric, b"
+
+    with _buckets_query.time(), get_connection() as conn:
+        rows = conn.execute(sql, params).fetchall()
+
+    series = []
+    current = None
+    for device, name, bucket_start, vmin, vavg, vmax, count in rows:
+        if current is None or current['device'] != device or current['metric'] != name:
+            current = {'device': device, 'metric': name, 'points': []}
+            series.append(current)
+        current['points'].append([bucket_start, vmin, vavg, vmax, count])
+    return source, series
+
+def get_latest_states():
+    """查询每个设备每个指标的最新值和最新一条原始数据，用于启动时预热状态缓存
+
+    返回 [{'device': 设备ID, 'topic': 主题, 'ts': 时间, 'metrics': {指标名: 数值}, 'data': 原始数据}, ...]
+    """
+    states = {}
+    with get_connection() as conn:
+        # 设备/指标列表取自日汇总表（数据量很小），再逐个按索引取最新值
+        series = conn.execute("SELECT DISTINCT device_id, metric FROM telemetry_1d").fetchall()
+        for device_id, metric in series:
+            row = conn.execute('''SELECT ts, topic, value FROM telemetry
+                                  WHERE device_id = ? AND metric = ? ORDER BY ts DESC LIMIT 1''',
+                               (device_id, metric)).fetchone()
+            if row is None:
+                continue
+            state = states.setdefault(device_id, {'device': device_id, 'topic': row[1], 'ts': row[0],
+                                                  'metrics': {}, 'data': None})
+            if row[0] > state['ts']:
+                state['ts'] = row[0]
+                state['topic'] = row[1]
+            state['metrics'][metric] = row[2]
+
+        for device_id, state in states.items():
+            row = conn.execute("SELECT data FROM sensor_data WHERE device_id = ? ORDER BY id DESC LIMIT 1",
+                               (device_id,)).fetchone()
+            if row:
+                state['data'] = codec.loads(row[0])
+    return list(states.values())
+
+def get_journal_seq(name):
+    """返回写入日志已回放到数据库的最大序号，没有记录时返回0"""
+    with get_connection() as conn:
+        row = conn.execute("SELECT seq FROM ingest_journal WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else 0
+
+def set_service_status(name, data):
+    """保存某个进程的运行状态"""
+    with write_connection() as conn:
+        conn.execute('''INSERT INTO service_status (name, updated_at, data) VALUES (?, ?, ?)
+                        ON CONFLICT(name) DO UPDATE SET updated_at = excluded.updated_at, data = excluded.data''',
+                     (name, time.time(), json.dumps(data)))
+
+def get_service_status(name):
+    """读取某个进程的运行状态，返回 {'updated_at': 时间, 'data': 状态}，不存在时返回None"""
+    with get_connection() as conn:
+        row = conn.execute("SELECT updated_at, data FROM service_status WHERE name = ?", (name,)).fetchone()
+    if row is None:
+        return None
+    return {'updated_at': row[0], 'data': json.loads(row[1])}
 
 def register_user(username, password, email=None):
     """注册新用户"""
-    conn = sqlite3.connect('app.db')
-    c = conn.cursor()
-    
     try:
         hashed_password = hash_password(password)
-        c.execute("INSERT INTO users (username, password, email) VALUES (?, ?, ?)",
-                 (username, hashed_password, email))
-        conn.commit()
-        conn.close()
+        with write_connection() as conn:
+            conn.execute("INSERT INTO users (username, password, email) VALUES (?, ?, ?)",
+                         (username, hashed_password, email))
         return True, "用户注册成功"
     except sqlite3.IntegrityError:
-        conn.close()
         return False, "用户名或邮箱已存在"
     except Exception as e:
-        conn.close()
         return False, str(e)
 
 def verify_user(username, password):
     """验证用户登录"""
-    conn = sqlite3.connect('app.db')
-    c = conn.cursor()
-    
-    c.execute("SELECT id, username, password FROM users WHERE username = ?", (username,))
-    user = c.fetchone()
-    conn.close()
-    
-    if user and user[2] == hash_password(password):
-        return True, {"id": user[0], "username": user[1]}
-    
+    with get_connection() as conn:
+        user = conn.execute("SELECT id, username, password FROM users WHERE username = ?",
+                            (username,)).fetchone()
+    if not user:
+        return False, "用户名或密码错误"
+
+    # 最近验证通过、且数据库中的密码哈希未变的凭据直接返回，跳过密码哈希计算
+    # （其他工作进程修改密码后哈希不同，缓存不再命中）
+    cached = credential_cache.get(username, password, user[2])
+    if cached is not None:
+        return True, cached
+
+    if verify_password(password, user[2]):
+        result = {"id": user[0], "username": user[1]}
+        stored = user[2]
+        if needs_rehash(stored):
+            # 旧格式或工作因子已调整，登录成功时顺便升级存储的哈希
+            new_hash = hash_password(password)
+            with write_connection() as conn:
+                if conn.execute("UPDATE users SET password = ? WHERE id = ? AND password = ?",
+                                (new_hash, user[0], stored)).rowcount:
+                    stored = new_hash
+        credential_cache.put(username, password, stored, result)
+        return True, result
+
     return False, "用户名或密码错误"
 
 def update_user_password(user_id, current_password, new_password):
     """更新用户密码"""
-    conn = sqlite3.connect('app.db')
-    c = conn.cursor()
-    
-    # 首先验证当前密码是否正确
-    c.execute("SELECT password FROM users WHERE id = ?", (user_id,))
-    user = c.fetchone()
-    
-    if not user:
-        conn.close()
-        return False, "用户不存在"
-    
-    if user[0] != hash_password(current_password):
-        conn.close()
-        return False, "当前密码不正确"
-    
-    # 更新密码
     try:
+        with get_connection() as conn:
+            # 首先验证当前密码是否正确
+            user = conn.execute("SELECT password FROM users WHERE id = ?", (user_id,)).fetchone()
+
+        if not user:
+            return False, "用户不存在"
+
+        if not verify_password(current_password, user[0]):
+            return False, "当前密码不正确"
+
+        # 更新密码（只有密码在校验后未被修改时才更新）
         hashed_new_password = hash_password(new_password)
-        c.execute("UPDATE users SET password = ? WHERE id = ?", 
-                 (hashed_new_password, user_id))
-        conn.commit()
-        conn.close()
+        with write_connection() as conn:
+            updated = conn.execute("UPDATE users SET password = ? WHERE id = ? AND password = ?",
+                                   (hashed_new_password, user_id, user[0])).rowcount
+        credential_cache.invalidate_user(user_id)
+        if not updated:
+            return False, "密码已被修改，请重试"
         return True, "密码更新成功"
     except Exception as e:
-        conn.rollback()
-        conn.close()
-        return False, str(e)
\ No newline at end of file
+        return False, str(e)
@@ -0,0 +1,190 @@
+"""MQTT消息去重
+
+设备重连后重发、QoS1重传都会让同一条数据到达多次。消息按 (设备ID, 设备时间戳, 负载哈希) 识别，
+在时间窗口（至少window秒）内再次出现时丢弃，不写库也不推送：
+  - 轮转布隆过滤器：每代固定字节数，每隔window/(generations-1)秒（或本代写满capacity条时）
+    换新一代并丢弃最旧的一代，内存占用固定，与设备数量无关
+  - 最近消息表：窗口内最近recent_size条消息的摘要和首次出现时间，按首次出现的顺序（FIFO）淘汰，
+    超过时间窗口的条目也从表头删除。命中该表的是确定的重复；只命中布隆过滤器的消息，
+    若因表满被淘汰的摘要都早于最旧的一代则可以确定是误判（放行并计数），否则按重复处理
+没有设备时间戳的消息（如继电器状态）可能是内容相同的正常上报，默认不去重。
+"""
+
+import hashlib
+import math
+import struct
+import threading
+import time
+from collections import OrderedDict
+from telemetry import extract_device_id
+from metrics import registry
+from config import DEDUP_CONFIG
+
+# 从32字节的摘要中取最多8个32位整数作为布隆过滤器的位置
+MAX_HASHES = 8
+_POSITIONS = struct.Struct('<8I')
+
+class BloomFilter:
+    """固定大小的布隆过滤器（k个位置直接取自消息摘要的不同字节）"""
+
+    __slots__ = ('bits', 'size', 'hashes', 'count', 'started')
+
+    def __init__(self, size_bytes, hashes, started):
+        self.bits = bytearray(size_bytes)
+        self.size = size_bytes * 8
+        self.hashes = hashes
+        self.count = 0
+        self.started = started
+
+    def positions(self, digest):
+        size = self.size
+        return [value % size for value in _POSITIONS.unpack(digest)[:self.hashes]]
+
+    def contains(self, positions):
+        bits = self.bits
+        for position in positions:
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def add(self, positions):
+        bits = self.bits
+        for position in positions:
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def fill_ratio(self):
+        """置位比例（抽样统计）"""
+        sample = self.bits[::max(1, len(self.bits) // 4096)]
+        return sum(bin(byte).count('1') for byte in sample) / (len(sample) * 8)
+
+class Deduplicator:
+    """时间窗口内的消息去重：轮转布隆过滤器 + 精确的最近消息表"""
+
+    def __init__(self, window=None, generations=None, bloom_bytes=None, capacity=None, recent_size=None,
+                 require_timestamp=None, clock=time.time):
+        self.window = window or DEDUP_CONFIG['window']
+        self.generations = max(2, generations or DEDUP_CONFIG['generations'])
+        self.bloom_bytes = bloom_bytes or DEDUP_CONFIG['bloom_bytes']
+        self.capacity = capacity or DEDUP_CONFIG['capacity']
+        self.recent_size = recent_size or DEDUP_CONFIG['recent_size']
+        self.require_timestamp = (DEDUP_CONFIG['require_timestamp'] if require_timestamp is None
+                                  else require_timestamp)
+        self.clock = clock
+        # 每代的时间跨度：保留的generations-1个旧代覆盖完整的时间窗口
+        self.span = self.window / (self.generations - 1)
+        # 按每代容量选择最优哈希数 k = m/n * ln2（最多MAX_HASHES个）
+        self.hashes = min(MAX_HASHES, max(1, round(self.bloom_bytes * 8 / self.capacity * math.log(2))))
+        self._filters = [BloomFilter(self.bloom_bytes, self.hashes, clock())]
+        self._recent = OrderedDict()    # 摘要 -> 首次出现时间，按首次出现的顺序排列（FIFO）
+        self._evicted_at = None         # 最近因表满被淘汰的摘要的首次出现时间
+        self._lock = threading.Lock()
+
+        # 统计计数
+        self.checked = 0            # 检查的消息数
+        self.skipped = 0            # 没有设备时间戳、未检查的消息数
+        self.duplicates = 0         # 命中最近消息表的重复消息数
+        self.probable_duplicates = 0    # 只命中布隆过滤器、按重复丢弃的消息数
+        self.false_positives = 0    # 确定为布隆过滤器误判、已放行的消息数
+        self.rotations = 0          # 换代次数
+        self.early_rotations = 0    # 因本代写满提前换代的次数
+
+        registry.function('counter', 'smarthome_dedup_checked_total', '去重检查的消息数', lambda: self.checked)
+        registry.function('counter', 'smarthome_dedup_false_positives_total', '确定为布隆过滤器误判并放行的消息数',
+                          lambda: self.false_positives)
+        registry.function('counter', 'smarthome_dedup_probable_duplicates_total',
+                          '只命中布隆过滤器、按重复丢弃的消息数', lambda: self.probable_duplicates)
+        registry.function('gauge', 'smarthome_dedup_estimated_fp_rate', '按置位比例估计的布隆过滤器误判率',
+                          self.estimated_fp_rate)
+
+    @staticmethod
+    def key(device_id, timestamp, payload):
+        """消息的摘要：(设备ID, 设备时间戳, 负载哈希)"""
+        digest = hashlib.blake2b(payload, digest_size=32)
+        digest.update(f"\0{device_id}\0{timestamp}".encode())
+        return digest.digest()
+
+    def is_duplicate(self, topic, data, payload):
+        """判断消息是否为窗口内的重复消息，不是重复时记录该消息"""
+        if not isinstance(data, dict):
+            return False
+        timestamp = data.get('timestamp')
+        if timestamp is None and self.require_timestamp:
+            self.skipped += 1
+            return False
+        if isinstance(payload, str):
+            payload = payload.encode()
+        digest = self.key(extract_device_id(topic, data), timestamp, payload)
+        now = self.clock()
+
+        with self._lock:
+            self.checked += 1
+            recent = self._recent
+            # 删除超过时间窗口的条目（表按首次出现的顺序排列，只需检查表头），之后表中的条目都在窗口内
+            while recent:
+                oldest = next(iter(recent))
+                if now - recent[oldest] < self.window:
+                    break
+                del recent[oldest]
+            if digest in recent:
+                self.duplicates += 1
+                return True
+
+            self._rotate(now)
+            current = self._filters[-1]
+            positions = current.positions(digest)
+            if any(bloom.contains(positions) for bloom in self._filters):
+                if self._recent_covers_filters():
+                    self.false_positives += 1
+                else:
+                    self.probable_duplicates += 1
+                    return True
+
+            current.add(positions)
+            recent[digest] = now
+            if len(recent) > self.recent_size:
+                # 窗口内的条目因表满被淘汰：之后只命中布隆过滤器的消息不能再确定是误判
+                self._evicted_at = recent.popitem(last=False)[1]
+            return False
+
+    def _rotate(self, now):
+        """到期或写满时换新一代，只保留generations代（调用方持有锁）"""
+        current = self._filters[-1]
+        full = current.count >= self.capacity
+        if now - current.started < self.span and not full:
+            return
+        self._filters.append(BloomFilter(self.bloom_bytes, self.hashes, now))
+        del self._filters[:-self.generations]
+        self.rotations += 1
+        if full:
+            self.early_rotations += 1
+
+    def _recent_covers_filters(self):
+        """布隆过滤器中窗口内的消息是否都在最近消息表中（从未因表满淘汰过条目，或淘汰的条目早于最旧的一代）"""
+        return self._evicted_at is None or self._evicted_at < self._filters[0].started
+
+    def estimated_fp_rate(self):
+        """按置位比例估计的当前误判率（任一代命中即判为可能重复）"""
+        with self._lock:
+            filters = list(self._filters)
+        miss = 1.0
+        for bloom in filters:
+            miss *= 1 - bloom.fill_ratio() ** bloom.hashes
+        return 1 - miss
+
+    def stats(self):
+        """返回去重统计"""
+        return {
+            'checked': self.checked,
+            'skipped': self.skipped,
+            'duplicates': self.duplicates,
+            'probable_duplicates': self.probable_duplicates,
+            'false_positives': self.false_positives,
+            'estimated_fp_rate': round(self.estimated_fp_rate(), 6),
+            'generations': len(self._filters),
+            'rotations': self.rotations,
+            'early_rotations': self.early_rotations,
+            'hashes': self.hashes,
+            'bloom_bytes': self.bloom_bytes * self.generations,
+            'recent_entries': len(self._recent)
+        }
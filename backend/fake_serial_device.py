@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+基于pty的模拟串口设备（仅Linux/macOS）
+在没有开发板时测试串口调试、多串口管理和热插拔：每个模拟设备创建一个伪终端，
+后端像打开真实串口一样打开它。
+
+    python fake_serial_device.py --devices 2 --link /tmp/ttyFAKE
+
+会创建 /tmp/ttyFAKE0、/tmp/ttyFAKE1 两个链接，把它们加入SERIAL_CONFIG['ports']，
+并设置 SERIAL_CONFIG['identify_command'] = 'ID' 即可按设备ID发送命令；
+结束脚本（相当于拔出设备）后链接被删除，后端会关闭对应串口，重新运行脚本后自动重新连接。
+
+支持的命令：ID、AT、AT+INFO、LOG <文本>，其他命令返回ERROR。
+"""
+
+import argparse
+import os
+import select
+import threading
+import time
+import tty
+
+class FakeSerialDevice:
+    """一个模拟设备：伪终端主端由本对象读写，从端路径交给后端打开"""
+
+    def __init__(self, device_id, link=None, log_interval=0):
+        self.device_id = device_id
+        self.link = link
+        self.log_interval = log_interval
+        self.commands = []
+        self._master = None
+        self._slave = None
+        self._running = False
+        self._threads = []
+        self._write_lock = threading.Lock()
+
+    @property
+    def path(self):
+        """后端应打开的串口路径"""
+        return self.link or os.ttyname(self._slave)
+
+    def start(self):
+        self._master, self._slave = os.openpty()
+        # 原始模式：不回显、不转换换行，回显由模拟设备自己完成
+        tty.setraw(self._master)
+        tty.setraw(self._slave)
+        if self.link:
+            if os.path.lexists(self.link):
+                os.remove(self.link)
+            os.symlink(os.ttyname(self._slave), self.link)
+        self._running = True
+        self._threads = [threading.Thread(target=self._run, name=f'fake-serial-{self.device_id}', daemon=True)]
+        if self.log_interval:
+            self._threads.append(threading.Thread(target=self._log, name=f'fake-serial-log-{self.device_id}',
+                                                  daemon=True))
+        for thread in self._threads:
+            thread.start()
+        self.boot()
+        return self
+
+    def boot(self):
+        """输出上电启动信息（模拟设备复位）。
+
+        pyserial打开串口时会清空输入缓冲区，start()时输出的启动信息在后端打开串口前就被丢弃；
+        需要后端收到启动信息时，在打开串口后再调用一次"""
+        self.write('boot: fake device ready\r\n> ')
+
+    def stop(self):
+        """模拟拔出设备：删除链接并关闭伪终端（后端打开的从端随后读取出错）"""
+        self._running = False
+        if self.link and os.path.lexists(self.link):
+            os.remove(self.link)
+        # 等读写线程退出后再关闭：线程阻塞在read()中时关闭主端并不会真正释放伪终端
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join(1)
+        for fd in (self._master, self._slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def write(self, text):
+        with self._write_lock:
+            os.write(self._master, text.encode())
+
+    def respond(self, command):
+        """返回命令的响应行"""
+        if command == 'ID':
+            return [f'ID: {self.device_id}', 'OK']
+        if command == 'AT':
+            return ['OK']
+        if command == 'AT+INFO':
+            return [f'device: {self.device_id}', 'firmware: fake-1.0', f'uptime: {int(time.monotonic())}', 'OK']
+        if command.startswith('LOG '):
+            return [command[4:], 'OK']
+        return [f'unknown command: {command}', 'ERROR']
+
+    def _run(self):
+        buffer = b''
+        while self._running:
+            try:
+                if not select.select([self._master], [], [], 0.1)[0]:
+                    continue
+                chunk = os.read(self._master, 1024)
+            except (OSError, ValueError):
+                break
+            if not chunk:
+                break
+            buffer += chunk
+            while b'\r\n' in buffer:
+                line, buffer = buffer.split(b'\r\n', 1)
+                command = line.decode('utf-8', errors='replace').strip()
+                self.commands.append(command)
+                lines = [command] + self.respond(command)   # 先回显命令
+                self.write('\r\n'.join(lines) + '\r\n> ')
+
+    def _log(self):
+        seq = 0
+        while self._running:
+            time.sleep(self.log_interval)
+            seq += 1
+            try:
+                self.write(f'[{time.strftime("%H:%M:%S")}] sensor sample {seq} temp=23.{seq % 10}\r\n')
+            except OSError:
+                break
+
+def main():
+    parser = argparse.ArgumentParser(description="基于pty的模拟串口设备")
+    parser.add_argument("--devices", type=int, default=1, help="模拟设备数")
+    parser.add_argument("--link", help="串口链接路径前缀（如/tmp/ttyFAKE），不指定时打印pty路径")
+    parser.add_argument("--id-prefix", default="FAKE", help="设备ID前缀")
+    parser.add_argument("--log-interval", type=float, default=0, help="设备主动输出日志的间隔(秒)，0表示不输出")
+    args = parser.parse_args()
+
+    devices = []
+    for index in range(args.devices):
+        link = f"{args.link}{index}" if args.link else None
+        device = FakeSerialDevice(f"{args.id_prefix}{index:02d}", link, args.log_interval).start()
+        devices.append(device)
+        print(f"{device.device_id}: {device.path}")
+
+    print("按Ctrl+C拔出全部设备")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for device in devices:
+            device.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+import os
+import queue
+import threading
+import time
+from database import insert_data_batch
+from metrics import Counter, registry, SIZE_BUCKETS
+from journal import IngestJournal, JournalReplayer
+from log import get_logger
+from config import INGEST_CONFIG, JOURNAL_CONFIG
+
+logger = get_logger('ingest')
+
+# 停止写线程的哨兵对象
+_STOP = object()
+
+BATCH_SIZE = registry.histogram('smarthome_ingest_batch_size', '每批写入数据库的消息数', ['pipeline'],
+                                buckets=SIZE_BUCKETS)
+COMMIT_SECONDS = registry.histogram('smarthome_ingest_commit_seconds', '写入并提交一批数据的耗时', ['pipeline'])
+
+class IngestPipeline:
+    """MQTT数据写入流水线
+
+    MQTT回调线程只调用submit()把解码后的数据放入有界队列，
+    由唯一的写线程按批次（数量或时间触发）取出并一次性写入数据库。
+    启用写入日志（journal为True或JOURNAL_CONFIG['enabled']）时，写库失败或队列积压的批次
+    追加到磁盘日志，由回放线程按顺序写入数据库；日志中还有未回放的消息时新批次也写入日志，保持写库顺序。
+    """
+
+    def __init__(self, writer=insert_data_batch, queue_size=None, batch_size=None,
+                 flush_interval=None, put_timeout=None, name='ingest-writer', journal=None):
+        self.writer = writer
+        self.name = name
+        self.use_journal = JOURNAL_CONFIG['enabled'] if journal is None else journal
+        self.journal = None
+        self.replayer = None
+        self.batch_size = batch_size or INGEST_CONFIG['batch_size']
+        self.flush_interval = flush_interval or INGEST_CONFIG['flush_interval']
+        self.put_timeout = INGEST_CONFIG['put_timeout'] if put_timeout is None else put_timeout
+        self._queue = queue.Queue(maxsize=queue_size or INGEST_CONFIG['queue_size'])
+        self._thread = None
+        self._stopping = False
+
+        # 统计计数。submit()可能被多个线程同时调用（消费组共用一条流水线），入队计数按线程分片；
+        # 其余计数只由写线程修改
+        self._enqueued = Counter()      # 成功入队的消息数
+        self._dropped = Counter()       # 因队列已满或正在停止被丢弃的消息数
+        self._backpressure = Counter()  # 入队时遇到队列已满的次数
+        self.written = 0        # 写线程直接写入数据库的消息数
+        self.failed = 0         # 写入失败的消息数
+        self.rejected = 0       # 无法转换为数据库行、被写入函数跳过的消息数
+        self.journaled = 0      # 写入磁盘日志、由回放线程写库的消息数
+        self.batches = 0        # 已提交的批次数
+        self.last_batch_size = 0
+        self.last_flush_time = None
+        self.last_lag = None    # 最近一批中最早的消息从接收到写入完成的时间(秒)
+
+        self._batch_metric = BATCH_SIZE.labels(name)
+        self._commit_metric = COMMIT_SECONDS.labels(name)
+        labels = [('pipeline', name)]
+        registry.function('gauge', 'smarthome_ingest_queue_depth', '写入队列中等待的消息数',
+                          self._queue.qsize, labels)
+        registry.function('counter', 'smarthome_ingest_enqueued_total', '成功入队的消息数',
+                          lambda: self.enqueued, labels)
+        registry.function('counter', 'smarthome_ingest_dropped_total', '因队列已满被丢弃的消息数',
+                          lambda: self.dropped, labels)
+        registry.function('counter', 'smarthome_ingest_written_total', '已写入数据库的消息数',
+                          self.written_total, labels)
+        registry.function('counter', 'smarthome_ingest_failed_total', '写入失败的消息数',
+                          lambda: self.failed, labels)
+        registry.function('counter', 'smarthome_ingest_journaled_total', '写入磁盘日志的消息数',
+                          lambda: self.journaled, labels)
+        registry.function('gauge', 'smarthome_ingest_journal_pending', '磁盘日志中尚未写入数据库的消息数',
+                          lambda: self.journal.pending if self.journal is not None else 0, labels)
+
+    def start(self):
+        """启动写线程"""
+        if self._thread and self._thread.is_alive():
+            return
+        if self.use_journal and self.journal is None:
+            # 打开日志时会接着上次未回放完的消息继续
+            self.journal = IngestJournal(os.path.join(JOURNAL_CONFIG['directory'], self.name)).open()
+            self.replayer = JournalReplayer(self.journal, self.name)
+        if self.replayer is not None:
+            self.replayer.start()
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def submit(self, item):
+        """提交一条数据，成功入队返回True，被丢弃返回False"""
+        if self._stopping:
+            self._dropped.inc()
+            return False
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self._backpressure.inc()
+            try:
+                if self.put_timeout <= 0:
+                    raise queue.Full
+                self._queue.put(item, timeout=self.put_timeout)
+            except queue.Full:
+                self._dropped.inc()
+                return False
+        self._enqueued.inc()
+        return True
+
+    @property
+    def enqueued(self):
+        return self._enqueued.value
+
+    @property
+    def dropped(self):
+        return self._dropped.value
+
+    @property
+    def backpressure(self):
+        return self._backpressure.value
+
+    def stop(self, timeout=10):
+        """停止写线程，并把队列中剩余的数据全部写入"""
+        if not self._thread or self._stopping:
+            return
+        self._stopping = True
+        # 写线程每轮检查_stopping；_STOP只用于唤醒空闲时阻塞在get上的写线程。
+        # 队列已满说明写线程正忙，不会阻塞在get上，不能为放入_STOP而阻塞
+        try:
+            self._queue.put_nowait(_STOP)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+        if self.replayer is not None:
+            self.replayer.stop(timeout)
+            self.journal.close()
+
+    def written_total(self):
+        """已写入数据库的消息数（包括从磁盘日志回放写入的）"""
+        return self.written + (self.replayer.replayed if self.replayer is not None else 0)
+
+    def stats(self):
+        """返回流水线的运行统计"""
+        return {
+            'queue_depth': self._queue.qsize(),
+            'queue_size': self._queue.maxsize,
+            'enqueued': self.enqueued,
+            'dropped': self.dropped,
+            'backpressure': self.backpressure,
+            'written': self.written_total(),
+            'failed': self.failed,
+            'rejected': self.rejected,
+            'journaled': self.journaled,
+            'journal': dict(self.journal.stats(), **self.replayer.stats()) if self.journal is not None else None,
+            'batches': self.batches,
+            'last_batch_size': self.last_batch_size,
+            'last_flush_time': self.last_flush_time,
+            'last_lag': self.last_lag
+        }
+
+    def _run(self):
+        """写线程主循环：攒够一批或等待超时后写入"""
+        running = True
+        while running and not self._stopping:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            if item is _STOP:
+                break
+
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    running = False
+                    break
+                batch.append(item)
+
+            self._flush(batch)
+
+        # 停止前写完队列中残留的数据
+        batch = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                batch.append(item)
+            if len(batch) >= self.batch_size:
+                self._flush(batch)
+                batch = []
+        self._flush(batch)
+
+    def _flush(self, batch):
+        """把一批数据写入数据库"""
+        if not batch:
+            return
+        # 日志中还有未回放的消息，或数据库写入跟不上（队列积压）时，改写日志
+        if self.journal is not None and (self.journal.pending or
+                                         self._queue.qsize() >= self._queue.maxsize * JOURNAL_CONFIG['spill_depth']):
+            self._spill(batch)
+            return
+        try:
+            start = time.perf_counter()
+            stored = self.writer(batch)
+            self._commit_metric.observe(time.perf_counter() - start)
+            self._batch_metric.observe(len(batch))
+            # 写入函数返回实际写入的消息数（insert_data_batch跳过无法转换的消息），不返回时按整批计
+            stored = len(batch) if stored is None else stored
+            self.written += stored
+            self.rejected += len(batch) - stored
+            self.batches += 1
+            self.last_batch_size = len(batch)
+            self.last_flush_time = time.time()
+            self.last_lag = self.last_flush_time - batch[0][1]
+        except Exception as e:
+            if self.journal is not None:
+                logger.warning("Error writing batch, spilling to journal", extra={'size': len(batch), 'error': str(e)})
+                self._spill(batch)
+                return
+            self.failed += len(batch)
+            logger.error("Error writing batch", extra={'size': len(batch), 'error': str(e)})
+
+    def _spill(self, batch):
+        """把一批数据追加到磁盘日志，交给回放线程写入数据库"""
+        try:
+            self.journal.append(batch)
+        except OSError as e:
+            self.failed += len(batch)
+            logger.error("Error writing journal", extra={'size': len(batch), 'error': str(e)})
+            return
+        self.journaled += len(batch)
+        self.replayer.notify()
@@ -0,0 +1,57 @@
+"""MQTT数据写入进程
+
+多进程部署时唯一订阅MQTT并写入数据库的进程（同时负责过期数据清理和串口），
+HTTP工作进程从数据库读取它写入的数据。运行状态定期保存到service_status表，
+供HTTP进程的/api/ingest/stats接口读取。
+
+通常由launcher.py启动，也可以单独运行：
+    python ingest_service.py
+"""
+
+import signal
+import threading
+import config
+import metrics
+import log
+import mqtt_handler
+from mqtt_handler import client, consumer_group, ingest_pipeline, mqtt_publisher, retention_worker
+from database import init_db, set_service_status
+
+def save_status():
+    """保存写入进程的运行状态"""
+    set_service_status('ingest', dict(mqtt_handler.ingest_stats(), publish=mqtt_publisher.stats()))
+
+def main():
+    # 本进程负责订阅和写库，不受SMARTHOME_ROLE环境变量影响
+    config.DEPLOY_CONFIG['role'] = 'ingest'
+    log.setup()
+    logger = log.get_logger('ingest')
+
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stop_event.set())
+
+    init_db()
+    mqtt_handler.start()
+    if config.METRICS_CONFIG['enabled'] and config.METRICS_CONFIG['ingest_port']:
+        metrics.start_http_server(config.METRICS_CONFIG['ingest_port'])
+    logger.info("Ingest service started")
+
+    while not stop_event.wait(config.DEPLOY_CONFIG['status_interval']):
+        try:
+            save_status()
+        except Exception as e:
+            logger.error("Error saving status", extra={'error': str(e)})
+
+    # 先停止接收新消息，再写完队列中剩余的数据
+    logger.info("Stopping ingest service")
+    client.disconnect()
+    client.loop_stop()
+    consumer_group.stop()
+    ingest_pipeline.stop()
+    retention_worker.stop()
+    mqtt_publisher.stop()
+    save_status()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,359 @@
+"""写入流水线的磁盘日志（store-and-forward）
+
+数据库被锁、磁盘写满或写入跟不上时，写入流水线把整批消息追加到只追加的分段日志中，
+由JournalReplayer按顺序分大批写入数据库，不丢失消息：
+  - 日志段文件名为段内第一条记录的序号（journal/<流水线>/<序号>.jnl），写满segment_bytes后换新文件
+  - 每条记录为16字节头部（负载长度、CRC32、序号）+ JSON负载，
+    一批消息一次write、一次fsync（组提交），比逐条提交SQLite事务快得多
+  - 打开日志时校验最后一个日志段，截掉崩溃时未写完的记录
+  - 回放进度（已写入数据库的最大序号）与数据在同一个事务中写入ingest_journal表，
+    回放中途崩溃后从数据库记录的序号继续，同一条消息不会写入两次
+  - 同一批连续失败poison_retries次后逐条写入：单独写入仍失败（且不是数据库被锁、磁盘错误等暂时性错误）的记录
+    移到隔离日志（journal/<流水线>/quarantine/），跳过其序号，一条坏数据不会让回放永远停住
+"""
+
+import os
+import sqlite3
+import struct
+import threading
+import zlib
+import codec
+from database import get_journal_seq, insert_data_batch
+from log import get_logger
+from config import JOURNAL_CONFIG
+
+logger = get_logger('journal')
+
+# 负载长度、负载和序号的CRC32、序号
+HEADER = struct.Struct('<IIQ')
+SUFFIX = '.jnl'
+# 隔离日志的子目录
+QUARANTINE = 'quarantine'
+# 数据库被锁、磁盘写满或读写出错等暂时性错误：重试，不隔离记录
+TRANSIENT_ERRORS = (sqlite3.OperationalError, OSError)
+
+def encode_item(item):
+    """把流水线中的一条消息编码为日志负载：带原始JSON负载的只保存原始负载"""
+    topic, received_at, data = item[:3]
+    raw = item[3] if len(item) > 3 else None
+    if raw is not None:
+        try:
+            raw = raw.decode('utf-8') if isinstance(raw, (bytes, bytearray)) else raw
+            return codec.dumps([topic, received_at, raw]).encode('utf-8')
+        except UnicodeDecodeError:
+            pass
+    return codec.dumps([topic, received_at, None, data]).encode('utf-8')
+
+def decode_item(payload):
+    """从日志负载还原流水线中的消息"""
+    record = codec.loads(payload)
+    if record[2] is not None:
+        return (record[0], record[1], codec.loads(record[2]), record[2])
+    return (record[0], record[1], record[3])
+
+class IngestJournal:
+    """一条写入流水线的分段日志
+
+    append()只由流水线的写线程调用，read()和release()只由回放线程调用。
+    """
+
+    def __init__(self, directory, segment_bytes=None, fsync=None):
+        self.directory = directory
+        self.segment_bytes = segment_bytes or JOURNAL_CONFIG['segment_bytes']
+        self.fsync = JOURNAL_CONFIG['fsync'] if fsync is None else fsync
+        self.last_seq = 0           # 最后写入的记录序号
+        self.released_seq = 0       # 已写入数据库的最大序号
+        self._segments = []         # [[第一条记录的序号, 路径, 已提交的字节数], ...]
+        self._file = None           # 当前日志段（最后一个）的追加句柄
+        self._cursor = None         # 回放位置：(日志段第一条记录的序号, 偏移, 该位置之前的最后序号)
+        self._lock = threading.Lock()
+
+        # 统计计数
+        self.appended = 0           # 写入日志的消息数
+        self.appends = 0            # 组提交次数
+        self.corrupted = 0          # 校验失败被跳过的日志段数
+
+    @property
+    def pending(self):
+        """已写入日志、尚未写入数据库的消息数"""
+        return self.last_seq - self.released_seq
+
+    def open(self):
+        """打开日志目录，恢复序号并截掉最后一个日志段中未写完的记录"""
+        os.makedirs(self.directory, exist_ok=True)
+        segments = []
+        for name in os.listdir(self.directory):
+            if name.endswith(SUFFIX) and name[:-len(SUFFIX)].isdigit():
+                path = os.path.join(self.directory, name)
+                segments.append([int(name[:-len(SUFFIX)]), path, os.path.getsize(path)])
+        segments.sort()
+        self._segments = segments
+        if not segments:
+            return self
+
+        first_seq, path, size = segments[-1]
+        last_seq = first_seq - 1
+        valid = 0
+        with open(path, 'rb') as f:
+            for seq, _, end in self._scan(f, 0, size):
+                last_seq, valid = seq, end
+        if valid < size:
+            logger.warning("Truncating incomplete journal records", extra={'segment': path, 'bytes': size - valid})
+            with open(path, 'r+b') as f:
+                f.truncate(valid)
+                os.fsync(f.fileno())
+            segments[-1][2] = valid
+        self.last_seq = last_seq
+        # 已回放的日志段已被删除，最早的日志段之前的记录都已写入数据库
+        self.released_seq = segments[0][0] - 1
+        self._file = open(path, 'ab')
+        return self
+
+    def append(self, items):
+        """把一批消息追加到日志（一次写入、一次fsync），返回最后一条记录的序号"""
+        chunks = []
+        seq = self.last_seq
+        for item in items:
+            seq += 1
+            payload = encode_item(item)
+            crc = zlib.crc32(payload, zlib.crc32(seq.to_bytes(8, 'little')))
+            chunks.append(HEADER.pack(len(payload), crc, seq))
+            chunks.append(payload)
+        data = b''.join(chunks)
+
+        with self._lock:
+            if self._file is None or self._segments[-1][2] >= self.segment_bytes:
+                self._roll(self.last_seq + 1)
+            segment = self._segments[-1]
+            self._file.write(data)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            segment[2] += len(data)
+            self.last_seq = seq
+        self.appended += len(items)
+        self.appends += 1
+        return seq
+
+    def read(self, after_seq, limit):
+        """按顺序读取序号大于after_seq的最多limit条记录，返回 [(序号, 消息), ...]"""
+        records = []
+        while len(records) < limit:
+            with self._lock:
+                segments = [list(segment) for segment in self._segments]
+            position = self._locate(segments, after_seq)
+            if position is None:
+                break
+            index, offset = position
+            first_seq, path, size = segments[index]
+            read_to = offset
+            try:
+                with open(path, 'rb') as f:
+                    for seq, payload, end in self._scan(f, offset, size):
+                        if seq <= after_seq:
+                            read_to = end
+                            continue
+                        records.append((seq, decode_item(payload)))
+                        after_seq, read_to = seq, end
+                        if len(records) >= limit:
+                            break
+            except FileNotFoundError:
+                break
+            self._cursor = (first_seq, read_to, after_seq)
+
+            if len(records) >= limit or index == len(segments) - 1:
+                break
+            if read_to < size:
+                # 日志段中间的记录损坏：跳过该段剩余的记录，从下一个日志段继续
+                self.corrupted += 1
+                logger.error("Corrupted journal segment, skipping the rest",
+                             extra={'segment': path, 'offset': read_to})
+                after_seq = max(after_seq, segments[index + 1][0] - 1)
+        return records
+
+    def release(self, seq):
+        """记录已写入数据库的序号，删除已全部写入数据库的日志段"""
+        with self._lock:
+            self.released_seq = max(self.released_seq, seq)
+            if self._segments and self._segments[-1][2] > 0 and self.last_seq <= self.released_seq:
+                # 当前日志段也已全部写入数据库：换成以下一个序号命名的空日志段，重启后据此恢复序号
+                self._roll(self.last_seq + 1)
+            while len(self._segments) > 1 and self._segments[1][0] - 1 <= self.released_seq:
+                path = self._segments.pop(0)[1]
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def stats(self):
+        """返回日志统计"""
+        with self._lock:
+            segments = len(self._segments)
+            size = sum(segment[2] for segment in self._segments)
+        return {
+            'pending': self.pending,
+            'last_seq': self.last_seq,
+            'released_seq': self.released_seq,
+            'segments': segments,
+            'bytes': size,
+            'appended': self.appended,
+            'appends': self.appends,
+            'corrupted': self.corrupted
+        }
+
+    def _roll(self, first_seq):
+        """开始新的日志段（调用方持有锁）"""
+        if self._file is not None:
+            self._file.close()
+        path = os.path.join(self.directory, f"{first_seq:020d}{SUFFIX}")
+        self._file = open(path, 'ab')
+        self._segments.append([first_seq, path, 0])
+        if self.fsync and os.name == 'posix':
+            # 新文件的目录项也要落盘，崩溃后才能找到这个日志段
+            fd = os.open(self.directory, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def _locate(self, segments, after_seq):
+        """返回下一条要读取的记录所在的 (日志段下标, 开始读取的偏移)"""
+        index = None
+        for i, segment in enumerate(segments):
+            if segment[0] <= after_seq + 1:
+                index = i
+            else:
+                break
+        if index is None:
+            return (0, 0) if segments else None
+        first_seq = segments[index][0]
+        if self._cursor is not None and self._cursor[0] == first_seq and self._cursor[2] <= after_seq:
+            return index, self._cursor[1]
+        return index, 0
+
+    @staticmethod
+    def _scan(f, offset, size):
+        """从offset开始逐条读取到size为止的有效记录，生成 (序号, 负载, 记录结束偏移)；遇到不完整或校验失败的记录时停止"""
+        f.seek(offset)
+        while offset + HEADER.size <= size:
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size:
+                return
+            length, crc, seq = HEADER.unpack(header)
+            end = offset + HEADER.size + length
+            if end > size:
+                return
+            payload = f.read(length)
+            if len(payload) < length or zlib.crc32(payload, zlib.crc32(seq.to_bytes(8, 'little'))) != crc:
+                return
+            yield seq, payload, end
+            offset = end
+
+class JournalReplayer:
+    """回放线程：把日志中的消息按顺序分大批写入数据库"""
+
+    def __init__(self, journal, name, writer=insert_data_batch, batch_size=None):
+        self.journal = journal
+        self.name = name
+        self.writer = writer
+        self.batch_size = batch_size or JOURNAL_CONFIG['replay_batch']
+        self.poison_retries = JOURNAL_CONFIG['poison_retries']
+        self.replayed = 0           # 已回放写入数据库的消息数
+        self.errors = 0             # 回放写库失败的次数
+        self.quarantined = 0        # 单独写入也失败、移到隔离日志的消息数
+        self._quarantine = None     # 隔离日志，第一次隔离记录时打开
+        self._stop_event = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """启动回放线程"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name=f'{self.name}-replay', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10):
+        """停止回放线程（未回放的消息留在日志中，下次启动后继续）"""
+        self._stop_event.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def notify(self):
+        """有新消息写入日志时唤醒回放线程"""
+        self._wake.set()
+
+    def stats(self):
+        return {'replayed': self.replayed, 'errors': self.errors, 'quarantined': self.quarantined}
+
+    def _run(self):
+        delay = JOURNAL_CONFIG['retry_interval']
+        checkpoint = None
+        failures = 0                # 当前批次连续失败的次数
+        while not self._stop_event.is_set():
+            try:
+                if checkpoint is None:
+                    # 数据库中记录的回放进度，之前的记录已经写入数据库
+                    checkpoint = get_journal_seq(self.name)
+                    if checkpoint > self.journal.last_seq:
+                        # 日志目录被删除或更换过，数据库中的进度属于以前的日志
+                        logger.warning("Journal is behind the database checkpoint, replaying the whole journal",
+                                       extra={'journal': self.name, 'checkpoint': checkpoint,
+                                              'last_seq': self.journal.last_seq})
+                        checkpoint = self.journal.released_seq
+                    self.journal.release(checkpoint)
+                records = self.journal.read(max(checkpoint, self.journal.released_seq), self.batch_size)
+                if records:
+                    if failures >= self.poison_retries:
+                        self._isolate(records)
+                    else:
+                        last_seq = records[-1][0]
+                        stored = self.writer([item for _, item in records], journal=(self.name, last_seq))
+                        self.journal.release(last_seq)
+                        self.replayed += len(records) if stored is None else stored
+                    checkpoint = records[-1][0]
+                    failures = 0
+                    delay = JOURNAL_CONFIG['retry_interval']
+                    continue
+            except Exception as e:
+                self.errors += 1
+                failures += 1
+                logger.warning("Journal replay failed, retrying", extra={'journal': self.name, 'error': str(e),
+                                                                         'retry_in': delay})
+                self._stop_event.wait(delay)
+                delay = min(delay * 2, JOURNAL_CONFIG['retry_max'])
+                continue
+            self._wake.wait(1.0)
+            self._wake.clear()
+        if self._quarantine is not None:
+            self._quarantine.close()
+
+    def _isolate(self, records):
+        """逐条写入反复失败的一批记录，把单独写入仍失败的记录移到隔离日志
+
+        遇到暂时性错误时抛出异常（之前的记录已写入），稍后重试。
+        """
+        for seq, item in records:
+            try:
+                stored = self.writer([item], journal=(self.name, seq))
+                self.replayed += 1 if stored is None else stored
+            except TRANSIENT_ERRORS:
+                raise
+            except Exception as e:
+                if self._quarantine is None:
+                    self._quarantine = IngestJournal(os.path.join(self.journal.directory, QUARANTINE)).open()
+                self._quarantine.append([item])
+                # 跳过该记录：在数据库中记录回放进度，重启后不再回放它
+                self.writer([], journal=(self.name, seq))
+                self.quarantined += 1
+                logger.error("Quarantined journal record that cannot be written",
+                             extra={'journal': self.name, 'seq': seq, 'topic': item[0], 'error': str(e)})
+            self.journal.release(seq)
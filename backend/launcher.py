@@ -0,0 +1,94 @@
+"""多进程部署启动器
+
+启动一个MQTT写入进程（ingest_service.py）和若干无状态的HTTP工作进程：
+    python launcher.py [--workers N] [--server gunicorn|uvicorn]
+
+HTTP工作进程以SMARTHOME_ROLE=http运行：不订阅MQTT、不写库，通过数据库读取写入进程保存的数据，
+登录令牌保存在SQLite中共享。未安装gunicorn/uvicorn时退回单进程Flask服务。
+任一进程退出时停止全部进程。
+"""
+
+import argparse
+import importlib.util
+import os
+import signal
+import subprocess
+import sys
+import time
+import config
+import log
+from database import init_db
+
+logger = log.get_logger('launcher')
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def http_command(server, workers, threads):
+    """根据已安装的服务器生成HTTP工作进程的启动命令"""
+    host = config.WEB_SERVER_CONFIG['host']
+    port = str(config.WEB_SERVER_CONFIG['port'])
+
+    if server == 'uvicorn' and importlib.util.find_spec('uvicorn'):
+        return [sys.executable, '-m', 'uvicorn', 'asgi_app:app', '--host', host, '--port', port,
+                '--workers', str(workers), '--loop', 'asyncio']
+    if server == 'gunicorn' and importlib.util.find_spec('gunicorn'):
+        # SSE连接会长期占用一个线程，使用多线程工作进程
+        return [sys.executable, '-m', 'gunicorn', '--bind', f'{host}:{port}', '--workers', str(workers),
+                '--worker-class', 'gthread', '--threads', str(threads), '--timeout', '0', 'app:app']
+
+    logger.warning("Server is not installed, falling back to a single Flask process", extra={'server': server})
+    return [sys.executable, '-m', 'flask', '--app', 'app', 'run', '--host', host, '--port', port,
+            '--with-threads', '--no-reload']
+
+def spawn(command, role):
+    env = dict(os.environ, SMARTHOME_ROLE=role)
+    logger.info("Starting process", extra={'role': role, 'command': ' '.join(command)})
+    return subprocess.Popen(command, cwd=BASE_DIR, env=env)
+
+def terminate(processes, timeout=15):
+    """按顺序停止进程（先停HTTP，最后停写入进程，让它写完队列中的数据）"""
+    for process in processes:
+        if process.poll() is None:
+            process.terminate()
+            try:
+                process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+def main():
+    parser = argparse.ArgumentParser(description='启动MQTT写入进程和HTTP工作进程')
+    parser.add_argument('--workers', type=int, default=config.DEPLOY_CONFIG['http_workers'],
+                        help='HTTP工作进程数')
+    parser.add_argument('--threads', type=int, default=config.DEPLOY_CONFIG['http_threads'],
+                        help='每个gunicorn工作进程的线程数')
+    parser.add_argument('--server', choices=['gunicorn', 'uvicorn'], default=config.DEPLOY_CONFIG['server'],
+                        help='HTTP服务器')
+    args = parser.parse_args()
+    log.setup(role='launcher')
+
+    # 先完成数据库初始化和升级，避免多个进程同时执行
+    init_db()
+
+    ingest = spawn([sys.executable, 'ingest_service.py'], 'ingest')
+    http = spawn(http_command(args.server, args.workers, args.threads), 'http')
+    processes = [http, ingest]
+
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+    signal.signal(signal.SIGINT, lambda signum, frame: stopping.append(signum))
+
+    exit_code = 0
+    while not stopping:
+        exited = [process for process in processes if process.poll() is not None]
+        if exited:
+            exit_code = exited[0].returncode or 1
+            logger.error("Process exited", extra={'command': ' '.join(exited[0].args[1:]),
+                                                   'code': exited[0].returncode})
+            break
+        time.sleep(0.5)
+
+    terminate(processes)
+    sys.exit(exit_code)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,276 @@
+"""非阻塞的结构化日志
+
+各模块使用标准库logging（logging.getLogger('smarthome.xxx')），setup()为"smarthome"日志器配置：
+  - 调用线程上只做过滤和格式化：按日志器的采样和限速过滤后，把记录格式化为一行紧凑的JSON（或文本），
+    放入有界队列后立即返回；队列已满时丢弃并计数，不阻塞MQTT回调线程和请求线程
+  - 后台写线程成批取出日志行，写入控制台和/或按大小滚动的日志文件
+  - 级别、采样和限速由LOG_CONFIG配置
+
+日志调用中extra的字段作为结构化字段输出：
+    logger.info('Received message', extra={'topic': topic, 'device': device_id})
+"""
+
+import atexit
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+import codec
+from metrics import registry
+from config import LOG_CONFIG, DEPLOY_CONFIG
+
+ROOT = 'smarthome'
+
+# LogRecord自带的属性，其余属性视为extra传入的结构化字段
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'suppressed'}
+
+class StructuredFormatter(logging.Formatter):
+    """把日志记录格式化为一行：json格式为紧凑的JSON对象，text格式为"时间 级别 日志器 消息 key=value" """
+
+    def __init__(self, style='json'):
+        super().__init__()
+        self.style = style
+
+    def format(self, record):
+        fields = {key: value for key, value in record.__dict__.items() if key not in _RECORD_ATTRS}
+        suppressed = getattr(record, 'suppressed', 0)
+        if suppressed:
+            fields['suppressed'] = suppressed
+        message = record.getMessage()
+        if record.exc_info:
+            fields['exc'] = self.formatException(record.exc_info)
+
+        if self.style == 'json':
+            entry = {'ts': round(record.created, 6), 'level': record.levelname, 'logger': record.name, 'msg': message}
+            entry.update(fields)
+            try:
+                return codec.dumps(entry)
+            except (TypeError, ValueError):
+                return codec.dumps({key: str(value) for key, value in entry.items()})
+
+        moment = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(record.created))
+        extra = ' '.join(f'{key}={value}' for key, value in fields.items())
+        return f"{moment}.{int(record.msecs):03d} {record.levelname:<7} [{record.name}] {message}" + \
+            (f" {extra}" if extra else '')
+
+class RateLimitFilter(logging.Filter):
+    """每秒最多通过rate条记录；被抑制的条数附加在下一条通过的记录上（suppressed字段）"""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+        self._window = 0
+        self._count = 0
+        self._suppressed = 0
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        window = int(record.created)
+        with self._lock:
+            if window != self._window:
+                self._window = window
+                self._count = 0
+            if self._count >= self.rate:
+                self._suppressed += 1
+                return False
+            self._count += 1
+            record.suppressed, self._suppressed = self._suppressed, 0
+        return True
+
+class SampleFilter(logging.Filter):
+    """每every条记录只保留一条；警告及以上的记录总是保留"""
+
+    def __init__(self, every):
+        super().__init__()
+        self.every = max(1, int(every))
+        self._seen = 0
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        with self._lock:
+            self._seen += 1
+            seen = self._seen
+        if seen % self.every:
+            return False
+        record.sampled = self.every
+        return True
+
+class RotatingWriter:
+    """按大小滚动的日志文件：超过max_bytes时依次重命名为.1、.2 …，保留backup_count个旧文件"""
+
+    def __init__(self, path, max_bytes, backup_count):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._file = open(path, 'a', encoding='utf-8')
+        self._size = self._file.tell()
+
+    def write(self, text):
+        size = len(text.encode('utf-8'))
+        if self.max_bytes and self._size + size > self.max_bytes and self._size > 0:
+            self._rotate()
+        self._file.write(text)
+        self._file.flush()
+        self._size += size
+
+    def _rotate(self):
+        self._file.close()
+        for index in range(self.backup_count - 1, 0, -1):
+            source = f"{self.path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index + 1}")
+        if self.backup_count:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._file = open(self.path, 'a', encoding='utf-8')
+        self._size = 0
+
+    def close(self):
+        self._file.close()
+
+class AsyncHandler(logging.Handler):
+    """在调用线程上格式化，把日志行交给后台写线程"""
+
+    def __init__(self, outputs, queue_size):
+        super().__init__()
+        self.outputs = outputs          # 写线程调用 output.write(text)
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+        self._stopped = False
+        self._drop_lock = threading.Lock()    # 只在队列已满时使用，正常路径不加锁
+        self.dropped = 0
+        self.written = 0
+        self._thread.start()
+
+    def handle(self, record):
+        # 队列本身是线程安全的，不像Handler.handle那样持锁，各线程的格式化可以并行
+        rv = self.filter(record)
+        if rv:
+            self.emit(record)
+        return rv
+
+    def emit(self, record):
+        try:
+            line = self.format(record)
+        except Exception:
+            self.handleError(record)
+            return
+        try:
+            self._queue.put_nowait(line)
+        except queue.Full:
+            with self._drop_lock:
+                self.dropped += 1
+
+    def close(self):
+        """写完队列中剩余的日志并停止写线程"""
+        if not self._stopped:
+            self._stopped = True
+            self._queue.put(None)
+            self._thread.join(5)
+        super().close()
+
+    def _run(self):
+        reported = 0
+        while True:
+            line = self._queue.get()
+            lines = [line]
+            # 一次取出队列中已有的全部日志行，合并为一次写入
+            while len(lines) < 1000:
+                try:
+                    lines.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in lines
+            lines = [line for line in lines if line is not None]
+            dropped = self.dropped
+            if dropped != reported:
+                lines.append(codec.dumps({'ts': round(time.time(), 6), 'level': 'WARNING', 'logger': ROOT,
+                                          'msg': 'Log queue full, records dropped',
+                                          'dropped': dropped - reported}))
+                reported = dropped
+            if lines:
+                text = '\n'.join(lines) + '\n'
+                for output in self.outputs:
+                    try:
+                        output.write(text)
+                    except Exception as e:
+                        sys.stderr.write(f"log write failed: {e}\n")
+                self.written += len(lines)
+            if stop:
+                break
+        for output in self.outputs:
+            if hasattr(output, 'close'):
+                output.close()
+
+class _Console:
+    """控制台输出（写线程中调用）"""
+
+    def write(self, text):
+        sys.stdout.write(text)
+        sys.stdout.flush()
+
+_handler = None
+_lock = threading.Lock()
+
+def log_file(config, role):
+    """返回本进程的日志文件路径"""
+    path = config['file'].format(role=role)
+    # 多个HTTP工作进程各写各的文件，避免同时滚动同一个文件
+    if role == 'http':
+        root, ext = os.path.splitext(path)
+        path = f"{root}.{os.getpid()}{ext}"
+    return path
+
+def setup(config=None, role=None):
+    """按LOG_CONFIG配置smarthome日志器（重复调用时不重复配置），返回处理器"""
+    global _handler
+    config = config or LOG_CONFIG
+    with _lock:
+        if _handler is not None:
+            return _handler
+
+        outputs = []
+        if config['console']:
+            outputs.append(_Console())
+        if config['file']:
+            path = log_file(config, role or DEPLOY_CONFIG['role'])
+            outputs.append(RotatingWriter(path, config['max_bytes'], config['backup_count']))
+        handler = AsyncHandler(outputs, config['queue_size'])
+        handler.setFormatter(StructuredFormatter(config['format']))
+
+        root = logging.getLogger(ROOT)
+        root.handlers = [handler]
+        root.propagate = False
+        root.setLevel(config['level'])
+        for name, level in config['levels'].items():
+            logging.getLogger(name).setLevel(level)
+        for name, rate in config['rate_limits'].items():
+            logging.getLogger(name).addFilter(RateLimitFilter(rate))
+        for name, every in config['sampling'].items():
+            logging.getLogger(name).addFilter(SampleFilter(every))
+
+        registry.function('counter', 'smarthome_log_written_total', '写出的日志行数', lambda: handler.written)
+        registry.function('counter', 'smarthome_log_dropped_total', '写线程来不及写出而丢弃的日志数',
+                          lambda: handler.dropped)
+        registry.function('gauge', 'smarthome_log_queue_depth', '等待写出的日志行数', handler._queue.qsize)
+
+        atexit.register(handler.close)
+        _handler = handler
+        return handler
+
+def get_logger(name):
+    """返回smarthome下的日志器，如 get_logger('mqtt') -> smarthome.mqtt"""
+    return logging.getLogger(f"{ROOT}.{name}")
+
+def stats():
+    """返回日志写线程的统计"""
+    if _handler is None:
+        return None
+    return {'queued': _handler._queue.qsize(), 'written': _handler.written, 'dropped': _handler.dropped}
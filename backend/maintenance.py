@@ -0,0 +1,39 @@
+import threading
+from database import prune_expired
+from log import get_logger
+from config import RETENTION_CONFIG
+
+logger = get_logger('retention')
+
+class RetentionWorker:
+    """后台数据保留任务：定期分批删除过期的原始数据和汇总数据"""
+
+    def __init__(self, interval=None):
+        self.interval = interval or RETENTION_CONFIG['interval']
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.last_result = None
+
+    def start(self):
+        """启动清理线程"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='retention-worker', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        """停止清理线程"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.last_result = prune_expired()
+                removed = sum(self.last_result.values())
+                if removed:
+                    logger.info("Pruned expired rows", extra={'removed': removed, 'tables': self.last_result})
+            except Exception as e:
+                logger.error("Error pruning expired data", extra={'error': str(e)})
@@ -0,0 +1,268 @@
+"""进程内指标注册表（Prometheus文本格式）
+
+计数器和直方图按线程分片：每个线程只修改自己的分片，热路径上不加锁，
+记录一次的开销是一次threading.local属性访问加几次列表操作（直方图另加一次bisect）。
+读取时把全部分片相加；已退出线程的分片在新线程注册分片时合并，线程频繁创建时分片数不会增长。
+队列深度等瞬时值用Gauge在读取时调用函数获取，热路径上没有任何开销。
+
+    messages = registry.counter('mqtt_messages_total', 'MQTT消息数', ['route'])
+    counter = messages.labels('mySmartHome/sensor/#')   # 在热路径之外取得子指标
+    counter.inc()
+"""
+
+import bisect
+import threading
+import time
+
+# 默认的延迟直方图分桶（秒）
+LATENCY_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 批次大小等数量的分桶
+SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+class _Shards:
+    """按线程分片的一组数值：每个线程一个长度为size的列表"""
+
+    __slots__ = ('size', '_local', '_cells', '_base', '_lock')
+
+    def __init__(self, size):
+        self.size = size
+        self._local = threading.local()
+        self._cells = []                # [(线程, 分片), ...]
+        self._base = [0] * size         # 已退出线程的分片之和
+        self._lock = threading.Lock()
+
+    def cell(self):
+        """返回当前线程的分片"""
+        try:
+            return self._local.cell
+        except AttributeError:
+            return self._register()
+
+    def _register(self):
+        cell = [0] * self.size
+        with self._lock:
+            alive = []
+            for thread, other in self._cells:
+                if thread.is_alive():
+                    alive.append((thread, other))
+                else:
+                    for i, value in enumerate(other):
+                        self._base[i] += value
+            alive.append((threading.current_thread(), cell))
+            self._cells = alive
+        self._local.cell = cell
+        return cell
+
+    def values(self):
+        """返回各位置在全部分片上的和"""
+        with self._lock:
+            total = list(self._base)
+            for _, cell in self._cells:
+                for i, value in enumerate(cell):
+                    total[i] += value
+        return total
+
+class Counter:
+    """只增不减的计数器"""
+
+    __slots__ = ('_shards',)
+
+    def __init__(self):
+        self._shards = _Shards(1)
+
+    def inc(self, amount=1):
+        self._shards.cell()[0] += amount
+
+    @property
+    def value(self):
+        return self._shards.values()[0]
+
+class Histogram:
+    """固定分桶的直方图"""
+
+    __slots__ = ('bounds', '_shards')
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.bounds = tuple(buckets)
+        # 每个桶的计数，最后两个位置为超出最大分桶的计数和观测值之和
+        self._shards = _Shards(len(self.bounds) + 2)
+
+    def observe(self, value):
+        cell = self._shards.cell()
+        cell[bisect.bisect_left(self.bounds, value)] += 1
+        cell[-1] += value
+
+    def time(self):
+        """用with语句记录代码块的耗时"""
+        return _Timer(self)
+
+    def snapshot(self):
+        """返回 (累计分桶计数, 总数, 观测值之和)"""
+        values = self._shards.values()
+        cumulative = []
+        total = 0
+        for count in values[:-1]:
+            total += count
+            cumulative.append(total)
+        return cumulative, total, values[-1]
+
+class _Timer:
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+class Gauge:
+    """瞬时值，读取时调用函数获取"""
+
+    __slots__ = ('func',)
+
+    def __init__(self, func=None):
+        self.func = func
+
+    @property
+    def value(self):
+        return self.func() if self.func is not None else 0
+
+class Family:
+    """一个指标名下按标签值区分的一组指标"""
+
+    def __init__(self, kind, name, documentation, labelnames, factory):
+        self.kind = kind
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._factory = factory
+        self._children = {}
+        self._lock = threading.Lock()
+        # 没有标签的指标在注册时即输出（值为0），不等到第一次记录
+        if not self.labelnames:
+            self._children[()] = factory()
+
+    def labels(self, *values):
+        """返回标签值对应的子指标（不存在时创建）；热路径上应事先取得并保存子指标"""
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f'{self.name}需要标签{self.labelnames}')
+            with self._lock:
+                child = self._children.setdefault(key, self._factory())
+        return child
+
+    def children(self):
+        return list(self._children.items())
+
+    # 没有标签的指标直接使用
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+class Registry:
+    """指标注册表"""
+
+    def __init__(self):
+        self._families = {}
+        self._lock = threading.Lock()
+
+    def _register(self, kind, name, documentation, labelnames, factory):
+        with self._lock:
+            family = self._families.get(name)
+            if family is None:
+                family = self._families[name] = Family(kind, name, documentation, labelnames, factory)
+            elif family.kind != kind or family.labelnames != tuple(labelnames):
+                raise ValueError(f'指标已以不同的类型或标签注册: {name}')
+        return family
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register('counter', name, documentation, labelnames, Counter)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register('histogram', name, documentation, labelnames, lambda: Histogram(buckets))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register('gauge', name, documentation, labelnames, Gauge)
+
+    def function(self, kind, name, documentation, func, labels=()):
+        """注册读取时调用func取值的指标（kind为gauge或counter），用于已有的计数和队列深度等
+
+        labels为 [(标签名, 标签值), ...]；同一组标签值重复注册时使用新的func。
+        """
+        family = self._register(kind, name, documentation, [label for label, _ in labels], Gauge)
+        family.labels(*[value for _, value in labels]).func = func
+
+    def expose(self):
+        """返回Prometheus文本格式（0.0.4）的全部指标"""
+        lines = []
+        for family in list(self._families.values()):
+            lines.append(f"# HELP {family.name} {family.documentation}")
+            lines.append(f"# TYPE {family.name} {family.kind}")
+            for key, child in sorted(family.children()):
+                labels = _format_labels(family.labelnames, key)
+                if family.kind == 'histogram':
+                    cumulative, count, total = child.snapshot()
+                    for bound, value in zip(child.bounds + (float('inf'),), cumulative):
+                        le = _format_labels(family.labelnames + ('le',), key + (_format_value(bound),))
+                        lines.append(f"{family.name}_bucket{le} {value}")
+                    lines.append(f"{family.name}_sum{labels} {_format_value(total)}")
+                    lines.append(f"{family.name}_count{labels} {count}")
+                else:
+                    try:
+                        value = child.value
+                    except Exception:
+                        continue
+                    lines.append(f"{family.name}{labels} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(value) if isinstance(value, float) else str(value)
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in values)
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(names, escaped)) + '}'
+
+# 进程内的默认注册表
+registry = Registry()
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+def start_http_server(port, host='0.0.0.0'):
+    """在后台线程中提供/metrics（用于没有HTTP服务的写入进程）"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.expose().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    return server
@@ -0,0 +1,81 @@
+import asyncio
+import threading
+import paho.mqtt.client as mqtt
+from log import get_logger
+
+logger = get_logger('mqtt')
+
+class AsyncioMqttLoop:
+    """在asyncio事件循环中驱动paho MQTT客户端，代替loop_start()的后台线程
+
+    通过paho的套接字回调把MQTT连接注册到事件循环：可读时调用loop_read，
+    有数据待写时调用loop_write，并定时调用loop_misc处理心跳和重发；连接断开后按退避间隔重连。
+    """
+
+    def __init__(self, client, loop=None, reconnect_min=1, reconnect_max=60):
+        self.client = client
+        self.loop = loop or asyncio.get_event_loop()
+        self.reconnect_min = reconnect_min
+        self.reconnect_max = reconnect_max
+        self._loop_thread = None
+        self._misc_task = None
+        self._closing = False
+
+        client.on_socket_open = self._on_socket_open
+        client.on_socket_close = self._on_socket_close
+        client.on_socket_register_write = self._on_socket_register_write
+        client.on_socket_unregister_write = self._on_socket_unregister_write
+
+    def _call(self, func, *args):
+        """在事件循环线程中执行（paho可能在其他线程中触发套接字回调，如发布队列线程）"""
+        if threading.get_ident() == self._loop_thread:
+            func(*args)
+        else:
+            self.loop.call_soon_threadsafe(func, *args)
+
+    def _on_socket_open(self, client, userdata, sock):
+        self._call(self.loop.add_reader, sock, client.loop_read)
+
+    def _on_socket_close(self, client, userdata, sock):
+        self._call(self.loop.remove_reader, sock)
+        self._call(self.loop.remove_writer, sock)
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self._call(self.loop.add_writer, sock, client.loop_write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._call(self.loop.remove_writer, sock)
+
+    async def connect(self, host, port=1883, keepalive=60):
+        """连接到代理服务器（阻塞的DNS解析和TCP连接放到线程池中执行）"""
+        self._loop_thread = threading.get_ident()
+        self._closing = False
+        await self.loop.run_in_executor(None, self.client.connect, host, port, keepalive)
+        if self._misc_task is None:
+            self._misc_task = self.loop.create_task(self._misc_loop())
+
+    async def disconnect(self):
+        """断开连接并停止定时任务"""
+        self._closing = True
+        self.client.disconnect()
+        if self._misc_task:
+            self._misc_task.cancel()
+            self._misc_task = None
+
+    async def _misc_loop(self):
+        delay = self.reconnect_min
+        while not self._closing:
+            if self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+                delay = self.reconnect_min
+                await asyncio.sleep(1)
+                continue
+
+            # 连接已断开，按退避间隔重连
+            await asyncio.sleep(delay)
+            if self._closing:
+                break
+            try:
+                await self.loop.run_in_executor(None, self.client.reconnect)
+            except OSError as e:
+                logger.warning("Reconnect failed", extra={'error': str(e)})
+                delay = min(delay * 2, self.reconnect_max)
@@ -1,109 +1,293 @@
 import paho.mqtt.client as mqtt
 import json
+import logging
 import serial
 import threading
 import time
-from database import insert_data
-from config import MQTT_CONFIG
+import atexit
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from ingest import IngestPipeline
+from maintenance import RetentionWorker
+from stream import LiveBroadcaster
+from publisher import MqttPublisher
+from state_cache import LatestStateCache
+from data_tail import DataTail
+from consumer_group import ConsumerGroup
+from router import TopicRouter
+from dedup import Deduplicator
+from rules import RuleEngine
+from metrics import registry
+import log
+from telemetry import extract_device_id, extract_metrics
+from database import get_latest_states
+from serial_manager import SerialManager
+from serial_log import SerialLogStore
+from config import MQTT_CONFIG, DEPLOY_CONFIG, SERIAL_CONFIG, SERIAL_LOG_CONFIG, DEDUP_CONFIG, RULES_CONFIG
 
-# 串口调试相关变量
-serial_connection = None
-serial_lock = threading.Lock()
+logger = log.get_logger('mqtt')
+# 每条设备数据一行日志，由LOG_CONFIG限速
+message_logger = log.get_logger('mqtt.message')
+serial_logger = log.get_logger('serial')
+
+# 串口管理（由init_serial()启动，只在写入进程中使用）：每个连接的设备一个串口调试桥
+serial_manager = SerialManager()
+# 串口日志（写入进程记录全部串口输出，HTTP工作进程只读取日志文件）
+serial_log = SerialLogStore()
+# 执行串口命令的线程，避免等待设备响应时阻塞MQTT回调线程
+serial_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='serial-command')
+# HTTP工作进程中通过MQTT转发、等待结果的串口命令：请求ID -> Future
+serial_requests = {}
+serial_requests_lock = threading.Lock()
+
+# 数据写入流水线（回调线程只入队，由写线程批量写库）
+ingest_pipeline = IngestPipeline()
+# 过期数据清理任务
+retention_worker = RetentionWorker()
+# 实时数据推送（浏览器通过SSE订阅，不经过数据库）
+live_stream = LiveBroadcaster()
+# 每个设备的最新状态（/api/devices/state直接读取，不访问数据库）
+device_states = LatestStateCache()
+
+def is_http_role():
+    """当前进程是否为多进程部署中的HTTP工作进程（不订阅MQTT、不写库）"""
+    return DEPLOY_CONFIG['role'] == 'http'
+
+def uses_consumer_group():
+    """是否由共享订阅消费组（而不是主客户端）订阅设备数据"""
+    return MQTT_CONFIG.get('consumer_count', 1) > 1 and not is_http_role()
 
 # MQTT连接回调
 def on_connect(client, userdata, flags, rc):
     if rc == 0:
-        print("Connected to MQTT Broker")
-        client.subscribe(MQTT_CONFIG['topic_subscribe'])
+        logger.info("Connected to MQTT Broker")
+        # HTTP工作进程只发布消息，订阅和写库由唯一的写入进程负责，避免每条消息被写入多次；
+        # 使用消费组时由各消费者订阅
+        if not is_http_role() and not uses_consumer_group():
+            client.subscribe(MQTT_CONFIG['topic_subscribe'])
+            for topic in MQTT_CONFIG.get('device_topics', []):
+                client.subscribe(topic)
+        if is_http_role():
+            # 接收写入进程转发回来的串口命令结果
+            client.subscribe(SERIAL_CONFIG['response_topic'])
+        mqtt_publisher.set_connected(True)
     else:
-        print(f"Failed to connect, return code {rc}")
+        logger.error("Failed to connect", extra={'rc': rc})
 
-# MQTT消息接收回调
-def on_message(client, userdata, msg):
+# MQTT断开连接回调
+def on_disconnect(client, userdata, rc):
+    mqtt_publisher.set_connected(False)
+    if rc != 0:
+        logger.warning("Unexpected disconnection from MQTT Broker", extra={'rc': rc})
+
+# 消息路由表：按主题选择处理函数、负载解码方式和是否写库；写库的路由丢弃重连重发和QoS1重传的重复消息
+router = TopicRouter(deduplicator=Deduplicator() if DEDUP_CONFIG['enabled'] else None)
+
+# 设备数据（JSON）：写库，更新设备最新状态，检查规则，并实时推送给已订阅的浏览器
+def handle_device_data(topic, data, received_at):
+    if message_logger.isEnabledFor(logging.INFO):
+        message_logger.info("Received message", extra={'topic': topic, 'data': data})
+    device_id = extract_device_id(topic, data)
+    metrics = extract_metrics(data)
+    device_states.update(device_id, topic, metrics, data, received_at)
+    rule_engine.evaluate(topic, device_id, metrics, received_at)
+    live_stream.publish(topic, device_id, data, received_at)
+
+# 是否为串口调试命令（订阅主题上的调试流量，不是设备数据）
+def is_serial_command(data):
+    return isinstance(data, dict) and 'command' in data and data.get('type') == 'serial_debug'
+
+# 订阅主题上的数据：串口调试命令只执行，不写库也不作为设备数据处理
+def handle_subscribe_data(topic, data, received_at):
+    if is_serial_command(data):
+        serial_executor.submit(handle_serial_command, data['command'], data.get('requestId'), data.get('timeout'),
+                               data.get('device'))
+        return
+    handle_device_data(topic, data, received_at)
+
+# 串口命令结果（HTTP工作进程订阅，交给等待中的请求）
+def handle_serial_response(topic, data, received_at):
+    request_id = data.get('requestId') if isinstance(data, dict) else None
+    with serial_requests_lock:
+        future = serial_requests.pop(request_id, None)
+    if future is not None and not future.done():
+        future.set_result(data)
+
+# 设备上线通知（纯文本，如"SmartRelay online - AA:BB:CC:DD:EE:FF"）：只推送给浏览器，不解析JSON也不写库
+def handle_device_status(topic, text, received_at):
+    device_id = text.rsplit(' - ', 1)[1] if ' - ' in text else text.split(' ', 1)[0]
+    live_stream.publish(topic, device_id, {'status': text}, received_at)
+
+# 未单独注册的订阅主题按设备数据处理；确定的主题优先于通配符主题
+router.add('#', handle_device_data, codec='json', persist=True)
+router.add(MQTT_CONFIG['topic_subscribe'], handle_subscribe_data, codec='json',
+           persist=lambda data: not is_serial_command(data))
+router.add('mySmartHome/sensor/#', handle_device_data, codec='json', persist=True)
+router.add('mySmartHome/relay/+/status', handle_device_data, codec='json', persist=True)
+router.add('mySmartHome/socket/status', handle_device_data, codec='json', persist=True)
+router.add('mySmartHome/device/status', handle_device_status, codec='text', persist=False)
+router.add(SERIAL_CONFIG['response_topic'], handle_serial_response, codec='json', persist=False)
+# 高频设备的紧凑二进制遥测（格式见binary_telemetry.py），解码后与JSON数据相同处理
+router.add('mySmartHome/bin/+', handle_device_data, codec='binary', persist=True)
+
+# 处理一条MQTT消息（主客户端和消费组中的各消费者共用，pipeline为各自的写入流水线）
+def process_message(topic, payload, pipeline):
     try:
-        payload = msg.payload.decode()
-        data = json.loads(payload)
-        print(f"Received message: {data}")
-        
-        # 存储到数据库
-        insert_data(data)
-        
-        # 检查是否是串口调试消息
-        if 'command' in data and data.get('type') == 'serial_debug':
-            handle_serial_command(data['command'])
-            
+        router.dispatch(topic, payload, time.time(), pipeline)
     except Exception as e:
-        print(f"Error processing message: {e}")
+        logger.error("Error processing message", extra={'topic': topic, 'error': str(e)})
+
+# MQTT消息接收回调
+def on_message(client, userdata, msg):
+    process_message(msg.topic, msg.payload, ingest_pipeline)
+
+# 从数据库预热设备状态缓存
+def warm_state_cache():
+    """用数据库中每个设备的最新数据预热状态缓存，返回设备数"""
+    states = get_latest_states()
+    for state in states:
+        device_states.update(state['device'], state['topic'], state['metrics'].items(),
+                             state['data'], state['ts'])
+    return len(states)
+
+# 处理写入进程新写入的记录（HTTP工作进程中由data_tail调用）
+def apply_stored_data(row):
+    if row['data'] is None:
+        return
+    device_states.update(row['device'], row['topic'], extract_metrics(row['data']), row['data'], row['ts'])
+    live_stream.publish(row['topic'], row['device'], row['data'], row['ts'], event_id=row['id'])
+
+# 跟踪写入进程新写入的数据（仅HTTP工作进程使用）
+data_tail = DataTail(apply_stored_data)
 
-# 处理串口命令
-def handle_serial_command(command):
-    """处理串口调试命令"""
+# 共享订阅消费组（consumer_count大于1时使用）
+consumer_group = ConsumerGroup(process_message, pipeline=ingest_pipeline)
+
+registry.function('gauge', 'smarthome_stream_subscribers', '实时数据推送（SSE）的订阅者数',
+                  lambda: live_stream.stats()['subscribers'])
+registry.function('gauge', 'smarthome_publish_pending', '等待发送到MQTT代理的消息数',
+                  lambda: mqtt_publisher.stats()['pending'])
+registry.function('gauge', 'smarthome_mqtt_connected', 'MQTT客户端是否已连接（1/0）',
+                  lambda: int(mqtt_publisher.stats()['connected']))
+registry.function('gauge', 'smarthome_serial_ports', '已打开的串口数', lambda: len(serial_manager.devices()))
+
+def ingest_stats():
+    """返回写入统计（使用消费组时包含每个消费者的吞吐量和积压）"""
+    stats = consumer_group.stats() if uses_consumer_group() else ingest_pipeline.stats()
+    stats['routes'] = router.stats()
+    stats['serial'] = serial_manager.stats()
+    stats['serial_log'] = serial_log.stats()
+    stats['log'] = log.stats()
+    stats['rules'] = rule_engine.stats()
+    return stats
+
+# 在本进程的串口上执行命令
+def run_serial_command(command, timeout=None, device=None):
+    """向设备（设备ID或串口名，不指定时为第一个串口）发送串口命令并等待响应，返回结果字典
+
+    没有对应的串口时抛出serial.SerialException。
+    """
+    result = serial_manager.command(command, device=device, timeout=timeout)
+    result['response'] = '\n'.join(result['lines'])
+    return result
+
+# 处理串口命令（来自MQTT的serial_debug消息，在serial_executor中执行）
+def handle_serial_command(command, request_id=None, timeout=None, device=None):
+    """处理串口调试命令，并把结果发布到MQTT"""
     try:
-        with serial_lock:
-            if serial_connection and serial_connection.is_open:
-                # 发送命令到串口
-                serial_connection.write((command + '\r\n').encode())
-                print(f"[SERIAL] Sent command: {command}")
-                
-                # 读取响应
-                time.sleep(0.1)  # 等待响应
-                response = serial_connection.read_all().decode().strip()
-                if response:
-                    print(f"[SERIAL] Response: {response}")
-                    
-                    # 发布响应到MQTT
-                    response_data = {
-                        'type': 'serial_response',
-                        'command': command,
-                        'response': response,
-                        'timestamp': time.time()
-                    }
-                    client.publish('mySmartHome/debug/serial', json.dumps(response_data))
-                    
-    except Exception as e:
-        print(f"[SERIAL] Error handling command: {e}")
+        result = run_serial_command(command, timeout, device)
+        serial_logger.info("Command finished", extra={'command': command, 'complete': result['complete'],
+                                                      'elapsed': result['elapsed']})
+        response_data = dict(result, type='serial_response', timestamp=time.time())
+    except serial.SerialException as e:
+        serial_logger.warning("Error handling command", extra={'command': command, 'error': str(e)})
+        response_data = {'type': 'serial_response', 'command': command, 'error': str(e), 'timestamp': time.time()}
+    if request_id:
+        response_data['requestId'] = request_id
+    mqtt_publisher.publish(SERIAL_CONFIG['response_topic'], json.dumps(response_data))
+
+def request_serial_command(command, timeout=None, device=None):
+    """执行串口命令，返回Future（结果同run_serial_command）
+
+    串口由写入进程打开；HTTP工作进程中通过MQTT把命令转发给写入进程，并等待带相同请求ID的结果。
+    """
+    if not is_http_role():
+        return serial_executor.submit(run_serial_command, command, timeout, device)
+
+    request_id = uuid.uuid4().hex
+    future = Future()
+    with serial_requests_lock:
+        serial_requests[request_id] = future
+    message = {'type': 'serial_debug', 'command': command, 'requestId': request_id, 'timeout': timeout,
+               'device': device}
+    mqtt_publisher.publish(MQTT_CONFIG['topic_subscribe'], json.dumps(message))
+    return future
+
+def cancel_serial_request(future):
+    """放弃等待一个转发的串口命令"""
+    with serial_requests_lock:
+        for request_id, pending in list(serial_requests.items()):
+            if pending is future:
+                del serial_requests[request_id]
 
 # 初始化串口连接
 def init_serial():
-    """初始化串口连接"""
-    global serial_connection
-    try:
-        # 尝试常见的串口设备
-        ports = ['COM3', 'COM4', 'COM5', '/dev/ttyUSB0', '/dev/ttyUSB1', '/dev/ttyACM0']
-        
-        for port in ports:
-            try:
-                serial_connection = serial.Serial(
-                    port=port,
-                    baudrate=115200,
-                    bytesize=serial.EIGHTBITS,
-                    parity=serial.PARITY_NONE,
-                    stopbits=serial.STOPBITS_ONE,
-                    timeout=1
-                )
-                print(f"[SERIAL] Connected to {port}")
-                return True
-            except serial.SerialException:
-                continue
-                
-        print("[SERIAL] No serial device found")
-        return False
-        
-    except Exception as e:
-        print(f"[SERIAL] Initialization error: {e}")
-        return False
+    """启动串口管理：扫描并打开已连接的设备串口，之后在后台检测热插拔和断线重连"""
+    if SERIAL_LOG_CONFIG['enabled']:
+        serial_log.start()
+        serial_manager.add_listener(serial_log.capture)
+        serial_manager.on_connect = serial_log.set_device
+        atexit.register(serial_log.stop)
+    serial_manager.start()
+    atexit.register(serial_manager.stop)
 
 # 初始化MQTT客户端
 client = mqtt.Client()
 client.on_connect = on_connect
+client.on_disconnect = on_disconnect
 client.on_message = on_message
 
-# 连接到代理服务器
-client.connect(
-    MQTT_CONFIG['broker_url'], 
-    int(MQTT_CONFIG['port']), 
-    int(MQTT_CONFIG['keepalive'])
-)
+# 异步发布队列（跟踪on_publish确认，断线时缓存待发消息）
+mqtt_publisher = MqttPublisher(client)
+client.on_publish = mqtt_publisher.on_publish
 
-# 初始化串口连接
-init_serial()
\ No newline at end of file
+# 规则引擎（只在写入进程中加载规则，动作通过发布队列发送）
+rule_engine = RuleEngine(mqtt_publisher.publish)
+
+def start_services():
+    """启动写入流水线、过期数据清理任务、规则引擎和发布队列
+
+    HTTP工作进程不写库，改为启动data_tail从数据库跟踪新数据。
+    """
+    if is_http_role():
+        data_tail.start()
+    else:
+        # 退出时写完队列中剩余的数据
+        ingest_pipeline.start()
+        atexit.register(ingest_pipeline.stop)
+        atexit.register(consumer_group.stop)
+        retention_worker.start()
+        if RULES_CONFIG['enabled']:
+            rule_engine.start()
+            atexit.register(rule_engine.stop)
+    mqtt_publisher.start()
+
+def connect():
+    """连接到MQTT代理服务器"""
+    client.connect(
+        MQTT_CONFIG['broker_url'], 
+        int(MQTT_CONFIG['port']), 
+        int(MQTT_CONFIG['keepalive'])
+    )
+
+def start():
+    """启动后台服务，连接代理并在独立线程中运行MQTT客户端循环"""
+    start_services()
+    connect()
+    client.loop_start()
+    if uses_consumer_group():
+        consumer_group.start()
+
+    # 初始化串口连接（串口只由写入进程打开）
+    if not is_http_role():
+        init_serial()
\ No newline at end of file
@@ -0,0 +1,121 @@
+import base64
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from config import PASSWORD_CONFIG
+
+# 密码哈希格式：pbkdf2_sha256$迭代次数$盐$哈希值
+ALGORITHM = 'pbkdf2_sha256'
+
+# 密码哈希专用线程池（hashlib.pbkdf2_hmac计算时释放GIL，限制同时进行的哈希计算数量）
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_CONFIG['workers'], thread_name_prefix='password-hash')
+
+def _b64encode(raw):
+    return base64.b64encode(raw).decode('ascii').rstrip('=')
+
+def _b64decode(text):
+    return base64.b64decode(text + '=' * (-len(text) % 4))
+
+def _pbkdf2(password, salt, iterations):
+    return hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations)
+
+def make_password_hash(password, iterations=None):
+    """在当前线程计算密码哈希"""
+    iterations = iterations or PASSWORD_CONFIG['iterations']
+    salt = os.urandom(16)
+    return f"{ALGORITHM}${iterations}${_b64encode(salt)}${_b64encode(_pbkdf2(password, salt, iterations))}"
+
+def check_password_hash(password, stored):
+    """在当前线程校验密码，兼容旧版的无盐SHA-256哈希"""
+    if not stored:
+        return False
+    if stored.startswith(ALGORITHM + '$'):
+        try:
+            _, iterations, salt, expected = stored.split('$')
+            computed = _pbkdf2(password, _b64decode(salt), int(iterations))
+        except ValueError:
+            return False
+        return hmac.compare_digest(computed, _b64decode(expected))
+    # 旧版格式：sha256十六进制字符串
+    return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), stored)
+
+def needs_rehash(stored, iterations=None):
+    """判断已存储的哈希是否需要按当前工作因子重新计算（旧格式或迭代次数不同）"""
+    iterations = iterations or PASSWORD_CONFIG['iterations']
+    if not stored.startswith(ALGORITHM + '$'):
+        return True
+    try:
+        return int(stored.split('$')[1]) != iterations
+    except (IndexError, ValueError):
+        return True
+
+def hash_password(password):
+    """在密码哈希线程池中计算密码哈希"""
+    return _executor.submit(make_password_hash, password).result()
+
+def verify_password(password, stored):
+    """在密码哈希线程池中校验密码"""
+    return _executor.submit(check_password_hash, password, stored).result()
+
+class CredentialCache:
+    """最近验证通过的凭据缓存
+
+    保存 (用户名, 密码摘要) -> 用户信息，条目有较短的有效期且数量有上限（LRU淘汰）。
+    密码摘要使用进程内随机密钥的HMAC，缓存中不保存明文密码。摘要中包含数据库中保存的密码哈希，
+    调用方每次从数据库读取当前的哈希：任何进程修改密码后，各HTTP工作进程中的旧条目都不再命中。
+    本进程修改密码时仍调用invalidate_user()，及时释放旧条目。
+    """
+
+    def __init__(self, max_entries=None, ttl=None):
+        self.max_entries = PASSWORD_CONFIG['cache_size'] if max_entries is None else max_entries
+        self.ttl = PASSWORD_CONFIG['cache_ttl'] if ttl is None else ttl
+        self._key = os.urandom(32)
+        self._entries = OrderedDict()   # 用户名 -> (摘要, 用户信息, 过期时间)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _digest(self, username, password, stored):
+        return hmac.new(self._key, f"{username}\0{password}\0{stored}".encode(), hashlib.sha256).digest()
+
+    def get(self, username, password, stored):
+        """凭据（stored为数据库中当前的密码哈希）命中缓存时返回用户信息，否则返回None"""
+        digest = self._digest(username, password, stored)
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is not None and entry[2] > time.time() and hmac.compare_digest(entry[0], digest):
+                self._entries.move_to_end(username)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def put(self, username, password, stored, user):
+        """缓存一次验证通过的凭据（stored为验证时数据库中的密码哈希）"""
+        if self.max_entries <= 0 or self.ttl <= 0:
+            return
+        digest = self._digest(username, password, stored)
+        with self._lock:
+            self._entries[username] = (digest, user, time.time() + self.ttl)
+            self._entries.move_to_end(username)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_user(self, user_id):
+        """删除某个用户的缓存凭据（修改密码后调用）"""
+        with self._lock:
+            for username, entry in list(self._entries.items()):
+                if entry[1].get('id') == user_id:
+                    del self._entries[username]
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+
+# 全局凭据缓存
+credential_cache = CredentialCache()
@@ -0,0 +1,203 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+import paho.mqtt.client as mqtt
+from config import PUBLISH_CONFIG
+
+class PublishRequest:
+    """一条待发布的消息及其结果Future"""
+
+    __slots__ = ('topic', 'payload', 'qos', 'retain', 'future', 'created_at', 'sent_at', 'mid')
+
+    def __init__(self, topic, payload, qos, retain):
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.retain = retain
+        self.future = Future()
+        self.created_at = time.time()
+        self.sent_at = None
+        self.mid = None
+
+class MqttPublisher:
+    """异步MQTT发布队列
+
+    publish()立即返回Future，由发送线程调用client.publish；收到on_publish回调
+    （QoS 0为写出后，QoS 1/2为收到代理确认后）时Future完成并返回消息ID。
+    与代理断开时消息留在有界缓冲区中，重新连接后按顺序发送；缓冲区满时新消息直接失败。
+    已交给paho的QoS 1/2消息由paho保存，重新连接后由paho重发，不再从缓冲区重复发送。
+    """
+
+    def __init__(self, client, qos=None, buffer_size=None, ack_timeout=None):
+        self.client = client
+        self.qos = PUBLISH_CONFIG['qos'] if qos is None else qos
+        self.buffer_size = buffer_size or PUBLISH_CONFIG['buffer_size']
+        self.ack_timeout = ack_timeout or PUBLISH_CONFIG['ack_timeout']
+        self._pending = deque()         # 等待发送的消息
+        self._inflight = {}             # 消息ID -> 已发送、等待确认的消息
+        self._early_acks = set()        # 在登记之前就收到确认的消息ID
+        self._expired = set()           # 已超时失败、paho仍可能重发并确认的消息ID
+        self._cond = threading.Condition()
+        self._connected = False
+        self._running = False
+        self._thread = None
+
+        # 统计计数
+        self.published = 0
+        self.delivered = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def start(self):
+        """启动发送线程"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='mqtt-publisher', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        """停止发送线程"""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def publish(self, topic, payload, qos=None, retain=False):
+        """把消息放入发布队列，返回Future（结果为消息ID）"""
+        request = PublishRequest(topic, payload, self.qos if qos is None else qos, retain)
+        with self._cond:
+            if len(self._pending) >= self.buffer_size:
+                self.rejected += 1
+                request.future.set_exception(BufferError('发布缓冲区已满'))
+                return request.future
+            self._pending.append(request)
+            self._cond.notify()
+        return request.future
+
+    def set_connected(self, connected):
+        """MQTT连接状态变化时调用（在on_connect/on_disconnect中）"""
+        with self._cond:
+            self._connected = connected
+            self._cond.notify()
+
+    def on_publish(self, client, userdata, mid):
+        """paho的on_publish回调"""
+        with self._cond:
+            request = self._inflight.pop(mid, None)
+            if request is None:
+                # 已超时的消息迟到的确认不能记为提前确认，否则会让之后复用该ID的消息误判为已送达
+                if mid in self._expired:
+                    self._expired.discard(mid)
+                else:
+                    self._early_acks.add(mid)
+                return
+            self.delivered += 1
+        request.future.set_result(mid)
+
+    def stats(self):
+        """返回发布队列统计"""
+        with self._cond:
+            return {
+                'connected': self._connected,
+                'pending': len(self._pending),
+                'inflight': len(self._inflight),
+                'published': self.published,
+                'delivered': self.delivered,
+                'failed': self.failed,
+                'rejected': self.rejected
+            }
+
+    def _run(self):
+        next_check = 0
+        while True:
+            with self._cond:
+                while self._running and not (self._connected and self._pending):
+                    self._cond.wait(1.0)
+                    self._expire_inflight()
+                if not self._running:
+                    break
+                request = self._pending.popleft()
+                if time.time() >= next_check:
+                    self._expire_inflight()
+                    next_check = time.time() + 1.0
+
+            self._send(request)
+
+        # 停止时让未完成的消息失败，避免调用方一直等待
+        with self._cond:
+            remaining = list(self._pending) + list(self._inflight.values())
+            self._pending.clear()
+            self._inflight.clear()
+        for request in remaining:
+            if not request.future.done():
+                request.future.set_exception(RuntimeError('发布队列已停止'))
+
+    def _send(self, request):
+        if not self.client.is_connected():
+            # on_disconnect尚未回调，消息留在缓冲区中，不交给paho排队
+            self._requeue(request)
+            return
+        try:
+            info = self.client.publish(request.topic, request.payload, request.qos, request.retain)
+        except Exception as e:
+            self._fail(request, e)
+            return
+
+        if info.rc == mqtt.MQTT_ERR_NO_CONN:
+            if request.qos == 0:
+                # QoS 0消息paho不保存，放回队首，等待重新连接后再发
+                self._requeue(request)
+                return
+            # QoS 1/2消息paho已保存，重新连接后由paho重发，按已发送等待确认
+            with self._cond:
+                self._connected = False
+        elif info.rc != mqtt.MQTT_ERR_SUCCESS:
+            self._fail(request, RuntimeError(f'发布失败，返回码: {info.rc}'))
+            return
+
+        request.mid = info.mid
+        request.sent_at = time.time()
+        with self._cond:
+            self.published += 1
+            # paho不会分配仍在其队列中的消息ID，ID被复用说明超时的旧消息已不会再确认
+            self._expired.discard(info.mid)
+            if info.mid in self._early_acks:
+                self._early_acks.discard(info.mid)
+                self.delivered += 1
+                acked = True
+            else:
+                self._inflight[info.mid] = request
+                acked = False
+        if acked:
+            request.future.set_result(info.mid)
+
+    def _requeue(self, request):
+        with self._cond:
+            self._connected = False
+            self._pending.appendleft(request)
+
+    def _fail(self, request, error):
+        with self._cond:
+            self.failed += 1
+        if not request.future.done():
+            request.future.set_exception(error)
+
+    def _expire_inflight(self):
+        """让超过ack_timeout仍未确认的消息失败（需持有锁）"""
+        if not self._inflight:
+            return
+        deadline = time.time() - self.ack_timeout
+        for mid, request in list(self._inflight.items()):
+            if request.sent_at < deadline:
+                del self._inflight[mid]
+                self._expired.add(mid)
+                self.failed += 1
+                request.future.set_exception(TimeoutError('等待代理确认超时'))
+        # 未匹配的提前确认不会再被使用，防止集合无限增长
+        if len(self._early_acks) > 1000:
+            self._early_acks.clear()
+        if len(self._expired) > 1000:
+            self._expired.clear()
@@ -0,0 +1,88 @@
+"""时序数据的汇总表（1分钟、1小时、1天）
+
+汇总表按水位线（已汇总到的telemetry.id）增量维护，每次只处理新写入的行，
+不会重新扫描原始数据（telemetry.id为AUTOINCREMENT，只增不减）。这些函数都在调用方提供的连接和事务中执行。
+"""
+
+# 汇总级别：(表名, 时间桶秒数)，按精度从细到粗排列
+ROLLUP_LEVELS = [
+    ('telemetry_1m', 60),
+    ('telemetry_1h', 3600),
+    ('telemetry_1d', 86400)
+]
+
+def create_rollup_tables(conn):
+    """创建汇总表和水位线表"""
+    for table, _ in ROLLUP_LEVELS:
+        conn.execute(f'''CREATE TABLE IF NOT EXISTS {table}
+                         (device_id TEXT NOT NULL,
+                          metric TEXT NOT NULL,
+                          bucket INTEGER NOT NULL,
+                          min REAL,
+                          max REAL,
+                          sum REAL,
+                          count INTEGER,
+                          PRIMARY KEY (device_id, metric, bucket)) WITHOUT ROWID''')
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_bucket ON {table} (bucket)")
+
+    conn.execute('''CREATE TABLE IF NOT EXISTS rollup_state
+                    (name TEXT PRIMARY KEY,
+                     watermark INTEGER NOT NULL)''')
+    conn.execute("INSERT OR IGNORE INTO rollup_state (name, watermark) VALUES ('telemetry', 0)")
+
+def get_watermark(conn):
+    """返回已汇总到的telemetry.id"""
+    row = conn.execute("SELECT watermark FROM rollup_state WHERE name = 'telemetry'").fetchone()
+    return row[0] if row else 0
+
+def advance_rollups(conn, max_rows=50000):
+    """把水位线之后的新数据合并进各级汇总表，返回本次处理的行数
+
+    每次最多处理max_rows行，积压较多时由调用方多次调用追平。
+    """
+    low = get_watermark(conn)
+    newest = conn.execute("SELECT MAX(id) FROM telemetry").fetchone()[0]
+    if newest is None or newest <= low:
+        return 0
+    high = min(newest, low + max_rows)
+
+    for table, seconds in ROLLUP_LEVELS:
+        conn.execute(f'''INSERT INTO {table} (device_id, metric, bucket, min, max, sum, count)
+                         SELECT device_id, metric, CAST(ts / {seconds} AS INTEGER) * {seconds} AS b,
+                                MIN(value), MAX(value), SUM(value), COUNT(value)
+                         FROM telemetry
+                         WHERE id > ? AND id <= ? AND value IS NOT NULL
+                         GROUP BY device_id, metric, b
+                         ON CONFLICT (device_id, metric, bucket) DO UPDATE SET
+                             min = MIN(min, excluded.min),
+                             max = MAX(max, excluded.max),
+                             sum = sum + excluded.sum,
+                             count = count + excluded.count''', (low, high))
+
+    conn.execute("UPDATE rollup_state SET watermark = ? WHERE name = 'telemetry'", (high,))
+    return high - low
+
+def pick_rollup(bucket):
+    """选择能满足时间桶精度的最粗汇总表，没有合适的返回None（使用原始数据）"""
+    for table, seconds in reversed(ROLLUP_LEVELS):
+        if bucket >= seconds and bucket % seconds == 0:
+            return table, seconds
+    return None
+
+def prune_raw_batch(conn, cutoff, batch_size):
+    """删除一批早于cutoff且已经汇总过的原始时序数据，返回删除行数
+
+    只检查id最小的batch_size行（id基本按时间递增），避免每次扫描全表。
+    """
+    watermark = get_watermark(conn)
+    cursor = conn.execute('''DELETE FROM telemetry WHERE id IN
+                             (SELECT id FROM telemetry WHERE id <= ? ORDER BY id LIMIT ?)
+                             AND ts < ?''', (watermark, batch_size, cutoff))
+    return cursor.rowcount
+
+def prune_rollup_batch(conn, table, cutoff, batch_size):
+    """删除一批早于cutoff的汇总数据，返回删除行数"""
+    cursor = conn.execute(f'''DELETE FROM {table} WHERE (device_id, metric, bucket) IN
+                              (SELECT device_id, metric, bucket FROM {table} WHERE bucket < ? LIMIT ?)''',
+                          (cutoff, batch_size))
+    return cursor.rowcount
@@ -0,0 +1,208 @@
+import threading
+import time
+import binary_telemetry
+import codec
+from metrics import Counter, registry
+
+def decode_json(payload):
+    return codec.loads(payload)
+
+def decode_text(payload):
+    return payload.decode('utf-8', errors='replace')
+
+def decode_raw(payload):
+    return payload
+
+# 负载解码方式：名称 -> 解码函数(bytes) -> 数据
+CODECS = {
+    'json': decode_json,
+    'binary': binary_telemetry.decode,
+    'text': decode_text,
+    'raw': decode_raw
+}
+
+MESSAGES = registry.counter('smarthome_mqtt_messages_total', '按路由统计的MQTT消息数', ['route'])
+DECODE_ERRORS = registry.counter('smarthome_mqtt_decode_errors_total', '按路由统计的负载解码失败数', ['route'])
+DECODE_SECONDS = registry.histogram('smarthome_mqtt_decode_seconds', '负载解码耗时', ['codec'])
+UNMATCHED = registry.counter('smarthome_mqtt_unmatched_total', '没有匹配路由的MQTT消息数')
+DUPLICATES = registry.counter('smarthome_mqtt_duplicates_total', '按路由统计的被去重丢弃的MQTT消息数', ['route'])
+
+class Route:
+    """一条路由：主题过滤器、处理函数、负载解码方式、存储策略和是否去重"""
+
+    __slots__ = ('filter', 'handler', 'codec', 'decode', 'persist', 'dedup', 'order', 'rank', '_matched', '_errors',
+                 '_duplicates', 'messages_metric', 'errors_metric', 'decode_metric', 'duplicates_metric')
+
+    def __init__(self, topic_filter, handler, codec, persist, order, dedup=False):
+        if codec not in CODECS:
+            raise ValueError(f'未知的负载解码方式: {codec}')
+        self.filter = topic_filter
+        self.handler = handler
+        self.codec = codec
+        self.decode = CODECS[codec]
+        self.persist = persist
+        self.dedup = dedup
+        self.order = order
+        # 优先级：从左到右逐级比较，确定的主题层级优先于+，+优先于#
+        self.rank = tuple(0 if level == '#' else 1 if level == '+' else 2 for level in topic_filter.split('/'))
+        # 消费组的多个线程共用同一个路由表，计数按线程分片，不加锁
+        self._matched = Counter()
+        self._errors = Counter()
+        self._duplicates = Counter()
+        # 按路由（而不是具体主题）统计，设备数量增加时指标数不变
+        self.messages_metric = MESSAGES.labels(topic_filter)
+        self.errors_metric = DECODE_ERRORS.labels(topic_filter)
+        self.decode_metric = DECODE_SECONDS.labels(codec)
+        self.duplicates_metric = DUPLICATES.labels(topic_filter)
+
+    @property
+    def matched(self):
+        return self._matched.value
+
+    @property
+    def errors(self):
+        return self._errors.value
+
+    @property
+    def duplicates(self):
+        return self._duplicates.value
+
+    def stats(self):
+        persist = 'conditional' if callable(self.persist) else self.persist
+        return {'filter': self.filter, 'codec': self.codec, 'persist': persist,
+                'matched': self.matched, 'errors': self.errors, 'duplicates': self.duplicates}
+
+class _Node:
+    __slots__ = ('children', 'routes')
+
+    def __init__(self):
+        self.children = {}
+        self.routes = []
+
+class TopicRouter:
+    """按MQTT主题过滤器（支持+和#通配符）分发消息的前缀树路由表
+
+    一条消息匹配多个过滤器时只使用最具体的一条路由。主题到路由的查找结果会被缓存，
+    设备主题数量有限，绝大多数消息只需要一次字典查找。
+    指定deduplicator时，去重的路由在解码后先检查是否为重复消息，重复消息不写库也不调用处理函数。
+    """
+
+    def __init__(self, cache_size=10000, deduplicator=None):
+        self.deduplicator = deduplicator
+        self._root = _Node()
+        self._routes = []
+        self._cache = {}
+        self._cache_size = cache_size
+        self._lock = threading.Lock()
+        self._unmatched = Counter()
+
+    @property
+    def unmatched(self):
+        return self._unmatched.value
+
+    def add(self, topic_filter, handler=None, codec='json', persist=False, dedup=None):
+        """注册路由
+
+        handler(topic, data, received_at)在解码后调用；persist为True时消息同时放入写入流水线
+        （json解码的负载以原始字节保存），为函数时只有persist(data)为真的消息写库。
+        dedup默认在persist不为False时启用。
+        """
+        levels = topic_filter.split('/')
+        if '#' in levels[:-1] or any(('+' in level or '#' in level) and len(level) > 1 for level in levels):
+            raise ValueError(f'无效的主题过滤器: {topic_filter}')
+
+        with self._lock:
+            route = Route(topic_filter, handler, codec, persist, len(self._routes),
+                          bool(persist) if dedup is None else dedup)
+            node = self._root
+            for level in levels:
+                node = node.children.setdefault(level, _Node())
+            node.routes.append(route)
+            self._routes.append(route)
+            self._cache = {}
+        return route
+
+    def route(self, topic_filter, codec='json', persist=False, dedup=None):
+        """以装饰器方式注册路由"""
+        def decorator(handler):
+            self.add(topic_filter, handler, codec, persist, dedup)
+            return handler
+        return decorator
+
+    def match_all(self, topic):
+        """返回与主题匹配的全部路由"""
+        levels = topic.split('/')
+        matches = []
+        self._match(self._root, levels, 0, matches, topic.startswith('$'))
+        return matches
+
+    def _match(self, node, levels, depth, matches, system_topic):
+        # 以$开头的主题（如$SYS）不匹配首层的通配符
+        wildcards = not (system_topic and depth == 0)
+        if wildcards and '#' in node.children:
+            matches.extend(node.children['#'].routes)
+        if depth == len(levels):
+            matches.extend(node.routes)
+            return
+        child = node.children.get(levels[depth])
+        if child is not None:
+            self._match(child, levels, depth + 1, matches, system_topic)
+        if wildcards and '+' in node.children:
+            self._match(node.children['+'], levels, depth + 1, matches, system_topic)
+
+    def resolve(self, topic):
+        """返回与主题匹配的最具体的路由，没有匹配时返回None"""
+        try:
+            return self._cache[topic]
+        except KeyError:
+            pass
+        matches = self.match_all(topic)
+        route = max(matches, key=lambda r: (r.rank, -r.order)) if matches else None
+        with self._lock:
+            if len(self._cache) >= self._cache_size:
+                self._cache = {}
+            self._cache[topic] = route
+        return route
+
+    def dispatch(self, topic, payload, received_at, pipeline=None):
+        """解码并处理一条消息，返回使用的路由（没有匹配时返回None）
+
+        解码失败时计入该路由的errors并抛出异常。
+        """
+        route = self.resolve(topic)
+        if route is None:
+            self._unmatched.inc()
+            UNMATCHED.inc()
+            return None
+        route._matched.inc()
+        route.messages_metric.inc()
+        start = time.perf_counter()
+        try:
+            data = route.decode(payload)
+        except ValueError:
+            route._errors.inc()
+            route.errors_metric.inc()
+            raise
+        route.decode_metric.observe(time.perf_counter() - start)
+        if route.dedup and self.deduplicator is not None and self.deduplicator.is_duplicate(topic, data, payload):
+            route._duplicates.inc()
+            route.duplicates_metric.inc()
+            return route
+        persist = route.persist
+        if persist and pipeline is not None and (persist is True or persist(data)):
+            # JSON负载已校验且无需转换，原样保存，写库时不再重新序列化
+            raw = payload if route.codec == 'json' else None
+            pipeline.submit((topic, received_at, data, raw))
+        if route.handler is not None:
+            route.handler(topic, data, received_at)
+        return route
+
+    def stats(self):
+        """返回每条路由的匹配次数"""
+        stats = {
+            'routes': [route.stats() for route in self._routes],
+            'unmatched': self.unmatched
+        }
+        if self.deduplicator is not None:
+            stats['dedup'] = self.deduplicator.stats()
+        return stats
@@ -0,0 +1,403 @@
+"""规则引擎：在写入路径上按规则检查设备数据，条件满足或恢复时发布MQTT消息
+
+规则从JSON文件（RULES_CONFIG['file']，规则对象的数组）加载，编译一次后按 (设备ID, 指标名) 建立索引，
+每条消息只检查可能匹配它的规则，规则数量增加时每条消息的开销基本不变。规则类型：
+  - threshold：指标值与阈值value比较（op为>、>=、<、<=、==、!=）
+  - rate：变化率（每per秒的变化量，默认每分钟）与阈值value比较
+  - absent：设备（指定metric时为该指标）超过minutes分钟没有数据
+  - hysteresis：回差控制，高于high时触发、低于low时恢复（op为<时低于low触发、高于high恢复）
+规则只在状态变化时执行动作：条件开始满足时执行actions，恢复时执行clear_actions。
+不指定device的规则对每个设备分别维护状态；topic为可选的主题过滤器（支持+和#）。
+动作为MQTT发布 {topic, payload, qos, retain}，或继电器控制的简写 {device, relay, state}
+（发往mySmartHome/relay/<device>/control，同批量发布接口）；主题中的{device}替换为触发规则的设备ID。
+"""
+
+import operator
+import os
+import threading
+import time
+import codec
+from metrics import registry
+from log import get_logger
+from config import RULES_CONFIG
+
+logger = get_logger('rules')
+
+OPERATORS = {
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le,
+    '==': operator.eq,
+    '!=': operator.ne
+}
+
+def topic_matches(topic_filter, topic):
+    """主题是否匹配主题过滤器（支持+和#通配符，以$开头的主题不匹配首层通配符）"""
+    filter_levels = topic_filter.split('/')
+    levels = topic.split('/')
+    for depth, level in enumerate(filter_levels):
+        if level == '#':
+            return not (depth == 0 and topic.startswith('$'))
+        if depth >= len(levels):
+            return False
+        if level == '+':
+            if depth == 0 and topic.startswith('$'):
+                return False
+        elif level != levels[depth]:
+            return False
+    return len(filter_levels) == len(levels)
+
+class _State:
+    """规则在一个设备上的状态：是否已触发、上一个数值和时间"""
+
+    __slots__ = ('active', 'value', 'ts')
+
+    def __init__(self, ts=None):
+        self.active = False
+        self.value = None
+        self.ts = ts
+
+class Action:
+    """规则触发或恢复时发布的一条MQTT消息（负载在编译时序列化）"""
+
+    __slots__ = ('topic', 'payload', 'qos', 'retain', 'templated')
+
+    def __init__(self, definition):
+        if not isinstance(definition, dict):
+            raise ValueError(f'无效的动作: {definition}')
+        if 'relay' in definition:
+            device = definition.get('device')
+            if not device:
+                raise ValueError('继电器控制动作缺少device')
+            topic = f"mySmartHome/relay/{device}/control"
+            payload = {'relay': definition['relay'], 'state': bool(definition.get('state'))}
+        else:
+            topic = definition.get('topic')
+            payload = definition.get('payload', '')
+        if not topic or '+' in topic or '#' in topic:
+            raise ValueError(f'无效的主题: {topic}')
+        qos = definition.get('qos')
+        if qos is not None and qos not in (0, 1, 2):
+            raise ValueError(f'无效的QoS: {qos}')
+        self.topic = topic
+        self.payload = payload if isinstance(payload, str) else codec.dumps(payload)
+        self.qos = qos
+        self.retain = bool(definition.get('retain'))
+        self.templated = '{device}' in topic
+
+    def resolve(self, device_id):
+        """返回 (主题, 负载, QoS, retain)"""
+        topic = self.topic.replace('{device}', device_id) if self.templated else self.topic
+        return topic, self.payload, self.qos, self.retain
+
+class Rule:
+    """编译后的一条规则及其在各设备上的状态"""
+
+    __slots__ = ('id', 'kind', 'topic', 'device', 'metric', 'test', 'value', 'high', 'low', 'rising', 'per',
+                 'seconds', 'min_interval', 'actions', 'clear_actions', 'definition', 'states', 'check')
+
+    def __init__(self, definition, min_interval=None):
+        if not isinstance(definition, dict) or not definition.get('id'):
+            raise ValueError(f'规则缺少id: {definition}')
+        self.id = str(definition['id'])
+        self.kind = definition.get('type', 'threshold')
+        self.topic = definition.get('topic')
+        self.device = definition.get('device')
+        self.metric = definition.get('metric')
+        self.definition = definition
+        self.min_interval = RULES_CONFIG['min_interval'] if min_interval is None else min_interval
+        self.states = {}        # 设备ID -> _State
+        try:
+            self._compile(definition)
+            self.actions = [Action(action) for action in definition.get('actions', [])]
+            self.clear_actions = [Action(action) for action in definition.get('clear_actions', [])]
+        except ValueError as e:
+            raise ValueError(f'规则{self.id}: {e}') from None
+        except (KeyError, TypeError) as e:
+            raise ValueError(f'规则{self.id}: 缺少或无效的字段 {e}') from None
+
+    def _compile(self, definition):
+        if self.topic is not None:
+            levels = self.topic.split('/')
+            if '#' in levels[:-1] or any(('+' in level or '#' in level) and len(level) > 1 for level in levels):
+                raise ValueError(f'无效的主题过滤器: {self.topic}')
+        if self.device is not None:
+            self.device = str(self.device)
+        if self.kind != 'absent' and not self.metric:
+            raise ValueError(f'{self.kind}规则缺少metric')
+
+        op = definition.get('op', '>')
+        if op not in OPERATORS:
+            raise ValueError(f'未知的比较运算符: {op}')
+        self.test = OPERATORS[op]
+        self.value = self.high = self.low = self.rising = self.per = self.seconds = None
+        if self.kind == 'threshold':
+            self.value = float(definition['value'])
+            self.check = self._check_threshold
+        elif self.kind == 'rate':
+            self.value = float(definition['value'])
+            self.per = float(definition.get('per', 60))
+            self.check = self._check_rate
+        elif self.kind == 'hysteresis':
+            self.high = float(definition['high'])
+            self.low = float(definition['low'])
+            if self.low >= self.high:
+                raise ValueError('hysteresis规则的low必须小于high')
+            if op not in ('>', '<'):
+                raise ValueError('hysteresis规则的op只能是>或<')
+            self.rising = op == '>'
+            self.check = self._check_hysteresis
+        elif self.kind == 'absent':
+            self.seconds = float(definition['minutes']) * 60
+            if self.seconds <= 0:
+                raise ValueError('absent规则的minutes必须大于0')
+            self.check = self._check_absent
+        else:
+            raise ValueError(f'未知的规则类型: {self.kind}')
+
+    def update(self, device_id, value, ts):
+        """用设备的一个新数据更新状态，触发时返回True，恢复时返回False，状态不变时返回None"""
+        state = self.states.get(device_id)
+        if state is None:
+            state = self.states[device_id] = _State()
+        active = self.check(state, value, ts)
+        if active is None or active == state.active:
+            return None
+        state.active = active
+        return active
+
+    def expire(self, now):
+        """返回超过时间没有数据、本次开始触发的设备ID（只用于absent规则）"""
+        expired = []
+        for device_id, state in self.states.items():
+            if not state.active and state.ts is not None and now - state.ts >= self.seconds:
+                state.active = True
+                expired.append(device_id)
+        return expired
+
+    def _check_threshold(self, state, value, ts):
+        return self.test(value, self.value)
+
+    def _check_rate(self, state, value, ts):
+        previous, previous_ts = state.value, state.ts
+        if previous_ts is not None and ts - previous_ts < self.min_interval:
+            # 间隔太短的数据不更新基准值，避免抖动被放大成很大的变化率
+            return None
+        if previous_ts is not None and ts <= previous_ts:
+            # 时间相同或倒退（min_interval为0时）无法计算变化率
+            return None
+        state.value, state.ts = value, ts
+        if previous_ts is None:
+            return None
+        return self.test((value - previous) / (ts - previous_ts) * self.per, self.value)
+
+    def _check_hysteresis(self, state, value, ts):
+        if value > self.high:
+            return self.rising
+        if value < self.low:
+            return not self.rising
+        return None
+
+    def _check_absent(self, state, value, ts):
+        state.ts = ts
+        return False
+
+class RuleEngine:
+    """规则引擎：evaluate()在写入路径上调用，后台线程检查absent规则和规则文件的修改
+
+    publish(topic, payload, qos, retain)用于执行动作（如MqttPublisher.publish，只入队、不阻塞）。
+    """
+
+    def __init__(self, publish, path=None, check_interval=None, cache_size=10000):
+        self.publish = publish
+        self.path = path or RULES_CONFIG['file']
+        self.check_interval = check_interval or RULES_CONFIG['check_interval']
+        self._rules = []
+        self._absent = []
+        self._index = {}            # 设备ID（None为任意设备） -> {指标名（None为任意指标） -> [规则, ...]}
+        self._topic_cache = {}      # (主题过滤器, 主题) -> 是否匹配
+        self._cache_size = cache_size
+        self._mtime = None
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        # 统计计数
+        self.messages = 0           # 有候选规则的消息数
+        self.evaluations = 0        # 检查的 (规则, 消息) 数
+        self.fired = 0              # 规则触发次数
+        self.cleared = 0            # 规则恢复次数
+        self.actions = 0            # 发布的动作消息数
+        self.action_errors = 0      # 发布失败的动作消息数
+        self.load_errors = 0        # 规则文件加载失败次数
+
+        registry.function('counter', 'smarthome_rules_evaluations_total', '规则检查次数', lambda: self.evaluations)
+        registry.function('counter', 'smarthome_rules_fired_total', '规则触发次数', lambda: self.fired)
+        registry.function('counter', 'smarthome_rules_actions_total', '规则发布的动作消息数', lambda: self.actions)
+        registry.function('gauge', 'smarthome_rules_loaded', '已加载的规则数', lambda: len(self._rules))
+
+    def load(self, definitions, now=None):
+        """编译并替换全部规则，定义不变的规则保留原有状态；规则无效时抛出ValueError，原规则不变"""
+        now = time.time() if now is None else now
+        if not isinstance(definitions, list):
+            raise ValueError('规则文件应为规则对象的数组')
+        rules = [Rule(definition) for definition in definitions]
+        ids = [rule.id for rule in rules]
+        if len(set(ids)) != len(ids):
+            raise ValueError('规则id重复')
+
+        index = {}
+        with self._lock:
+            previous = {rule.id: rule for rule in self._rules}
+            for rule in rules:
+                old = previous.get(rule.id)
+                if old is not None and old.definition == rule.definition:
+                    rule.states = old.states
+                elif rule.kind == 'absent' and rule.device is not None:
+                    # 指定设备的absent规则从加载时开始计时，设备一直没有数据时也会触发
+                    rule.states[rule.device] = _State(now)
+                index.setdefault(rule.device, {}).setdefault(rule.metric, []).append(rule)
+            self._rules = rules
+            self._absent = [rule for rule in rules if rule.kind == 'absent']
+            self._index = index
+            self._topic_cache = {}
+        return len(rules)
+
+    def reload(self):
+        """规则文件修改后重新加载，返回是否重新加载；文件不存在时清空规则"""
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            mtime = None
+        if mtime == self._mtime:
+            return False
+        self._mtime = mtime
+        try:
+            if mtime is None:
+                count = self.load([])
+            else:
+                with open(self.path, 'rb') as f:
+                    count = self.load(codec.loads(f.read()))
+        except ValueError as e:
+            self.load_errors += 1
+            logger.error("Invalid rules file, keeping previous rules", extra={'file': self.path, 'error': str(e)})
+            return False
+        logger.info("Rules loaded", extra={'file': self.path, 'rules': count})
+        return True
+
+    def start(self):
+        """加载规则文件并启动检查线程"""
+        if self._thread and self._thread.is_alive():
+            return
+        self.reload()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='rule-engine', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        """停止检查线程"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def evaluate(self, topic, device_id, metrics, ts):
+        """用一条消息（metrics为 [(指标名, 数值), ...]）更新可能匹配它的规则，执行状态变化的规则的动作"""
+        index = self._index
+        specific = index.get(device_id)
+        generic = index.get(None)
+        if specific is None and generic is None:
+            return
+        changes = []
+        with self._lock:
+            self.messages += 1
+            for by_metric in (specific, generic):
+                if by_metric is None:
+                    continue
+                rules = by_metric.get(None)
+                if rules:
+                    self._update(rules, topic, device_id, None, ts, changes)
+                for metric, value in metrics:
+                    rules = by_metric.get(metric)
+                    if rules:
+                        self._update(rules, topic, device_id, value, ts, changes)
+        for rule, device, active, value in changes:
+            self._execute(rule, device, active, value)
+
+    def _update(self, rules, topic, device_id, value, ts, changes):
+        """更新一组候选规则（调用方持有锁），状态变化记入changes"""
+        for rule in rules:
+            if rule.topic is not None and not self._topic_matches(rule.topic, topic):
+                continue
+            self.evaluations += 1
+            active = rule.update(device_id, value, ts)
+            if active is not None:
+                changes.append((rule, device_id, active, value))
+
+    def _topic_matches(self, topic_filter, topic):
+        key = (topic_filter, topic)
+        try:
+            return self._topic_cache[key]
+        except KeyError:
+            pass
+        if len(self._topic_cache) >= self._cache_size:
+            self._topic_cache = {}
+        matched = self._topic_cache[key] = topic_matches(topic_filter, topic)
+        return matched
+
+    def check_absent(self, now=None):
+        """触发超过时间没有数据的absent规则，返回触发的次数"""
+        now = time.time() if now is None else now
+        with self._lock:
+            changes = [(rule, device_id, True, None) for rule in self._absent for device_id in rule.expire(now)]
+        for rule, device_id, active, value in changes:
+            self._execute(rule, device_id, active, value)
+        return len(changes)
+
+    def _execute(self, rule, device_id, active, value):
+        """执行规则触发（或恢复）的动作"""
+        if active:
+            self.fired += 1
+        else:
+            self.cleared += 1
+        logger.info("Rule triggered" if active else "Rule cleared",
+                    extra={'rule': rule.id, 'device': device_id, 'value': value})
+        for action in rule.actions if active else rule.clear_actions:
+            topic, payload, qos, retain = action.resolve(device_id)
+            self.actions += 1
+            future = self.publish(topic, payload, qos, retain)
+            if future is not None:
+                future.add_done_callback(lambda f, rule_id=rule.id, topic=topic: self._published(f, rule_id, topic))
+
+    def _published(self, future, rule_id, topic):
+        error = future.exception()
+        if error is not None:
+            self.action_errors += 1
+            logger.warning("Rule action failed", extra={'rule': rule_id, 'topic': topic, 'error': str(error)})
+
+    def _run(self):
+        while not self._stop_event.wait(self.check_interval):
+            try:
+                self.reload()
+                self.check_absent()
+            except Exception as e:
+                logger.error("Error checking rules", extra={'error': str(e)})
+
+    def stats(self):
+        """返回规则引擎统计"""
+        with self._lock:
+            # 写入线程会向states中添加新设备，在锁内统计
+            rules = len(self._rules)
+            active = sum(1 for rule in self._rules for state in rule.states.values() if state.active)
+        return {
+            'file': self.path,
+            'rules': rules,
+            'messages': self.messages,
+            'evaluations': self.evaluations,
+            'fired': self.fired,
+            'cleared': self.cleared,
+            'active': active,
+            'actions': self.actions,
+            'action_errors': self.action_errors,
+            'load_errors': self.load_errors
+        }
@@ -0,0 +1,232 @@
+import codecs
+import itertools
+import re
+import threading
+import time
+from collections import deque
+import serial
+from log import get_logger
+from config import SERIAL_CONFIG
+
+logger = get_logger('serial')
+
+class SerialBridge:
+    """一个串口的调试桥
+
+    独立的读线程持续读取串口输出，按行放入环形缓冲区（不会因为没有命令在等待而丢失输出）；
+    command()写入命令后等待读线程交来的新行，收到匹配的响应行、提示符，
+    或输出停止超过idle_timeout、总时间超过timeout时返回。同一串口上的命令依次执行。
+    """
+
+    def __init__(self, port, baudrate=None, buffer_lines=None, response_pattern=None, prompt_pattern=None,
+                 serial_factory=None):
+        self.port = port
+        self.device_id = port           # 串口上设备的ID，由SerialManager识别后设置
+        self.baudrate = baudrate or SERIAL_CONFIG['baudrate']
+        self.response_pattern = re.compile(response_pattern or SERIAL_CONFIG['response_pattern'])
+        self.prompt_pattern = re.compile(prompt_pattern or SERIAL_CONFIG['prompt_pattern'])
+        self.line_ending = SERIAL_CONFIG['line_ending']
+        self.serial_factory = serial_factory or serial.Serial
+        self.listeners = []             # 收到原始数据时调用 listener(端口, 时间, bytes)
+
+        self._serial = None
+        self._lines = deque(maxlen=buffer_lines or SERIAL_CONFIG['buffer_lines'])  # (序号, 时间, 行)
+        self._seq = 0
+        self._chunks = 0
+        self._partial = ''
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self._cond = threading.Condition()
+        self._command_lock = threading.Lock()
+        self._thread = None
+        self._running = False
+
+        # 统计计数
+        self.bytes_received = 0
+        self.commands = 0
+        self.last_error = None
+
+    @property
+    def is_open(self):
+        return self._running and self._serial is not None
+
+    def start(self):
+        """打开串口并启动读线程，打开失败时抛出serial.SerialException"""
+        self._serial = self.serial_factory(
+            port=self.port,
+            baudrate=self.baudrate,
+            bytesize=serial.EIGHTBITS,
+            parity=serial.PARITY_NONE,
+            stopbits=serial.STOPBITS_ONE,
+            timeout=0.05
+        )
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name=f'serial-reader-{self.port}', daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """停止读线程并关闭串口"""
+        self._running = False
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(1)
+        if self._serial is not None:
+            try:
+                self._serial.close()
+            except (serial.SerialException, OSError):
+                pass
+            self._serial = None
+        with self._cond:
+            self._cond.notify_all()
+
+    def recent(self, count=100):
+        """返回最近的count行输出 [(序号, 时间, 行), ...]"""
+        with self._cond:
+            return list(self._lines)[-count:]
+
+    def command(self, command, timeout=None, expect=None, idle_timeout=None):
+        """发送命令并等待响应
+
+        返回 {'command', 'lines', 'complete', 'elapsed'}，complete表示结束原因：
+        match（收到匹配expect/response_pattern的行）、prompt（出现提示符）、
+        idle（已有输出且停止超过idle_timeout）、timeout（超时）、closed（串口已断开）。
+        """
+        timeout = timeout or SERIAL_CONFIG['command_timeout']
+        idle_timeout = idle_timeout or SERIAL_CONFIG['idle_timeout']
+        pattern = re.compile(expect) if expect else self.response_pattern
+
+        with self._command_lock:
+            if not self.is_open:
+                raise serial.SerialException(f'串口未打开: {self.port}')
+            with self._cond:
+                next_seq = self._seq + 1
+                # 回显行以发送命令前已输出的提示符开头
+                echo = (self._partial + command).strip()
+
+            started = time.monotonic()
+            self._write((command + self.line_ending).encode())
+            self.commands += 1
+
+            deadline = started + timeout
+            lines = []
+            echoed = False
+            last_output = None
+            complete = 'timeout'
+            with self._cond:
+                while True:
+                    for seq, _, line in self._lines_since(next_seq):
+                        next_seq = seq + 1
+                        last_output = time.monotonic()
+                        # 设备回显的命令不计入响应
+                        if not lines and not echoed and line.strip() in (command.strip(), echo):
+                            echoed = True
+                            continue
+                        lines.append(line)
+                        if pattern.search(line):
+                            complete = 'match'
+                            break
+                    if complete == 'match':
+                        break
+                    # 只认命令有输出（包括回显）之后出现的提示符，发送命令前残留的提示符不算
+                    if last_output is not None and self._partial and self.prompt_pattern.search(self._partial):
+                        complete = 'prompt'
+                        break
+                    if not self.is_open:
+                        complete = 'closed'
+                        break
+
+                    now = time.monotonic()
+                    if now >= deadline:
+                        break
+                    wait = deadline - now
+                    if last_output is not None:
+                        idle_left = last_output + idle_timeout - now
+                        if idle_left <= 0:
+                            complete = 'idle'
+                            break
+                        wait = min(wait, idle_left)
+                    self._cond.wait(wait)
+
+        return {
+            'command': command,
+            'lines': lines,
+            'complete': complete,
+            'elapsed': round(time.monotonic() - started, 4)
+        }
+
+    def wait_idle(self, idle_timeout=None, timeout=None):
+        """等待串口停止输出超过idle_timeout（如设备上电后的启动信息），最多等待timeout秒"""
+        idle_timeout = idle_timeout or SERIAL_CONFIG['idle_timeout']
+        deadline = time.monotonic() + (timeout or SERIAL_CONFIG['command_timeout'])
+        with self._cond:
+            while self.is_open:
+                chunks = self._chunks
+                now = time.monotonic()
+                if now >= deadline:
+                    return False
+                self._cond.wait(min(idle_timeout, deadline - now))
+                if self._chunks == chunks:
+                    return True
+        return False
+
+    def stats(self):
+        return {
+            'port': self.port,
+            'device': self.device_id,
+            'open': self.is_open,
+            'bytes_received': self.bytes_received,
+            'lines': self._seq,
+            'commands': self.commands,
+            'last_error': self.last_error
+        }
+
+    def _lines_since(self, seq):
+        """返回序号不小于seq的缓冲行（需持有锁）"""
+        if not self._lines:
+            return []
+        offset = max(0, seq - self._lines[0][0])
+        return list(itertools.islice(self._lines, offset, None))
+
+    def _write(self, data):
+        try:
+            self._serial.write(data)
+        except (serial.SerialException, OSError) as e:
+            self.last_error = str(e)
+            self._running = False
+            raise serial.SerialException(f'写入串口失败: {e}') from e
+
+    def _run(self):
+        while self._running:
+            try:
+                chunk = self._serial.read(self._serial.in_waiting or 1)
+            except (serial.SerialException, OSError, TypeError, AttributeError) as e:
+                # 设备被拔出等错误，由调用方决定是否重新连接
+                if self._running:
+                    self.last_error = str(e)
+                    logger.warning("Read error", extra={'port': self.port, 'error': str(e)})
+                self._running = False
+                break
+            if not chunk:
+                continue
+
+            now = time.time()
+            self.bytes_received += len(chunk)
+            for listener in self.listeners:
+                try:
+                    listener(self.port, now, chunk)
+                except Exception as e:
+                    logger.error("Listener error", extra={'port': self.port, 'error': str(e)})
+            self._feed(chunk, now)
+
+        with self._cond:
+            self._cond.notify_all()
+
+    def _feed(self, chunk, now):
+        """把读到的数据按行放入缓冲区，并唤醒等待响应的命令"""
+        text = self._partial + self._decoder.decode(chunk)
+        *lines, partial = text.split('\n')
+        with self._cond:
+            for line in lines:
+                self._seq += 1
+                self._lines.append((self._seq, now, line.rstrip('\r')))
+            self._partial = partial
+            self._chunks += 1
+            self._cond.notify_all()
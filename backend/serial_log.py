@@ -0,0 +1,433 @@
+"""串口日志存储
+
+每个串口的全部输出按到达顺序写入压缩的分段文件：
+
+    <directory>/<串口>/<起始时间ms>.log.gz（或.log.zst）  数据段，由若干独立压缩的数据块首尾相接组成
+    <directory>/<串口>/<起始时间ms>.idx                  索引，每个数据块一条定长记录
+    <directory>/<串口>/meta.json                        串口名和设备ID
+
+数据块解压后是连续的记录：d 到达时间 | I 长度 | 原始字节。每个块都是完整的gzip成员（或zstd帧），
+因此整个数据段仍是合法的.gz文件，也可以只按索引中的偏移读取并解压单个块。
+索引记录为 d 块内最早时间 | d 块内最晚时间 | Q 偏移 | I 压缩后长度 | I 原始长度。
+
+读线程只把数据追加到内存中的待写缓冲区，压缩和写文件由后台线程完成；
+数据段写满segment_bytes或起始时间超过segment_seconds后换新文件，超过保留天数或总大小上限时删除最旧的数据段。
+"""
+
+import bisect
+import heapq
+import json
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+from log import get_logger
+from config import SERIAL_LOG_CONFIG
+
+logger = get_logger('serial_log')
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+RECORD = struct.Struct('<dI')
+INDEX_ENTRY = struct.Struct('<ddQII')
+
+class GzipCodec:
+    extension = '.log.gz'
+
+    def __init__(self, level=None):
+        self.level = level or 6
+
+    def compress(self, data):
+        # wbits=31：每个块写成一个完整的gzip成员
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, 31)
+        return compressor.compress(data) + compressor.flush()
+
+    def decompress(self, data):
+        return zlib.decompress(data, 31)
+
+class ZstdCodec:
+    extension = '.log.zst'
+
+    def __init__(self, level=None):
+        self._compressor = zstandard.ZstdCompressor(level=level or 3)
+        self._decompressor = zstandard.ZstdDecompressor()
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def decompress(self, data):
+        return self._decompressor.decompress(data)
+
+def create_codec(name=None, level=None):
+    """按名称创建压缩方式：auto（安装了zstandard时使用zstd）、zstd或gzip"""
+    name = name or SERIAL_LOG_CONFIG['compression']
+    if name == 'auto':
+        name = 'zstd' if zstandard is not None else 'gzip'
+    if name == 'zstd':
+        if zstandard is None:
+            raise RuntimeError('zstd压缩需要安装zstandard')
+        return ZstdCodec(level)
+    if name == 'gzip':
+        return GzipCodec(level)
+    raise ValueError(f'未知的压缩方式: {name}')
+
+def codec_for(path):
+    """按数据段的扩展名返回解压所用的压缩方式"""
+    if path.endswith(ZstdCodec.extension):
+        return create_codec('zstd')
+    return create_codec('gzip')
+
+def port_key(port):
+    """串口名对应的目录名，如 /dev/ttyUSB0 -> dev_ttyUSB0、COM3 -> COM3"""
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', port.strip('/\\')) or '_'
+
+class _PortLog:
+    """一个串口的写入状态（由SerialLogStore加锁访问）"""
+
+    def __init__(self, port, directory):
+        self.port = port
+        self.directory = directory
+        self.pending = []               # 待写入的 (时间, 字节)
+        self.pending_bytes = 0
+        self.segment = None             # 当前数据段路径（不含扩展名）
+        self.segment_started = None     # 当前数据段中最早的时间
+        self.segment_file = None
+        self.index_file = None
+        self.segment_size = 0
+
+class SerialLogStore:
+    """把各串口的原始输出写入按大小滚动的压缩分段文件，并按时间和正则表达式查询"""
+
+    def __init__(self, directory=None, codec=None):
+        self.directory = directory or SERIAL_LOG_CONFIG['directory']
+        self.codec = codec or create_codec(level=SERIAL_LOG_CONFIG['level'])
+        self.block_bytes = SERIAL_LOG_CONFIG['block_bytes']
+        self.flush_interval = SERIAL_LOG_CONFIG['flush_interval']
+        self.segment_bytes = SERIAL_LOG_CONFIG['segment_bytes']
+        self.segment_seconds = SERIAL_LOG_CONFIG['segment_seconds']
+
+        self._ports = {}
+        self._lock = threading.Lock()
+        # 写线程持有，保证同一时间只有一个线程写文件
+        self._write_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._index_cache = {}          # 索引路径 -> (文件大小, [索引记录], [块最早时间], [块最晚时间])
+
+        # 统计计数
+        self.bytes_captured = 0
+        self.bytes_written = 0
+        self.blocks_written = 0
+        self.segments_deleted = 0
+
+    def start(self):
+        """启动写线程"""
+        if self._thread and self._thread.is_alive():
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='serial-log-writer', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        """写入剩余数据并停止写线程"""
+        self._stop_event.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout)
+        self.flush(force=True)
+        with self._write_lock:
+            for log in self._ports.values():
+                self._close_segment(log)
+
+    def capture(self, port, ts, chunk):
+        """串口数据监听函数（在串口读线程中调用，只追加到内存缓冲区）"""
+        with self._lock:
+            log = self._ports.get(port)
+            if log is None:
+                log = self._ports[port] = _PortLog(port, os.path.join(self.directory, port_key(port)))
+            log.pending.append((ts, chunk))
+            log.pending_bytes += len(chunk)
+            self.bytes_captured += len(chunk)
+            full = log.pending_bytes >= self.block_bytes
+        if full:
+            self._wakeup.set()
+
+    def set_device(self, port, device):
+        """记录串口上的设备ID，查询时可以按设备ID选择串口"""
+        directory = os.path.join(self.directory, port_key(port))
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({'port': port, 'device': device}, f, ensure_ascii=False)
+
+    def flush(self, force=False):
+        """把待写缓冲区压缩为数据块写入文件；force为False时只写满block_bytes或超过flush_interval的缓冲区"""
+        now = time.time()
+        with self._write_lock:
+            with self._lock:
+                batches = []
+                for log in self._ports.values():
+                    if not log.pending:
+                        continue
+                    if force or log.pending_bytes >= self.block_bytes or now - log.pending[0][0] >= self.flush_interval:
+                        batches.append((log, log.pending))
+                        log.pending = []
+                        log.pending_bytes = 0
+            for log, records in batches:
+                try:
+                    self._write_block(log, records)
+                except OSError as e:
+                    logger.error("Error writing serial log", extra={'port': log.port, 'error': str(e)})
+        return len(batches)
+
+    def query(self, port=None, device=None, start=None, end=None, pattern=None, limit=1000):
+        """按时间范围和正则表达式查询串口输出行
+
+        通过索引只读取与时间范围重叠的数据块，在数据段中定位后单独解压。
+        返回 {'lines': [{'ts', 'port', 'device', 'line'}, ...], 'truncated', 'blocks_read', 'blocks_total'}，
+        多个串口的结果按时间合并，最多limit行。
+        """
+        end = end if end is not None else time.time()
+        start = start if start is not None else end - SERIAL_LOG_CONFIG['default_window']
+        regex = re.compile(pattern) if pattern else None
+        stats = {'blocks_read': 0, 'blocks_total': 0}
+
+        results = []
+        for directory, meta in self._select_ports(port, device):
+            lines = []
+            for ts, text in self._port_lines(directory, meta['port'], start, end, stats):
+                if regex is None or regex.search(text):
+                    lines.append((ts, meta['port'], meta.get('device'), text))
+                    # 多取一行，用于判断结果是否被截断
+                    if len(lines) > limit:
+                        break
+            results.append(lines)
+
+        merged = list(heapq.merge(*results, key=lambda line: line[0]))
+        return {
+            'from': start,
+            'to': end,
+            'lines': [{'ts': ts, 'port': p, 'device': d, 'line': text} for ts, p, d, text in merged[:limit]],
+            'truncated': len(merged) > limit,
+            'blocks_read': stats['blocks_read'],
+            'blocks_total': stats['blocks_total']
+        }
+
+    def stats(self):
+        with self._lock:
+            pending = sum(log.pending_bytes for log in self._ports.values())
+        return {
+            'directory': self.directory,
+            'codec': self.codec.extension,
+            'bytes_captured': self.bytes_captured,
+            'bytes_written': self.bytes_written,
+            'blocks_written': self.blocks_written,
+            'pending_bytes': pending,
+            'segments_deleted': self.segments_deleted,
+            'disk_bytes': sum(size for _, _, size in self._segments())
+        }
+
+    def _write_block(self, log, records):
+        """把一批记录压缩为一个数据块，追加到当前数据段并写入索引（需持有_write_lock）"""
+        raw = b''.join(RECORD.pack(ts, len(chunk)) + chunk for ts, chunk in records)
+        block = self.codec.compress(raw)
+        if log.segment_file is not None and records[0][0] - log.segment_started >= self.segment_seconds:
+            self._close_segment(log)
+        if log.segment_file is None:
+            self._open_segment(log, records[0][0])
+
+        offset = log.segment_size
+        log.segment_file.write(block)
+        log.segment_file.flush()
+        # 先写数据再写索引，索引中的块一定是完整的
+        log.index_file.write(INDEX_ENTRY.pack(records[0][0], records[-1][0], offset, len(block), len(raw)))
+        log.index_file.flush()
+        log.segment_size += len(block)
+        self.bytes_written += len(block)
+        self.blocks_written += 1
+
+        if log.segment_size >= self.segment_bytes:
+            self._close_segment(log)
+            self._enforce_retention()
+
+    def _open_segment(self, log, first_ts):
+        os.makedirs(log.directory, exist_ok=True)
+        if not os.path.exists(os.path.join(log.directory, 'meta.json')):
+            self.set_device(log.port, None)
+        stamp = int(first_ts * 1000)
+        while os.path.exists(os.path.join(log.directory, f'{stamp:013d}.idx')):
+            stamp += 1
+        log.segment = os.path.join(log.directory, f'{stamp:013d}')
+        log.segment_file = open(log.segment + self.codec.extension, 'ab')
+        log.index_file = open(log.segment + '.idx', 'ab')
+        log.segment_size = 0
+        log.segment_started = first_ts
+
+    def _close_segment(self, log):
+        if log.segment_file is not None:
+            log.segment_file.close()
+            log.index_file.close()
+        log.segment = log.segment_file = log.index_file = log.segment_started = None
+        log.segment_size = 0
+
+    def _close_aged_segments(self):
+        """关闭起始时间超过segment_seconds的数据段（需持有_write_lock）
+
+        输出很少的串口很久写不满一个数据段；正在写入的数据段不会被删除，
+        不按时间换文件时其中的旧数据无法按保留天数删除。
+        """
+        now = time.time()
+        with self._lock:
+            logs = list(self._ports.values())
+        for log in logs:
+            if log.segment_file is not None and now - log.segment_started >= self.segment_seconds:
+                self._close_segment(log)
+
+    def _segments(self):
+        """返回全部数据段 [(起始时间ms, 数据段路径, 数据段和索引的大小), ...]"""
+        segments = []
+        if not os.path.isdir(self.directory):
+            return segments
+        for key in os.listdir(self.directory):
+            directory = os.path.join(self.directory, key)
+            if not os.path.isdir(directory):
+                continue
+            for name in os.listdir(directory):
+                if not name.endswith('.idx'):
+                    continue
+                base = os.path.join(directory, name[:-4])
+                size = 0
+                for path in (base + '.idx', base + GzipCodec.extension, base + ZstdCodec.extension):
+                    if os.path.exists(path):
+                        size += os.path.getsize(path)
+                segments.append((int(name[:-4]), base, size))
+        return segments
+
+    def _enforce_retention(self):
+        """删除超过保留天数的数据段，并从最旧的开始删除直到总大小不超过上限（正在写入的数据段除外）"""
+        with self._lock:
+            active = {log.segment for log in self._ports.values() if log.segment}
+        segments = sorted(s for s in self._segments() if s[1] not in active)
+        total = sum(size for _, _, size in self._segments())
+        cutoff = (time.time() - SERIAL_LOG_CONFIG['retention_days'] * 86400) * 1000
+        for stamp, base, size in segments:
+            if stamp >= cutoff and total <= SERIAL_LOG_CONFIG['max_total_bytes']:
+                break
+            for path in (base + '.idx', base + GzipCodec.extension, base + ZstdCodec.extension):
+                if os.path.exists(path):
+                    os.remove(path)
+            self._index_cache.pop(base + '.idx', None)
+            total -= size
+            self.segments_deleted += 1
+
+    def _select_ports(self, port=None, device=None):
+        """返回要查询的串口 [(目录, meta), ...]"""
+        selected = []
+        if not os.path.isdir(self.directory):
+            return selected
+        for key in sorted(os.listdir(self.directory)):
+            directory = os.path.join(self.directory, key)
+            meta_path = os.path.join(directory, 'meta.json')
+            if not os.path.isfile(meta_path):
+                continue
+            try:
+                with open(meta_path, encoding='utf-8') as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                meta = {'port': key, 'device': None}
+            if port and port not in (meta.get('port'), key):
+                continue
+            if device and device != meta.get('device'):
+                continue
+            selected.append((directory, meta))
+        return selected
+
+    def _read_index(self, path):
+        """读取索引文件（未变化的索引使用缓存）"""
+        size = os.path.getsize(path)
+        size -= size % INDEX_ENTRY.size     # 忽略写入中途的不完整记录
+        cached = self._index_cache.get(path)
+        if cached and cached[0] == size:
+            return cached
+        with open(path, 'rb') as f:
+            data = f.read(size)
+        entries = list(INDEX_ENTRY.iter_unpack(data))
+        cached = (size, entries, [entry[0] for entry in entries], [entry[1] for entry in entries])
+        self._index_cache[path] = cached
+        return cached
+
+    def _port_records(self, directory, port, start, end, stats):
+        """按时间顺序返回一个串口在时间范围内的 (时间, 字节) 记录"""
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith('.idx'):
+                continue
+            base = os.path.join(directory, name[:-4])
+            _, entries, firsts, lasts = self._read_index(base + '.idx')
+            stats['blocks_total'] += len(entries)
+            # 数据段按起始时间命名，之后的数据段都晚于end时不再读取
+            if entries and firsts[0] > end:
+                break
+            # 块按时间顺序写入，二分查找与时间范围重叠的块
+            selected = entries[bisect.bisect_left(lasts, start):bisect.bisect_right(firsts, end)]
+            if not selected:
+                continue
+            path = base + ZstdCodec.extension if os.path.exists(base + ZstdCodec.extension) else base + GzipCodec.extension
+            codec = codec_for(path)
+            with open(path, 'rb') as f:
+                for first_ts, last_ts, offset, length, raw_length in selected:
+                    f.seek(offset)
+                    raw = codec.decompress(f.read(length))
+                    stats['blocks_read'] += 1
+                    pos = 0
+                    while pos < len(raw):
+                        ts, size = RECORD.unpack_from(raw, pos)
+                        pos += RECORD.size
+                        if start <= ts <= end:
+                            yield ts, raw[pos:pos + size]
+                        pos += size
+
+        # 尚未写入文件的数据
+        with self._lock:
+            log = self._ports.get(port)
+            pending = list(log.pending) if log else []
+        for ts, chunk in pending:
+            if start <= ts <= end:
+                yield ts, chunk
+
+    def _port_lines(self, directory, port, start, end, stats):
+        """把记录拼接为行，返回 (行首所在记录的时间, 文本)"""
+        partial = b''
+        partial_ts = None
+        for ts, chunk in self._port_records(directory, port, start, end, stats):
+            parts = chunk.split(b'\n')
+            for part in parts[:-1]:
+                line = partial + part
+                yield (partial_ts if partial else ts), line.decode('utf-8', errors='replace').rstrip('\r')
+                partial = b''
+            if parts[-1]:
+                if not partial:
+                    partial_ts = ts
+                partial += parts[-1]
+        if partial:
+            yield partial_ts, partial.decode('utf-8', errors='replace').rstrip('\r')
+
+    def _run(self):
+        next_retention = 0
+        while not self._stop_event.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+                if time.monotonic() >= next_retention:
+                    with self._write_lock:
+                        self._close_aged_segments()
+                        self._enforce_retention()
+                    next_retention = time.monotonic() + 600
+            except Exception as e:
+                logger.error("Error flushing serial logs", extra={'error': str(e)})
@@ -0,0 +1,213 @@
+import os
+import random
+import re
+import threading
+import time
+import serial
+from serial.tools import list_ports
+from serial_bridge import SerialBridge
+from log import get_logger
+from config import SERIAL_CONFIG
+
+logger = get_logger('serial')
+
+class SerialManager:
+    """管理多个串口调试桥：枚举串口、热插拔检测、断线重连
+
+    后台线程每隔scan_interval扫描一次串口：新出现的串口打开一个SerialBridge（各自独立的读线程），
+    消失或读写出错的串口关闭并按指数退避重新连接。打开串口和识别设备都在该线程中进行，
+    不会阻塞MQTT回调线程。命令按设备ID（或串口名）选择串口。
+    """
+
+    def __init__(self, scan_interval=None, bridge_factory=None, port_source=None):
+        self.scan_interval = scan_interval or SERIAL_CONFIG['scan_interval']
+        self.bridge_factory = bridge_factory or SerialBridge
+        self.port_source = port_source or list_ports.comports
+        self.port_patterns = [re.compile(pattern) for pattern in SERIAL_CONFIG['port_patterns']]
+        self.identify_pattern = re.compile(SERIAL_CONFIG['identify_pattern'])
+        self.listeners = []             # 添加到每个串口的数据监听函数，见SerialBridge.listeners
+        self.on_connect = None          # 识别出设备后调用 on_connect(串口名, 设备ID)
+
+        self._bridges = {}              # 串口名 -> SerialBridge
+        self._devices = {}              # 设备ID -> 串口名
+        self._retry = {}                # 串口名 -> (失败次数, 下次尝试时间)
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        # 统计计数
+        self.connects = 0
+        self.disconnects = 0
+
+    def start(self):
+        """启动扫描线程（立即进行第一次扫描）"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='serial-manager', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        """停止扫描线程并关闭全部串口"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout)
+        with self._lock:
+            bridges = list(self._bridges.values())
+            self._bridges = {}
+            self._devices = {}
+        for bridge in bridges:
+            bridge.close()
+
+    def add_listener(self, listener):
+        """为已打开和以后打开的每个串口添加数据监听函数"""
+        self.listeners.append(listener)
+        with self._lock:
+            bridges = list(self._bridges.values())
+        for bridge in bridges:
+            bridge.listeners.append(listener)
+
+    def get(self, device=None):
+        """按设备ID或串口名返回已打开的串口；不指定时返回第一个已打开的串口
+
+        没有可用串口时抛出serial.SerialException。
+        """
+        with self._lock:
+            if device:
+                port = self._devices.get(device, device)
+                bridge = self._bridges.get(port)
+            else:
+                bridge = next((b for b in self._bridges.values() if b.is_open), None)
+        if bridge is None or not bridge.is_open:
+            raise serial.SerialException(f'未连接串口设备: {device}' if device else '未连接串口设备')
+        return bridge
+
+    def command(self, command, device=None, timeout=None):
+        """在指定设备的串口上执行命令，结果同SerialBridge.command"""
+        bridge = self.get(device)
+        result = bridge.command(command, timeout=timeout)
+        result['port'] = bridge.port
+        result['device'] = bridge.device_id
+        return result
+
+    def devices(self):
+        """返回已打开的串口 [{'device', 'port', 'open'}, ...]"""
+        with self._lock:
+            return [{'device': bridge.device_id, 'port': port, 'open': bridge.is_open}
+                    for port, bridge in self._bridges.items()]
+
+    def scan(self):
+        """扫描一次串口：打开新出现的串口，关闭已消失或出错的串口，返回当前可用的串口名"""
+        available = self._available_ports()
+        now = time.monotonic()
+
+        with self._lock:
+            current = dict(self._bridges)
+        for port, bridge in current.items():
+            if port not in available or not bridge.is_open:
+                self._remove(port, bridge)
+                if port in available:
+                    self._schedule_retry(port, now, bridge.last_error)
+
+        for port, info in available.items():
+            if port in self._bridges:
+                continue
+            failures, next_attempt = self._retry.get(port, (0, 0))
+            if now < next_attempt:
+                continue
+            self._connect(port, info, now)
+
+        # 已拔出的串口不再重试，重新插入时立即连接
+        for port in list(self._retry):
+            if port not in available:
+                del self._retry[port]
+        return list(available)
+
+    def stats(self):
+        return {
+            'ports': self.devices(),
+            'connects': self.connects,
+            'disconnects': self.disconnects,
+            'retrying': {port: failures for port, (failures, _) in dict(self._retry).items()},
+            'bridges': [bridge.stats() for bridge in list(self._bridges.values())]
+        }
+
+    def _available_ports(self):
+        """返回 {串口名: 枚举信息}：匹配port_patterns的枚举结果，加上SERIAL_CONFIG['ports']中存在的串口"""
+        available = {}
+        try:
+            for info in self.port_source():
+                if any(pattern.search(info.device) for pattern in self.port_patterns):
+                    available[info.device] = info
+        except Exception as e:
+            logger.error("Error listing ports", extra={'error': str(e)})
+        for port in SERIAL_CONFIG['ports']:
+            if port not in available and os.path.exists(port):
+                available[port] = None
+        return available
+
+    def _connect(self, port, info, now):
+        bridge = self.bridge_factory(port)
+        bridge.listeners.extend(self.listeners)
+        try:
+            bridge.start()
+        except (serial.SerialException, OSError) as e:
+            self._schedule_retry(port, now, str(e))
+            return
+        bridge.device_id = self._identify(bridge, info)
+        with self._lock:
+            self._bridges[port] = bridge
+            self._devices[bridge.device_id] = port
+        self._retry.pop(port, None)
+        self.connects += 1
+        logger.info("Connected", extra={'port': port, 'device': bridge.device_id})
+        if self.on_connect is not None:
+            try:
+                self.on_connect(port, bridge.device_id)
+            except Exception as e:
+                logger.error("on_connect error", extra={'port': port, 'error': str(e)})
+
+    def _identify(self, bridge, info):
+        """确定串口上设备的ID：identify_command的响应，其次是USB序列号，最后是串口名"""
+        command = SERIAL_CONFIG['identify_command']
+        if command:
+            try:
+                # 先等设备的启动输出结束，避免被当作查询的响应
+                bridge.wait_idle()
+                result = bridge.command(command, timeout=SERIAL_CONFIG['command_timeout'])
+                for line in result['lines']:
+                    match = self.identify_pattern.search(line)
+                    if match:
+                        return match.group(1)
+            except serial.SerialException as e:
+                logger.warning("Failed to identify device", extra={'port': bridge.port, 'error': str(e)})
+        if info is not None and getattr(info, 'serial_number', None):
+            return info.serial_number
+        return bridge.port
+
+    def _remove(self, port, bridge):
+        bridge.close()
+        with self._lock:
+            self._bridges.pop(port, None)
+            if self._devices.get(bridge.device_id) == port:
+                del self._devices[bridge.device_id]
+        self.disconnects += 1
+        logger.info("Disconnected", extra={'port': port})
+
+    def _schedule_retry(self, port, now, error):
+        failures = self._retry.get(port, (0, 0))[0] + 1
+        delay = min(SERIAL_CONFIG['reconnect_max'], SERIAL_CONFIG['reconnect_min'] * 2 ** (failures - 1))
+        # 随机抖动，避免多个串口同时重试
+        delay *= random.uniform(0.8, 1.2)
+        self._retry[port] = (failures, now + delay)
+        if failures == 1:
+            logger.warning("Cannot open port, retrying with backoff", extra={'port': port, 'error': str(error)})
+
+    def _run(self):
+        while True:
+            try:
+                self.scan()
+            except Exception as e:
+                logger.error("Error scanning ports", extra={'error': str(e)})
+            if self._stop_event.wait(self.scan_interval):
+                break
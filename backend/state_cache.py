@@ -0,0 +1,78 @@
+import codec
+import os
+import threading
+import time
+
+class LatestStateCache:
+    """每个设备最新状态的内存表
+
+    MQTT写入路径在收到消息时更新，/api/devices/state直接从这里读取，不访问数据库。
+    每次更新递增版本号，用于生成ETag；同一版本的JSON响应只序列化一次。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._devices = {}
+        self._version = 0
+        # 进程标识，保证重启后的ETag与之前不同
+        self._epoch = f"{os.getpid():x}{int(time.time()):x}"
+        self._body_cache = (None, None)
+
+    def update(self, device_id, topic, metrics, data=None, ts=None):
+        """更新设备的最新指标值（metrics为 [(指标名, 数值), ...]）"""
+        ts = ts or time.time()
+        with self._lock:
+            # 旧消息（如重启时预热的数据晚于实时数据到达）不覆盖新状态
+            entry = self._devices.get(device_id)
+            if entry is not None and entry['ts'] > ts:
+                return
+            if entry is None:
+                entry = {'device': device_id, 'metrics': {}}
+                self._devices[device_id] = entry
+            self._version += 1
+            entry['topic'] = topic
+            entry['ts'] = ts
+            entry['version'] = self._version
+            entry['metrics'].update(metrics)
+            if data is not None:
+                entry['data'] = data
+
+    def etag(self, device_id=None):
+        """返回当前状态的ETag"""
+        if device_id is None:
+            version = self._version
+        else:
+            entry = self._devices.get(device_id)
+            version = entry['version'] if entry else 0
+        return f'"{self._epoch}-{version}"'
+
+    def get(self, device_id):
+        """返回单个设备的状态副本，不存在时返回None"""
+        with self._lock:
+            entry = self._devices.get(device_id)
+            if entry is None:
+                return None
+            return dict(entry, metrics=dict(entry['metrics']))
+
+    def get_with_etag(self, device_id):
+        """返回单个设备的状态副本和对应的ETag，不存在时返回 (None, None)"""
+        state = self.get(device_id)
+        if state is None:
+            return None, None
+        return state, f'"{self._epoch}-{state["version"]}"'
+
+    def to_json(self):
+        """返回全部设备状态的JSON文本和对应的ETag（同一版本只序列化一次）"""
+        version, body = self._body_cache
+        if version == self._version:
+            return body, f'"{self._epoch}-{version}"'
+
+        with self._lock:
+            version = self._version
+            devices = [dict(entry, metrics=dict(entry['metrics'])) for entry in self._devices.values()]
+        body = codec.dumps({'version': version, 'devices': devices})
+        self._body_cache = (version, body)
+        return body, f'"{self._epoch}-{version}"'
+
+    def __len__(self):
+        return len(self._devices)
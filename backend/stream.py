@@ -0,0 +1,118 @@
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from paho.mqtt.client import topic_matches_sub
+import codec
+from config import STREAM_CONFIG
+
+def format_sse(events):
+    """把消息列表格式化为Server-Sent Events文本"""
+    return ''.join(f"id: {event['id']}\ndata: {codec.dumps(event)}\n\n" for event in events)
+
+class Subscriber:
+    """一个实时数据订阅者（对应一个浏览器连接）
+
+    每个订阅者有独立的有界缓冲区，消费过慢时丢弃最旧的消息，不影响其他订阅者。
+    """
+
+    def __init__(self, topic=None, device=None, buffer_size=None, notify=None):
+        self.topic = topic
+        self.device = device
+        self.buffer = deque(maxlen=buffer_size or STREAM_CONFIG['client_buffer'])
+        self.dropped = 0
+        self._event = threading.Event()
+        # 有新消息时的通知函数，默认唤醒等待在get()上的线程
+        self.notify = notify or self._event.set
+
+    def matches(self, event):
+        """判断消息是否符合该订阅者的主题/设备过滤条件"""
+        if self.device and event['device'] != self.device:
+            return False
+        if self.topic and not topic_matches_sub(self.topic, event['topic']):
+            return False
+        return True
+
+    def push(self, event):
+        """放入一条消息，缓冲区已满时自动丢弃最旧的消息"""
+        if len(self.buffer) == self.buffer.maxlen:
+            self.dropped += 1
+        self.buffer.append(event)
+        self.notify()
+
+    def drain(self):
+        """取出缓冲区中的全部消息"""
+        events = []
+        while True:
+            try:
+                events.append(self.buffer.popleft())
+            except IndexError:
+                return events
+
+    def get(self, timeout=None):
+        """等待并取出新消息，超时返回空列表"""
+        if not self.buffer:
+            self._event.wait(timeout)
+        self._event.clear()
+        return self.drain()
+
+class LiveBroadcaster:
+    """把MQTT收到的消息实时分发给所有订阅者，不经过数据库
+
+    保留最近的history_size条消息，订阅者可以从某个消息ID之后继续接收（断线重连）。
+    """
+
+    def __init__(self, history_size=None):
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._history = deque(maxlen=history_size or STREAM_CONFIG['history_size'])
+        self._subscribers = set()
+
+    def publish(self, topic, device_id, data, ts=None, event_id=None):
+        """分发一条消息，返回消息ID
+
+        event_id用于指定消息ID（多进程部署时使用数据库记录ID，各进程一致），须递增。
+        """
+        ts = ts or time.time()
+        with self._lock:
+            self._seq = event_id if event_id is not None else self._seq + 1
+            event = {
+                'id': self._seq,
+                'ts': ts,
+                'timestamp': datetime.fromtimestamp(ts, timezone.utc).strftime('%Y-%m-%d %H:%M:%S'),
+                'topic': topic,
+                'device': device_id,
+                'data': data
+            }
+            self._history.append(event)
+            subscribers = list(self._subscribers)
+
+        for subscriber in subscribers:
+            if subscriber.matches(event):
+                subscriber.push(event)
+        return event['id']
+
+    def subscribe(self, topic=None, device=None, last_id=None, buffer_size=None, notify=None):
+        """新建订阅者；指定last_id时先补发历史中该ID之后的消息"""
+        subscriber = Subscriber(topic, device, buffer_size, notify)
+        with self._lock:
+            if last_id is not None:
+                for event in self._history:
+                    if event['id'] > last_id and subscriber.matches(event):
+                        subscriber.buffer.append(event)
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        """移除订阅者"""
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def stats(self):
+        """返回订阅者数量和最新消息ID"""
+        with self._lock:
+            return {
+                'subscribers': len(self._subscribers),
+                'last_id': self._seq,
+                'history': len(self._history)
+            }
@@ -0,0 +1,73 @@
+"""设备上报数据的规范化
+
+把TempHum、SmartRelay、SmartSocket等设备上报的JSON数据拆分为
+(设备ID, 指标名, 数值) 形式的时序数据行。
+"""
+
+# 不作为指标存储的字段（设备内部计时、引脚配置等）
+SKIP_FIELDS = {'timestamp', 'lastChange', 'pin', 'index'}
+
+def extract_device_id(topic, data):
+    """从数据或主题中提取设备ID"""
+    if isinstance(data, dict):
+        device_id = data.get('deviceId') or data.get('device_id')
+        if device_id:
+            return str(device_id)
+
+    # SmartRelay的状态主题中带有设备MAC：mySmartHome/relay/<mac>/status
+    parts = topic.split('/') if topic else []
+    if len(parts) >= 4 and parts[0] == 'mySmartHome' and parts[1] == 'relay':
+        return parts[2]
+
+    # 二进制遥测主题中带有设备ID：mySmartHome/bin/<设备ID>
+    if len(parts) == 3 and parts[0] == 'mySmartHome' and parts[1] == 'bin':
+        return parts[2]
+
+    return 'unknown'
+
+def _to_number(value):
+    """把数值或布尔值转换为float，其他类型（以及超出float范围的整数）返回None"""
+    if isinstance(value, bool):
+        return 1.0 if value else 0.0
+    if isinstance(value, (int, float)):
+        try:
+            return float(value)
+        except OverflowError:
+            return None
+    return None
+
+def extract_metrics(data, prefix=''):
+    """提取数据中的数值指标，返回 [(指标名, 数值), ...]
+
+    嵌套对象以"."连接字段名；对象数组（如relays、outputs）使用元素的index字段
+    （没有时使用数组下标），例如 relays.0.state。
+    """
+    metrics = []
+    if not isinstance(data, dict):
+        return metrics
+
+    for key, value in data.items():
+        if key in SKIP_FIELDS:
+            continue
+        name = prefix + key
+        number = _to_number(value)
+        if number is not None:
+            metrics.append((name, number))
+        elif isinstance(value, dict):
+            metrics.extend(extract_metrics(value, name + '.'))
+        elif isinstance(value, list):
+            for position, item in enumerate(value):
+                if isinstance(item, dict):
+                    index = item.get('index', position)
+                    metrics.extend(extract_metrics(item, f"{name}.{index}."))
+                else:
+                    number = _to_number(item)
+                    if number is not None:
+                        metrics.append((f"{name}.{position}", number))
+    return metrics
+
+def normalize(topic, data, ts):
+    """把一条消息转换为时序数据行，返回 (设备ID, [(ts, 设备ID, 主题, 指标名, 数值), ...])"""
+    device_id = extract_device_id(topic, data)
+    rows = [(ts, device_id, topic, metric, value) for metric, value in extract_metrics(data)]
+    return device_id, rows
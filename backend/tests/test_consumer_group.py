@@ -0,0 +1,160 @@
+"""共享订阅消费组测试
+
+用进程内的模拟代理代替真实的MQTT代理：共享订阅（$share/<组名>/<主题>）上的消息轮流分给组内已连接的消费者，
+消费者断开后从组中移除。检查每条消息只被一个消费者处理、只写入一次，以及消费者离开后消息由其余消费者接收。
+
+    python -m unittest discover -s tests
+"""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import config
+from rules import topic_matches
+
+class FakeBroker:
+    """只实现共享订阅分配的模拟代理：同一共享订阅上的消息按顺序轮流分给组内的订阅者"""
+
+    def __init__(self):
+        self.groups = {}        # (组名, 主题过滤器) -> [客户端, ...]
+        self.next = {}          # (组名, 主题过滤器) -> 下一个接收者的位置
+        self.lock = threading.Lock()
+
+    def subscribe(self, client, topic):
+        _, group, topic_filter = topic.split('/', 2)
+        with self.lock:
+            self.groups.setdefault((group, topic_filter), []).append(client)
+
+    def disconnect(self, client):
+        with self.lock:
+            for members in self.groups.values():
+                if client in members:
+                    members.remove(client)
+
+    def publish(self, topic, payload):
+        with self.lock:
+            receivers = []
+            for key, members in self.groups.items():
+                if members and topic_matches(key[1], topic):
+                    position = self.next.get(key, 0) % len(members)
+                    self.next[key] = position + 1
+                    receivers.append(members[position])
+        message = SimpleNamespace(topic=topic, payload=payload)
+        for client in receivers:
+            client.on_message(client, None, message)
+
+class FakeClient:
+    """paho mqtt.Client中消费组用到的接口，连接到FakeBroker"""
+
+    def __init__(self, broker, client_id=None, protocol=None):
+        self.broker = broker
+        self.client_id = client_id
+        self.on_connect = self.on_disconnect = self.on_message = None
+
+    def username_pw_set(self, username, password=None):
+        pass
+
+    def connect_async(self, host, port, keepalive):
+        self.on_connect(self, None, {}, 0)
+
+    def loop_start(self):
+        pass
+
+    def loop_stop(self):
+        pass
+
+    def subscribe(self, topic):
+        self.broker.subscribe(self, topic)
+
+    def disconnect(self):
+        self.broker.disconnect(self)
+        self.on_disconnect(self, None, 0)
+
+def submit_json(topic, payload, pipeline):
+    pipeline.submit((topic, time.time(), json.loads(payload), payload))
+
+class ConsumerGroupTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.workdir = tempfile.mkdtemp()
+        cls.saved = (config.DATABASE_CONFIG['database_path'], config.JOURNAL_CONFIG['directory'])
+        config.DATABASE_CONFIG['database_path'] = os.path.join(cls.workdir, 'test.db')
+        config.JOURNAL_CONFIG['directory'] = os.path.join(cls.workdir, 'journal')
+        import database
+        database.close_all_connections()
+        database.init_db()
+        cls.database = database
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.database.close_all_connections()
+        config.DATABASE_CONFIG['database_path'], config.JOURNAL_CONFIG['directory'] = cls.saved
+        shutil.rmtree(cls.workdir, ignore_errors=True)
+
+    def setUp(self):
+        from consumer_group import ConsumerGroup
+        from ingest import IngestPipeline
+        self.broker = FakeBroker()
+        self.pipeline = IngestPipeline(name=f'test-writer-{id(self)}', flush_interval=0.05, journal=False)
+        self.group = ConsumerGroup(submit_json, count=3, group='test', topics=['mySmartHome/sensor/#'],
+                                   pipeline=self.pipeline,
+                                   client_factory=lambda **kwargs: FakeClient(self.broker, **kwargs))
+        self.group.start('localhost', 1883, 60)
+        self.addCleanup(self.pipeline.stop)
+        self.addCleanup(self.group.stop)
+        with self.database.get_connection() as conn:
+            self.before = conn.execute("SELECT COUNT(*) FROM sensor_data").fetchone()[0]
+
+    def publish(self, start, count):
+        for seq in range(start, start + count):
+            payload = json.dumps({'deviceId': f"dev{seq % 5}", 'temperature': 20, 'seq': seq}).encode()
+            self.broker.publish('mySmartHome/sensor/temphum', payload)
+
+    def stored_seqs(self):
+        deadline = time.time() + 5
+        while self.pipeline.stats()['queue_depth'] and time.time() < deadline:
+            time.sleep(0.01)
+        self.pipeline.stop()
+        with self.database.get_connection() as conn:
+            rows = conn.execute("SELECT data FROM sensor_data ORDER BY id LIMIT -1 OFFSET ?",
+                                (self.before,)).fetchall()
+        return sorted(json.loads(row[0])['seq'] for row in rows)
+
+    def test_shared_subscription_splits_messages(self):
+        self.publish(0, 300)
+        received = [consumer['received'] for consumer in self.group.stats()['consumers']]
+        self.assertEqual(received, [100, 100, 100])
+        self.assertEqual(self.stored_seqs(), list(range(300)))
+
+    def test_member_leaving_rebalances(self):
+        self.publish(0, 90)
+        leaving = self.group.consumers[1]
+        leaving.stop()
+        self.assertFalse(leaving.connected)
+        self.publish(90, 90)
+
+        received = [consumer['received'] for consumer in self.group.stats()['consumers']]
+        self.assertEqual(received[1], 30)
+        self.assertEqual(received[0] + received[2], 150)
+        self.assertEqual(self.group.stats()['received'], 180)
+        self.assertEqual(self.stored_seqs(), list(range(180)))
+
+    def test_consumers_share_one_writer(self):
+        self.assertTrue(all(consumer.pipeline is self.pipeline for consumer in self.group.consumers))
+        self.publish(0, 30)
+        stats = self.group.stats()
+        self.assertEqual(stats['enqueued'], 30)
+        self.assertEqual(stats['group'], 'test')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+"""串口调试桥和多串口管理测试
+
+用fake_serial_device.py的pty模拟设备代替开发板（仅Linux/macOS）：检查读线程按行接收输出、
+命令与响应、按设备ID选择串口，以及拔出设备后关闭串口、重新插入后自动重新连接。
+
+    python -m unittest discover -s tests
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import config
+import serial
+from fake_serial_device import FakeSerialDevice
+from serial_bridge import SerialBridge
+from serial_manager import SerialManager
+
+def wait_for(condition, timeout=3.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.02)
+    return True
+
+@unittest.skipUnless(hasattr(os, 'openpty'), '需要pty')
+class SerialBridgeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.device = FakeSerialDevice('FAKE00').start()
+        self.addCleanup(self.device.stop)
+        self.bridge = SerialBridge(self.device.path)
+        self.bridge.start()
+        self.addCleanup(self.bridge.close)
+
+    def lines(self):
+        return [line for _, _, line in self.bridge.recent()]
+
+    def test_reads_unsolicited_lines(self):
+        # start()时的启动信息已被打开串口时的reset_input_buffer()清掉，串口打开后再模拟一次复位
+        self.device.boot()
+        self.device.write('sensor sample 1 temp=23.1\r\nsensor sample 2 temp=23.2\r\n')
+        self.assertTrue(wait_for(lambda: 'sensor sample 2 temp=23.2' in self.lines()))
+        self.assertIn('boot: fake device ready', self.lines())
+
+    def test_command_response(self):
+        self.bridge.wait_idle()
+        result = self.bridge.command('AT+INFO')
+        self.assertEqual(result['complete'], 'match')
+        self.assertIn('device: FAKE00', result['lines'])
+        self.assertEqual(result['lines'][-1], 'OK')
+        self.assertNotIn('AT+INFO', result['lines'])
+
+    def test_unplug_closes_bridge(self):
+        self.device.stop()
+        self.assertTrue(wait_for(lambda: not self.bridge.is_open))
+        with self.assertRaises(serial.SerialException):
+            self.bridge.command('AT')
+
+@unittest.skipUnless(hasattr(os, 'openpty'), '需要pty')
+class SerialManagerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir, True)
+        saved = dict(config.SERIAL_CONFIG)
+        self.addCleanup(config.SERIAL_CONFIG.update, saved)
+        self.links = [os.path.join(self.workdir, f'ttyFAKE{index}') for index in range(2)]
+        config.SERIAL_CONFIG.update(ports=self.links, identify_command='ID', reconnect_min=0.01)
+
+        self.devices = [self.plug(index) for index in range(2)]
+        # 不枚举系统串口，只使用SERIAL_CONFIG['ports']中的模拟设备
+        self.manager = SerialManager(port_source=lambda: [])
+        self.addCleanup(self.manager.stop)
+
+    def plug(self, index):
+        device = FakeSerialDevice(f'FAKE{index:02d}', self.links[index]).start()
+        self.addCleanup(device.stop)
+        return device
+
+    def test_routes_commands_by_device_id(self):
+        self.assertEqual(sorted(self.manager.scan()), sorted(self.links))
+        self.assertEqual(sorted(port['device'] for port in self.manager.devices()), ['FAKE00', 'FAKE01'])
+
+        for device_id in ('FAKE00', 'FAKE01'):
+            result = self.manager.command('AT+INFO', device=device_id)
+            self.assertEqual(result['device'], device_id)
+            self.assertIn(f'device: {device_id}', result['lines'])
+        self.assertEqual(self.devices[1].commands[-1], 'AT+INFO')
+
+    def test_reconnects_after_hot_unplug(self):
+        self.manager.scan()
+        self.devices[0].stop()
+        self.manager.scan()
+        self.assertEqual([port['device'] for port in self.manager.devices()], ['FAKE01'])
+        with self.assertRaises(serial.SerialException):
+            self.manager.get('FAKE00')
+        self.assertEqual(self.manager.disconnects, 1)
+
+        self.devices[0] = self.plug(0)
+        self.manager.scan()
+        self.assertEqual(sorted(port['device'] for port in self.manager.devices()), ['FAKE00', 'FAKE01'])
+        result = self.manager.command('AT', device='FAKE00')
+        self.assertEqual(result['lines'], ['OK'])
+        self.assertEqual(self.manager.connects, 3)
+
+if __name__ == '__main__':
+    unittest.main()
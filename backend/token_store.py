@@ -0,0 +1,145 @@
+import heapq
+import json
+import secrets
+import threading
+import time
+from config import AUTH_CONFIG
+from database import get_connection, write_connection
+
+class MemoryTokenStore:
+    """进程内令牌存储
+
+    令牌带过期时间，过期令牌在读取时视为无效，并由最小堆按过期时间惰性清理；
+    令牌总数有上限，超出时淘汰最早过期的令牌。校验令牌只做一次字典查找，不加锁。
+    """
+
+    def __init__(self, ttl=None, max_tokens=None, sweep_interval=None):
+        self.ttl = ttl or AUTH_CONFIG['token_ttl']
+        self.max_tokens = max_tokens or AUTH_CONFIG['max_tokens']
+        self.sweep_interval = sweep_interval or AUTH_CONFIG['sweep_interval']
+        self._tokens = {}           # 令牌 -> (过期时间, 用户信息)
+        self._expiry_heap = []      # (过期时间, 令牌)，令牌被注销后留下的旧条目在清理时跳过
+        self._lock = threading.Lock()
+        self._next_sweep = 0
+
+    def issue(self, user):
+        """签发新令牌"""
+        token = secrets.token_urlsafe(32)
+        now = time.time()
+        expires_at = now + self.ttl
+        with self._lock:
+            if now >= self._next_sweep:
+                self._sweep(now)
+            while len(self._tokens) >= self.max_tokens and self._expiry_heap:
+                self._evict_one()
+            self._tokens[token] = (expires_at, user)
+            heapq.heappush(self._expiry_heap, (expires_at, token))
+        return token
+
+    def get(self, token):
+        """返回令牌对应的用户信息，无效或已过期返回None"""
+        entry = self._tokens.get(token)
+        if entry is None or entry[0] <= time.time():
+            return None
+        return entry[1]
+
+    def revoke(self, token):
+        """注销令牌"""
+        self._tokens.pop(token, None)
+
+    def sweep(self):
+        """立即清理所有过期令牌，返回清理数量"""
+        with self._lock:
+            return self._sweep(time.time())
+
+    def __len__(self):
+        return len(self._tokens)
+
+    def _evict_one(self):
+        """淘汰堆顶（最早过期）的令牌"""
+        expires_at, token = heapq.heappop(self._expiry_heap)
+        entry = self._tokens.get(token)
+        if entry is not None and entry[0] == expires_at:
+            del self._tokens[token]
+
+    def _sweep(self, now):
+        removed = 0
+        heap = self._expiry_heap
+        while heap and heap[0][0] <= now:
+            expires_at, token = heapq.heappop(heap)
+            entry = self._tokens.get(token)
+            if entry is not None and entry[0] == expires_at:
+                del self._tokens[token]
+                removed += 1
+        # 注销留下的旧条目过多时重建堆，保证堆大小与令牌数同阶
+        if len(heap) > 2 * len(self._tokens) + 64:
+            self._expiry_heap = [(entry[0], token) for token, entry in self._tokens.items()]
+            heapq.heapify(self._expiry_heap)
+        self._next_sweep = now + self.sweep_interval
+        return removed
+
+class SqliteTokenStore:
+    """基于SQLite的令牌存储，多个Web工作进程共享同一个数据库即可共享登录状态
+
+    校验令牌是一次主键查找；过期令牌在签发新令牌时按sweep_interval分批清理。
+    """
+
+    def __init__(self, ttl=None, max_tokens=None, sweep_interval=None):
+        self.ttl = ttl or AUTH_CONFIG['token_ttl']
+        self.max_tokens = max_tokens or AUTH_CONFIG['max_tokens']
+        self.sweep_interval = sweep_interval or AUTH_CONFIG['sweep_interval']
+        self._next_sweep = 0
+
+    def issue(self, user):
+        """签发新令牌"""
+        token = secrets.token_urlsafe(32)
+        now = time.time()
+        with write_connection() as conn:
+            conn.execute("INSERT INTO auth_tokens (token, user, expires_at) VALUES (?, ?, ?)",
+                         (token, json.dumps(user), now + self.ttl))
+        if now >= self._next_sweep:
+            self._next_sweep = now + self.sweep_interval
+            self.sweep()
+        return token
+
+    def get(self, token):
+        """返回令牌对应的用户信息，无效或已过期返回None"""
+        with get_connection() as conn:
+            row = conn.execute("SELECT user FROM auth_tokens WHERE token = ? AND expires_at > ?",
+                               (token, time.time())).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def revoke(self, token):
+        """注销令牌"""
+        with write_connection() as conn:
+            conn.execute("DELETE FROM auth_tokens WHERE token = ?", (token,))
+
+    def sweep(self, batch_size=1000):
+        """清理过期令牌，并在超出上限时淘汰最早过期的令牌，返回清理数量"""
+        removed = 0
+        while True:
+            with write_connection() as conn:
+                count = conn.execute('''DELETE FROM auth_tokens WHERE token IN
+                                        (SELECT token FROM auth_tokens WHERE expires_at <= ? LIMIT ?)''',
+                                     (time.time(), batch_size)).rowcount
+            removed += count
+            if count < batch_size:
+                break
+        with write_connection() as conn:
+            removed += conn.execute('''DELETE FROM auth_tokens WHERE token IN
+                                       (SELECT token FROM auth_tokens ORDER BY expires_at DESC LIMIT -1 OFFSET ?)''',
+                                    (self.max_tokens,)).rowcount
+        return removed
+
+    def __len__(self):
+        with get_connection() as conn:
+            return conn.execute("SELECT COUNT(*) FROM auth_tokens").fetchone()[0]
+
+def create_token_store(backend=None):
+    """按AUTH_CONFIG['token_backend']创建令牌存储（memory或sqlite）"""
+    backend = backend or AUTH_CONFIG['token_backend']
+    if backend == 'memory':
+        return MemoryTokenStore()
+    if backend == 'sqlite':
+        return SqliteTokenStore()
+    raise ValueError(f"Unknown token backend: {backend}")